@@ -0,0 +1,255 @@
+"""
+merakitools - action_batches.py
+Billy Zoellers
+
+CLI tools for managing Meraki networks based on Typer
+"""
+
+import json
+import time
+from collections import deque
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set
+from meraki.exceptions import APIError
+from rich.progress import Progress
+from merakitools.console import console
+from merakitools.dashboardapi import dashboard
+from merakitools.meraki_helpers import fingerprint, paced
+
+# Dashboard API limits for asynchronous action batches
+MAX_BATCH_ACTIONS = 100
+MAX_RUNNING_BATCHES = 5
+
+# Poll new batches quickly, backing off while a batch keeps running
+POLL_INTERVAL_MIN = 1
+POLL_INTERVAL_MAX = 15
+POLL_BACKOFF = 1.5
+# Give up on a batch that can not be read this many times in a row, or that
+# has not finished after this many seconds
+MAX_POLL_FAILURES = 5
+MAX_BATCH_SECONDS = 3600
+
+
+def action_key(action: Dict) -> str:
+    """
+    Identify an action by its operation, resource and body
+    """
+    return f"{action['operation']} {action['resource']} {fingerprint(action['body'])}"
+
+
+def chunk_actions(actions: List, size: int = MAX_BATCH_ACTIONS) -> Iterator[List]:
+    """
+    Split a list of actions into batch sized chunks
+    """
+    for idx in range(0, len(actions), size):
+        yield actions[idx : idx + size]
+
+
+def load_journal(journal: Optional[Path]) -> Set[str]:
+    """
+    Keys of actions that a previous run completed
+    """
+    if journal is None or not journal.exists():
+        return set()
+
+    completed = set()
+    with open(journal, encoding="utf-8") as file:
+        for line in file:
+            entry = json.loads(line)
+            if entry["status"] == "completed":
+                completed.add(entry["key"])
+    return completed
+
+
+def _write_journal(
+    journal: Optional[Path],
+    actions: List,
+    status: str,
+    batch_id: Optional[str] = None,
+    errors: Optional[List] = None,
+):
+    """
+    Record the outcome of each action
+    """
+    if journal is None:
+        return
+
+    with open(journal, "a", encoding="utf-8") as file:
+        for action in actions:
+            entry = {"key": action_key(action), "status": status, "batch": batch_id}
+            if errors:
+                entry["errors"] = errors
+            file.write(json.dumps(entry) + "\n")
+
+
+def _available_slots(organization_id: str) -> int:
+    """
+    Number of batches that can be started without exceeding the limit of
+    confirmed batches running in the organization
+    """
+    try:
+        pending = dashboard.organizations.getOrganizationActionBatches(
+            organization_id, status="pending"
+        )
+    except APIError:
+        return MAX_RUNNING_BATCHES
+
+    running = len([batch for batch in pending if batch.get("confirmed")])
+    return max(1, MAX_RUNNING_BATCHES - running)
+
+
+def _is_throttled(err: APIError) -> bool:
+    """
+    Whether batch creation failed because too many batches are running
+    """
+    return err.status == 429 or "concurrent" in str(err.message).lower()
+
+
+def submit_action_batches(
+    organization_id: str,
+    actions: List,
+    journal: Optional[Path] = None,
+    isolate_failures: bool = True,
+    description: str = "Running action batches",
+) -> Dict:
+    """
+    Submit actions as chunked action batches, keeping as many batches running
+    in the organization as the API allows and polling each with backoff.
+
+    Action batches are atomic, so a failed batch with isolate_failures is split
+    in half and resubmitted until the failing actions are found; the others
+    are still applied. Actions already completed in the journal are skipped.
+
+    Returns counts of completed, failed and skipped actions, and the errors
+    for each failed action
+    """
+    completed_keys = load_journal(journal)
+    pending = [action for action in actions if action_key(action) not in completed_keys]
+    results = {
+        "completed": 0,
+        "failed": 0,
+        "skipped": len(actions) - len(pending),
+        "errors": [],
+    }
+
+    queue = deque(chunk_actions(pending))
+    running = {}
+    slots = _available_slots(organization_id) if queue else 0
+
+    with Progress(console=console) as progress:
+        task = progress.add_task(description, total=len(pending))
+
+        def completed(batch_actions, batch_id):
+            results["completed"] += len(batch_actions)
+            _write_journal(journal, batch_actions, "completed", batch_id)
+            progress.advance(task, len(batch_actions))
+
+        def failed(batch_actions, errors, batch_id=None, split=True):
+            # Split the batch to find which actions failed
+            if split and isolate_failures and len(batch_actions) > 1:
+                half = len(batch_actions) // 2
+                queue.appendleft(batch_actions[half:])
+                queue.appendleft(batch_actions[:half])
+                return
+
+            results["failed"] += len(batch_actions)
+            for action in batch_actions:
+                results["errors"].append({"action": action, "errors": errors})
+            _write_journal(journal, batch_actions, "failed", batch_id, errors)
+            progress.advance(task, len(batch_actions))
+
+        while queue or running:
+            # Start new batches while there is capacity
+            throttled = False
+            while queue and len(running) < slots:
+                batch_actions = queue.popleft()
+                try:
+                    batch = paced(
+                        dashboard.organizations.createOrganizationActionBatch,
+                        organizationId=organization_id,
+                        actions=batch_actions,
+                        confirmed=True,
+                    )
+                except APIError as err:
+                    if _is_throttled(err):
+                        # Wait for a running batch to finish before retrying
+                        queue.appendleft(batch_actions)
+                        slots = max(1, len(running))
+                        throttled = True
+                        break
+                    failed(batch_actions, [str(err.message)])
+                    continue
+                running[batch["id"]] = {
+                    "batch": batch,
+                    "actions": batch_actions,
+                    "interval": POLL_INTERVAL_MIN,
+                    "poll_at": time.monotonic() + POLL_INTERVAL_MIN,
+                    "deadline": time.monotonic() + MAX_BATCH_SECONDS,
+                    "poll_failures": 0,
+                }
+
+            if not running:
+                # Batches started outside of this run are using all capacity
+                if throttled:
+                    time.sleep(POLL_INTERVAL_MAX)
+                continue
+
+            # Check the batch that is due to be polled next
+            batch_id, state = min(running.items(), key=lambda item: item[1]["poll_at"])
+            status = state["batch"]["status"]
+            if not (status["completed"] or status["failed"]):
+                time.sleep(max(0, state["poll_at"] - time.monotonic()))
+                try:
+                    state["batch"] = paced(
+                        dashboard.organizations.getOrganizationActionBatch,
+                        organizationId=organization_id,
+                        actionBatchId=batch_id,
+                    )
+                    state["poll_failures"] = 0
+                except APIError:
+                    state["poll_failures"] += 1
+                status = state["batch"]["status"]
+
+            if not (status["completed"] or status["failed"]):
+                # A batch that can not be read or never finishes may still be
+                # applied, so it is neither split nor resubmitted
+                if (
+                    state["poll_failures"] >= MAX_POLL_FAILURES
+                    or time.monotonic() >= state["deadline"]
+                ):
+                    del running[batch_id]
+                    failed(state["actions"], ["status unknown"], batch_id, split=False)
+                    continue
+                state["interval"] = min(
+                    state["interval"] * POLL_BACKOFF, POLL_INTERVAL_MAX
+                )
+                state["poll_at"] = time.monotonic() + state["interval"]
+                continue
+
+            del running[batch_id]
+            if status["completed"]:
+                completed(state["actions"], batch_id)
+            else:
+                failed(state["actions"], status.get("errors") or [], batch_id)
+
+    return results
+
+
+def print_batch_results(results: Dict, noun: str = "changes"):
+    """
+    Print a summary of submitted action batches and any failed actions
+    """
+    summary = (
+        f"[green]{results['completed']} {noun} applied[/green],"
+        f" [red]{results['failed']} failed[/red]"
+    )
+    if results["skipped"]:
+        summary += f", {results['skipped']} already completed"
+    console.print(f"{summary}.")
+
+    for failure in results["errors"]:
+        action = failure["action"]
+        console.print(
+            f" [red]{action['operation']} {action['resource']}:"
+            f" {'; '.join(failure['errors']) or 'unknown error'}"
+        )
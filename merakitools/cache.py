@@ -0,0 +1,92 @@
+"""
+merakitools - cache.py
+Billy Zoellers
+
+CLI tools for managing Meraki networks based on Typer
+"""
+
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable
+
+# Location and lifetime of locally cached API data
+CACHE_DIR = Path(
+    os.getenv("MERAKITOOLS_CACHE_DIR", Path.home() / ".cache" / "merakitools")
+)
+CACHE_TTL = int(os.getenv("MERAKITOOLS_CACHE_TTL", "300"))
+
+
+def cache_path(name: str) -> Path:
+    """
+    Path to a file within the cache directory, creating the directory if needed
+    """
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    return CACHE_DIR / re.sub(r"[^\w.-]", "_", name)
+
+
+def cached_value(key: str, ttl: int = CACHE_TTL):
+    """
+    Return a fresh cached result without making any API call, or None
+    """
+    path = cache_path(f"{key}.json")
+    if path.exists() and time.time() - path.stat().st_mtime < ttl:
+        with open(path, encoding="utf-8") as file:
+            return json.load(file)
+    return None
+
+
+def cached(
+    key: str,
+    func: Callable,
+    *args,
+    ttl: int = CACHE_TTL,
+    refresh: bool = False,
+    **kwargs,
+):
+    """
+    Return the result of an API call from the local cache, or make the call
+    and cache the result if there is no fresh copy
+    """
+    if not refresh:
+        data = cached_value(key, ttl=ttl)
+        if data is not None:
+            return data
+
+    data = func(*args, **kwargs)
+    store(key, data)
+    return data
+
+
+def store(key: str, data):
+    """
+    Cache a result, replacing any cached copy
+    """
+    path = cache_path(f"{key}.json")
+
+    # Write to a temporary file first so concurrent readers never see partial data
+    with tempfile.NamedTemporaryFile(
+        "w", dir=path.parent, delete=False, encoding="utf-8"
+    ) as file:
+        json.dump(data, file)
+    os.replace(file.name, path)
+
+
+def invalidate(key: str):
+    """
+    Remove a cached result so the next call is made to the API
+    """
+    cache_path(f"{key}.json").unlink(missing_ok=True)
+
+
+def open_database(name: str) -> sqlite3.Connection:
+    """
+    Open a SQLite database within the cache directory
+    """
+    connection = sqlite3.connect(cache_path(f"{name}.sqlite"))
+    connection.row_factory = sqlite3.Row
+    return connection
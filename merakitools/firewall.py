@@ -0,0 +1,287 @@
+"""
+merakitools - firewall.py
+Billy Zoellers
+
+CLI tools for managing Meraki networks based on Typer
+"""
+
+import ipaddress
+from typing import List, Optional, Tuple
+
+# Addresses at least this large are considered broad, by IP version
+BROAD_SIZE = {4: 2**24, 6: 2**96}
+# Subnets matched by "Local LAN" in SSID rules, unless others are given
+LOCAL_LAN = ["10.0.0.0/8", "172.16.0.0/12", "192.168.0.0/16"]
+
+
+def _parse_addresses(
+    value, local_lan: List[str]
+) -> Tuple[Optional[List[Tuple[int, int, int]]], bool]:
+    """
+    (version, first, last) ranges of a comma separated list of CIDRs, or None
+    for any address, and whether every item could be parsed. VLANs, objects
+    and FQDNs are left out of the ranges
+    """
+    if value is None or str(value).strip().lower() == "any":
+        return None, True
+
+    ranges, exact = [], True
+    for token in str(value).split(","):
+        token = token.strip()
+        networks = local_lan if token.lower() == "local lan" else [token]
+        for network in networks:
+            try:
+                network = ipaddress.ip_network(network, strict=False)
+            except ValueError:
+                exact = False
+                continue
+            ranges.append(
+                (
+                    network.version,
+                    int(network.network_address),
+                    int(network.broadcast_address),
+                )
+            )
+    return ranges, exact
+
+
+def _parse_ports(value) -> Tuple[Optional[List[Tuple[int, int]]], bool]:
+    """
+    (first, last) ranges of a comma separated list of ports and port ranges,
+    or None for any port, and whether every item could be parsed
+    """
+    if value is None or str(value).strip().lower() in ("any", ""):
+        return None, True
+
+    ranges, exact = [], True
+    for token in str(value).split(","):
+        first, _, last = token.strip().partition("-")
+        try:
+            ranges.append((int(first), int(last or first)))
+        except ValueError:
+            exact = False
+    return ranges, exact
+
+
+def _covers(outer, inner) -> bool:
+    """
+    Whether every address or port in inner ranges is within outer ranges
+    """
+    if outer is None:
+        return True
+    if inner is None:
+        return False
+    return all(
+        any(o[:-2] == i[:-2] and o[-2] <= i[-2] and i[-1] <= o[-1] for o in outer)
+        for i in inner
+    )
+
+
+def _intersects(first, second) -> bool:
+    """
+    Whether any address or port is in both ranges
+    """
+    if first is None or second is None:
+        return True
+    return any(
+        f[:-2] == s[:-2] and f[-2] <= s[-1] and s[-2] <= f[-1]
+        for f in first
+        for s in second
+    )
+
+
+def _contains(ranges, value) -> bool:
+    """
+    Whether a (version, address) or (port,) value is within ranges
+    """
+    if ranges is None:
+        return True
+    return any(r[:-2] == value[:-1] and r[-2] <= value[-1] <= r[-1] for r in ranges)
+
+
+class FirewallRule:
+    """
+    An L3 firewall rule compiled to integer address and port ranges
+    """
+
+    def __init__(self, rule: dict, position: int, local_lan: List[str] = LOCAL_LAN):
+        self.rule = rule
+        self.position = position
+        self.policy = rule["policy"].lower()
+        self.protocol = str(rule.get("protocol", "any")).lower()
+        # Fields using VLANs, objects or FQDNs are only partly known
+        self.src, src_exact = _parse_addresses(rule.get("srcCidr"), local_lan)
+        self.src_ports, src_ports_exact = _parse_ports(rule.get("srcPort"))
+        self.dst, dst_exact = _parse_addresses(rule.get("destCidr"), local_lan)
+        self.dst_ports, dst_ports_exact = _parse_ports(rule.get("destPort"))
+        self.exact = src_exact and src_ports_exact and dst_exact and dst_ports_exact
+        self.field_exact = {
+            "src": src_exact,
+            "dst": dst_exact,
+            "dst_ports": dst_ports_exact,
+        }
+
+    def _protocol_covers(self, other) -> bool:
+        """
+        Whether this rule matches every protocol matched by another rule
+        """
+        return self.protocol in ("any", other.protocol)
+
+    def covers(self, other) -> bool:
+        """
+        Whether all traffic matched by another rule is matched by this rule
+        """
+        return (
+            self.exact
+            and other.exact
+            and self._protocol_covers(other)
+            and _covers(self.src, other.src)
+            and _covers(self.src_ports, other.src_ports)
+            and _covers(self.dst, other.dst)
+            and _covers(self.dst_ports, other.dst_ports)
+        )
+
+    def intersects(self, other) -> bool:
+        """
+        Whether some traffic may be matched by both rules
+        """
+        if "any" not in (self.protocol, other.protocol) and (
+            self.protocol != other.protocol
+        ):
+            return False
+        if not (self.exact and other.exact):
+            return True
+        return all(
+            _intersects(mine, theirs)
+            for mine, theirs in (
+                (self.src, other.src),
+                (self.src_ports, other.src_ports),
+                (self.dst, other.dst),
+                (self.dst_ports, other.dst_ports),
+            )
+        )
+
+    def matches(self, src, dst, protocol: str, port: Optional[int]) -> Optional[bool]:
+        """
+        Whether traffic from a source to a destination address and port
+        matches this rule, or None if that can not be determined. A flow
+        without a port may or may not match a rule limited to some ports
+        """
+        if self.protocol not in ("any", protocol):
+            return False
+
+        fields = [
+            ("src", _contains(self.src, (src.version, int(src)))),
+            ("dst", _contains(self.dst, (dst.version, int(dst)))),
+        ]
+        if port is not None:
+            fields.append(("dst_ports", _contains(self.dst_ports, (port,))))
+
+        # Any known field that excludes the traffic rules out a match
+        unknown = False
+        for field, contained in fields:
+            if contained:
+                continue
+            if self.field_exact[field]:
+                return False
+            unknown = True
+
+        # Source ports of a connection are not known
+        if port is None and self.dst_ports is not None:
+            unknown = True
+        if self.src_ports is not None:
+            unknown = True
+        return None if unknown else True
+
+    def is_broad(self) -> bool:
+        """
+        Whether an allow rule permits any protocol and port between very
+        large ranges of addresses
+        """
+        if not self.exact or self.policy != "allow":
+            return False
+        if self.protocol != "any" or self.dst_ports is not None:
+            return False
+        return any(
+            addresses is None
+            or any(
+                last - first + 1 >= BROAD_SIZE[version]
+                for version, first, last in addresses
+            )
+            for addresses in (self.src, self.dst)
+        )
+
+
+def compile_rules(rules: List, local_lan: List[str] = LOCAL_LAN) -> List[FirewallRule]:
+    """
+    Compile a list of L3 firewall rules, in order, matching "Local LAN" to
+    the given subnets
+    """
+    return [
+        FirewallRule(rule, position, local_lan)
+        for position, rule in enumerate(rules, 1)
+    ]
+
+
+def _is_default(rule: FirewallRule, rules: List[FirewallRule]) -> bool:
+    """
+    Whether a rule is the default rule that ends every rule list
+    """
+    return rule is rules[-1] and rule.rule.get("comment") == "Default rule"
+
+
+def analyze_rules(rules: List[FirewallRule]) -> List[Tuple[FirewallRule, str]]:
+    """
+    Find rules that are shadowed by an earlier rule, redundant because an
+    earlier or later rule has the same effect, or overly broad
+    """
+    issues = []
+    for idx, rule in enumerate(rules):
+        if _is_default(rule, rules):
+            continue
+
+        earlier = next((other for other in rules[:idx] if other.covers(rule)), None)
+        if earlier is not None:
+            if earlier.policy != rule.policy:
+                issues.append(
+                    (rule, f"Shadowed by rule {earlier.position}, never matches")
+                )
+            else:
+                issues.append(
+                    (rule, f"Redundant, always matched by rule {earlier.position}")
+                )
+            continue
+
+        # A later rule with the same policy makes this rule redundant if no
+        # rule in between matches any of the same traffic differently
+        if rule.exact:
+            for other in rules[idx + 1 :]:
+                if other.covers(rule):
+                    if other.policy == rule.policy:
+                        issues.append(
+                            (rule, f"Redundant, same effect as rule {other.position}")
+                        )
+                    break
+                if other.policy != rule.policy and other.intersects(rule):
+                    break
+
+        if rule.is_broad():
+            issues.append((rule, "Overly broad allow rule"))
+    return issues
+
+
+def evaluate_rules(
+    rules: List[FirewallRule], src, dst, protocol: str, port: Optional[int]
+) -> Tuple[str, Optional[FirewallRule]]:
+    """
+    Policy of the first rule matching traffic, and the rule. The policy is
+    unknown when a rule that may match can not be evaluated
+    """
+    for rule in rules:
+        matched = rule.matches(src, dst, protocol, port)
+        if matched is None:
+            return "unknown", rule
+        if matched:
+            return rule.policy, rule
+    # Traffic not matched by any rule is allowed
+    return "allow", None
@@ -5,13 +5,27 @@ Billy Zoellers
 CLI tools for managing Meraki networks based on Typer
 """
 
+import csv
+import hashlib
+import json
 import os
-from typing import Optional, List
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, Optional, List, Tuple
 from meraki.exceptions import APIError
 import requests
 import typer
+from merakitools.cache import cached
 from merakitools.console import console
 from merakitools.dashboardapi import dashboard
+from merakitools.types import ExportFormat
+
+# The Dashboard API allows 10 requests per second per organization
+API_CALLS_PER_SECOND = 10
+API_MAX_WORKERS = 8
 
 
 def find_orgs_by_name(org_name: Optional[str]) -> List:
@@ -56,6 +70,35 @@ def find_org_by_name(org_name: str):
     return org
 
 
+def find_orgs_by_names(org_names: List[str]) -> List:
+    """
+    Accepts organization names or IDs, and return the Meraki organizations
+    using a single organization fetch
+    """
+    if len(org_names) == 1:
+        return [find_org_by_name(org_names[0])]
+
+    with console.status("Finding organizations..", spinner="material"):
+        try:
+            orgs = dashboard.organizations.getOrganizations()
+        except APIError as err:
+            console.print(f"{err.message}")
+            raise typer.Abort()
+
+    found = []
+    for org_name in org_names:
+        try:
+            found.append(
+                next(org for org in orgs if org_name in (org["id"], org["name"]))
+            )
+        except StopIteration as exc:
+            console.print(f"Organization [bold]{org_name}[/bold] not found.")
+            raise typer.Abort() from exc
+
+    console.print(f"Organizations: [bold]{', '.join(org['name'] for org in found)}")
+    return found
+
+
 def find_org_id_by_device_serial(serial: str):
     """
     Given a serial, find the organization it belongs to
@@ -89,6 +132,151 @@ def find_network_by_name(org_name: str, net_name: str):
     return net
 
 
+def get_networks(
+    organization_id: str, product_type: Optional[str] = None, refresh: bool = False
+) -> List:
+    """
+    Networks in an organization from the local cache, optionally filtered by
+    product type
+    """
+    networks = cached(
+        f"org-networks-{organization_id}",
+        dashboard.organizations.getOrganizationNetworks,
+        organization_id,
+        total_pages="all",
+        refresh=refresh,
+    )
+    if product_type:
+        networks = [net for net in networks if product_type in net["productTypes"]]
+    return networks
+
+
+def get_device_index(
+    organization_id: str, network_id: Optional[str] = None, refresh: bool = False
+) -> Dict[str, dict]:
+    """
+    Index of serial to device, from one network or organization device fetch
+    """
+    if network_id:
+        devices = cached(
+            f"network-devices-{network_id}",
+            dashboard.networks.getNetworkDevices,
+            network_id,
+            refresh=refresh,
+        )
+    else:
+        devices = cached(
+            f"org-devices-{organization_id}",
+            dashboard.organizations.getOrganizationDevices,
+            organization_id,
+            total_pages="all",
+            refresh=refresh,
+        )
+
+    return {device["serial"]: device for device in devices}
+
+
+def get_switch_stacks(organization_id: str, refresh: bool = False) -> List:
+    """
+    Switch stacks in every switch network of an organization from the local
+    cache, each including the ID of its network
+    """
+
+    def get_org_switch_stacks():
+        networks = get_networks(organization_id, product_type="switch", refresh=refresh)
+        stacks = []
+        for net, net_stacks, err in run_concurrently(
+            lambda net: paced(
+                dashboard.switch.getNetworkSwitchStacks, networkId=net["id"]
+            ),
+            networks,
+        ):
+            # Never cache an incomplete inventory
+            if err:
+                raise err
+            stacks += [{**stack, "networkId": net["id"]} for stack in net_stacks]
+        return stacks
+
+    return cached(
+        f"org-switch-stacks-{organization_id}", get_org_switch_stacks, refresh=refresh
+    )
+
+
+def fingerprint(settings) -> str:
+    """
+    Short, stable hash of a settings object used to group identical configurations
+    """
+    encoded = json.dumps(settings, sort_keys=True, default=str).encode()
+    return hashlib.sha256(encoded).hexdigest()[:12]
+
+
+def settings_diff(
+    expected: Dict, actual: Dict, keys: Optional[Iterable] = None
+) -> Dict[str, Tuple]:
+    """
+    Settings that differ between two objects, as {key: (expected, actual)}.
+    Compares the given keys, or every key found in either object
+    """
+    if keys is None:
+        keys = expected.keys() | actual.keys()
+    return {
+        key: (expected.get(key), actual.get(key))
+        for key in sorted(keys)
+        if expected.get(key) != actual.get(key)
+    }
+
+
+def time_shards(start: datetime, end: datetime, size: timedelta) -> List[Tuple]:
+    """
+    Split a time window into consecutive windows of at most size
+    """
+    shards = []
+    while start < end:
+        shards.append((start, min(start + size, end)))
+        start += size
+    return shards
+
+
+def export_format(output: Path, output_format: Optional[ExportFormat]):
+    """
+    Format of an output file, from its extension when not given
+    """
+    if output_format is not None:
+        return output_format
+    if output.suffix.lower() in (".ndjson", ".jsonl"):
+        return ExportFormat.ndjson
+    return ExportFormat.csv
+
+
+def record_writer(
+    file,
+    output_format: ExportFormat,
+    columns: List[str],
+    csv_row: Optional[Callable[[Dict], Dict]] = None,
+) -> Callable[[Dict], None]:
+    """
+    Function writing one record at a time to a file, as NDJSON or as CSV
+    columns, optionally taken from csv_row of each record
+    """
+    if output_format == ExportFormat.ndjson:
+        return lambda record: file.write(json.dumps(record) + "\n")
+
+    writer = csv.DictWriter(file, fieldnames=columns, extrasaction="ignore")
+    writer.writeheader()
+    if csv_row is None:
+        return writer.writerow
+    return lambda record: writer.writerow(csv_row(record))
+
+
+def api_error_text(err: APIError) -> str:
+    """
+    Readable errors from an API error
+    """
+    if isinstance(err.message, dict):
+        return "; ".join(err.message.get("errors", []))
+    return str(err.message)
+
+
 def api_req(resource: str, method: str = "GET", **kwargs):
     """
     API request outside of the Meraki Python SDK
@@ -108,3 +296,57 @@ def api_req(resource: str, method: str = "GET", **kwargs):
         return resp.json()
 
     return {}
+
+
+class _Pacer:
+    """
+    Space out API calls made from multiple threads
+    """
+
+    def __init__(self, calls_per_second: float):
+        self.interval = 1 / calls_per_second
+        self.next_call = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """
+        Block until the next call slot is available
+        """
+        with self.lock:
+            now = time.monotonic()
+            call_at = max(now, self.next_call)
+            self.next_call = call_at + self.interval
+        if call_at > now:
+            time.sleep(call_at - now)
+
+
+_pacer = _Pacer(API_CALLS_PER_SECOND)
+
+
+def paced(func: Callable, *args, **kwargs):
+    """
+    Call a Dashboard API method, pacing calls shared across all threads
+    """
+    _pacer.wait()
+    return func(*args, **kwargs)
+
+
+def run_concurrently(
+    func: Callable, items: Iterable, max_workers: int = API_MAX_WORKERS
+) -> Iterator[Tuple]:
+    """
+    Run func for each item in a thread pool, yielding (item, result, error)
+    as each call completes. API errors are yielded instead of raised
+    """
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        futures = {executor.submit(func, item): item for item in items}
+        for future in as_completed(futures):
+            # Release each result once it is yielded, so large results are not held
+            item = futures.pop(future)
+            try:
+                yield item, future.result(), None
+            except APIError as err:
+                yield item, None, err
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -5,13 +5,32 @@ Billy Zoellers
 CLI tools for managing Meraki networks based on Typer
 """
 
-from typing import Optional
+import csv
+import json
+import re
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import List, Optional
 from meraki.exceptions import APIError
+from rich.live import Live
+from rich.progress import Progress
 from rich.prompt import Confirm
 import typer
+from merakitools.action_batches import print_batch_results, submit_action_batches
 from merakitools.console import console, status_spinner
 from merakitools.dashboardapi import dashboard
-from merakitools.meraki_helpers import find_network_by_name
+from merakitools.meraki_helpers import (
+    export_format,
+    find_network_by_name,
+    find_org_by_name,
+    fingerprint,
+    get_device_index,
+    get_networks,
+    paced,
+    record_writer,
+    run_concurrently,
+    settings_diff,
+)
 from merakitools.formatting_helpers import table_with_columns, camel_case_split
 from merakitools.types import (
     DeviceModel,
@@ -21,10 +40,27 @@ from merakitools.types import (
     MRSSIDEncryptionMode,
     MRSSIDWPAEncrytionMode,
     FirewallPolicyOption,
+    ExportFormat,
 )
 
 app = typer.Typer()
 
+# SSID settings that differ between networks by design
+SSID_IGNORED_KEYS = ("adminSplashUrl",)
+
+# RF profile settings that identify a profile rather than configure it
+RF_PROFILE_IGNORED_KEYS = (
+    "id",
+    "networkId",
+    "name",
+    "isIndoorDefault",
+    "isOutdoorDefault",
+)
+
+# Columns of exported SSID and RF profile variant use
+SSID_VARIANT_COLUMNS = ["variant", "network", "matches"]
+RF_PROFILE_COLUMNS = ["variant", "network", "profile"]
+
 
 @app.command()
 def list_ssid(
@@ -91,46 +127,49 @@ def list_rf(organization_name: str, network_name: str):
         console.print(f"This network does not contain any MR devices")
         raise typer.Abort()
 
-    # Maintain a dict of RF profiles
-    rf_profiles = {}
-
-    # Get list of all wireless devices
     with status_spinner("Getting devices"):
         # Get sorted list of MR devices
         devices = dashboard.networks.getNetworkDevices(net["id"])
         devices = [device for device in devices if DeviceModel.MR in device["model"]]
         devices = sorted(devices, key=lambda k: k["name"], reverse=False)
 
-        # Create a table of MR devices with RF info from API
-        table = table_with_columns(
-            [
-                "RF Profile",
-                "2.4Ghz Manual Settings",
-                "2.4Ghz Actual",
-                "5Ghz Manual Settings",
-                "5Ghz Actual",
-            ],
-            title=f"RF Settings for {net['name']}",
-            first_column_name="AP Name",
-        )
-        for device in devices:
-            # Get RF settings and current status
-            device_rf = dashboard.wireless.getDeviceWirelessRadioSettings(
-                serial=device["serial"]
-            )
-            device_status = dashboard.wireless.getDeviceWirelessStatus(
-                serial=device["serial"]
+        # Get all RF profiles up front, indexed by ID
+        rf_profiles = {
+            profile["id"]: profile
+            for profile in dashboard.wireless.getNetworkWirelessRfProfiles(
+                net["id"], includeTemplateProfiles=True
             )
+        }
+
+    # Create a table of MR devices with RF info from API
+    table = table_with_columns(
+        [
+            "RF Profile",
+            "2.4Ghz Manual Settings",
+            "2.4Ghz Actual",
+            "5Ghz Manual Settings",
+            "5Ghz Actual",
+        ],
+        title=f"RF Settings for {net['name']}",
+        first_column_name="AP Name",
+    )
+
+    # Add a row for each AP as its RF settings and status are returned
+    with Live(table, console=console):
+        for device, result, err in run_concurrently(_get_device_rf, devices):
+            if err:
+                table.add_row(device["name"], "[red]Unable to get RF settings")
+                continue
+            device_rf, device_status = result
 
-            # Get RF profile from stored data or API
+            # Get RF profile name from prefetched profiles
             rf_profile_id = device_rf.get("rfProfileId")
             if rf_profile_id:
-                if rf_profile_id not in rf_profiles:
-                    rf_profiles[rf_profile_id] = (
-                        dashboard.wireless.getNetworkWirelessRfProfile(
-                            net["id"], rf_profile_id
-                        )
-                    )
+                rf_profile_name = rf_profiles.get(rf_profile_id, {}).get(
+                    "name", rf_profile_id
+                )
+            else:
+                rf_profile_name = "None"
 
             # Get first SSID on each band for actual status info
             try:
@@ -180,7 +219,7 @@ def list_rf(organization_name: str, network_name: str):
 
             table.add_row(
                 device["name"],
-                rf_profiles[rf_profile_id]["name"] if rf_profile_id else "None",
+                rf_profile_name,
                 " / ".join(twoFourGhzSettings),
                 (
                     f"ch {twoFour_status['channel']} / {twoFour_status['power']}"
@@ -194,7 +233,19 @@ def list_rf(organization_name: str, network_name: str):
                     else "Not broadcasting"
                 ),
             )
-    console.print(table)
+
+
+def _get_device_rf(device):
+    """
+    Get RF settings and current status for an AP
+    """
+    device_rf = paced(
+        dashboard.wireless.getDeviceWirelessRadioSettings, serial=device["serial"]
+    )
+    device_status = paced(
+        dashboard.wireless.getDeviceWirelessStatus, serial=device["serial"]
+    )
+    return device_rf, device_status
 
 
 @app.command()
@@ -279,7 +330,133 @@ def list_rf_profiles(organization_name: str, network_name: str):
 
 
 @app.command()
-def list_mesh(organization_name: str, network_name: str):
+def audit_rf_profiles(
+    organization_name: str,
+    refresh: bool = typer.Option(False, help="Ignore cached network data"),
+    output: Optional[Path] = typer.Option(
+        None, dir_okay=False, help="Write every network using each variant to a file"
+    ),
+    output_format: Optional[ExportFormat] = typer.Option(
+        None, help="Format of --output, defaults to the file extension"
+    ),
+):
+    """
+    Group RF profiles from all wireless networks and templates in an
+    organization by identical settings
+    """
+    org = find_org_by_name(organization_name)
+    with status_spinner("Getting networks and templates"):
+        sources = [
+            {"id": net["id"], "name": net["name"]}
+            for net in get_networks(
+                org["id"], product_type=ProductType.wireless, refresh=refresh
+            )
+        ]
+        sources += [
+            {"id": template["id"], "name": f"{template['name']} (template)"}
+            for template in dashboard.organizations.getOrganizationConfigTemplates(
+                org["id"]
+            )
+            if ProductType.wireless in template["productTypes"]
+        ]
+
+    # Get RF profiles from every network and template, grouped by settings
+    variants = defaultdict(list)
+    profile_count = 0
+    with Progress(console=console) as progress:
+        task = progress.add_task("Getting RF profiles", total=len(sources))
+        for source, profiles, err in run_concurrently(_get_rf_profiles, sources):
+            progress.advance(task)
+            if err:
+                console.print(f"[red]Unable to get RF profiles for {source['name']}")
+                continue
+            for profile in profiles:
+                profile_count += 1
+                variant = fingerprint(_normalize_rf_profile(profile))
+                variants[variant].append((profile["name"], source["name"]))
+
+    if not variants:
+        console.print("No RF Profiles found")
+        raise typer.Exit()
+
+    # Create a table of RF profile variants, most used first
+    table = table_with_columns(
+        ["Profile Names", "Networks", "Count"],
+        title=f"RF profile variants in {org['name']}",
+        first_column_name="Variant",
+    )
+    for variant, uses in sorted(
+        variants.items(), key=lambda k: len(k[1]), reverse=True
+    ):
+        profile_names = sorted({profile_name for profile_name, _ in uses})
+        net_names = sorted({net_name for _, net_name in uses})
+        table.add_row(
+            variant,
+            ", ".join(profile_names),
+            ", ".join(net_names[:5])
+            + (f" +{len(net_names) - 5} more" if len(net_names) > 5 else ""),
+            str(len(uses)),
+        )
+    console.print(table)
+    console.print(
+        f"[bold]{profile_count}[/bold] RF profiles in {len(sources)} networks and"
+        f" templates have [bold]{len(variants)}[/bold] distinct configurations."
+    )
+
+    if output:
+        with open(output, "w", encoding="utf-8", newline="") as file:
+            write_use = record_writer(
+                file, export_format(output, output_format), RF_PROFILE_COLUMNS
+            )
+            for variant, uses in variants.items():
+                for profile_name, net_name in sorted(uses, key=lambda k: (k[1], k[0])):
+                    write_use(
+                        {
+                            "variant": variant,
+                            "network": net_name,
+                            "profile": profile_name,
+                        }
+                    )
+        console.print(f"Wrote networks using each variant to {output}.")
+
+
+def _get_rf_profiles(source):
+    """
+    Get RF profiles for a network or template
+    """
+    return paced(dashboard.wireless.getNetworkWirelessRfProfiles, source["id"])
+
+
+def _normalize_rf_profile(profile):
+    """
+    Normalize RF profile settings so identical profiles compare equal,
+    regardless of name or where they are defined
+    """
+    profile = {
+        key: value
+        for key, value in profile.items()
+        if key not in RF_PROFILE_IGNORED_KEYS
+    }
+    for band in ("twoFourGhzSettings", "fiveGhzSettings", "sixGhzSettings"):
+        if "validAutoChannels" in (profile.get(band) or {}):
+            profile[band] = profile[band] | {
+                "validAutoChannels": sorted(profile[band]["validAutoChannels"])
+            }
+    return profile
+
+
+@app.command()
+def list_mesh(
+    organization_name: str,
+    network_name: str,
+    org_devices: bool = typer.Option(
+        False, help="Resolve AP names from all devices in the organization"
+    ),
+    stats: bool = typer.Option(
+        False, help="Include mesh depth and bottleneck hop statistics"
+    ),
+    refresh: bool = typer.Option(False, help="Ignore cached device data"),
+):
     """
     List mesh status for a network
     """
@@ -289,46 +466,83 @@ def list_mesh(organization_name: str, network_name: str):
         console.print(f"This network does not contain any MR devices")
         raise typer.Abort()
 
-    # Get network mesh status
+    # Get network mesh status and an index of devices to resolve names
     with status_spinner("Getting mesh status"):
         try:
             mesh = dashboard.wireless.getNetworkWirelessMeshStatuses(net["id"])
         except APIError as err:
             console.print(f"[bold]{err.message['errors'][0]}")
             raise typer.Abort()
+        devices = get_device_index(
+            net["organizationId"],
+            network_id=None if org_devices else net["id"],
+            refresh=refresh,
+        )
 
-    # Maintain a dict of mesh device info
-    devices = {}
+    def device_name(serial):
+        return devices.get(serial, {}).get("name") or serial
+
+    # Index mesh performance by serial to find the bottleneck hop of each route
+    mbps = {ap["serial"]: ap["latestMeshPerformance"]["mbps"] for ap in mesh}
 
     # Create a table of mesh devices and routes
+    columns = ["Mesh Route", "Mbps", "Metric", "Usage"]
+    if stats:
+        columns += ["Hops", "Bottleneck"]
     table = table_with_columns(
-        ["Mesh Route", "Mbps", "Metric", "Usage"],
+        columns,
         title=f"Mesh Status for {net['name']}",
         first_column_name="AP Name",
     )
+    depths = Counter()
+    bottlenecks = Counter()
     for ap in mesh:
-        mesh_route = ""
-        # Iterate through each item in the mesh route
-        for idx, serial in enumerate(ap["meshRoute"]):
-            # Get device data for new serials
-            if serial not in devices:
-                devices[serial] = dashboard.devices.getDevice(serial)
-
-            # Add mesh name to mesh route
-            last_item = idx == len(ap["meshRoute"]) - 1
-            mesh_route += f"[bold]{devices[serial]['name']}[/bold]"
-            if not last_item:
-                mesh_route += " -> "
-
-        table.add_row(
-            devices[ap["serial"]]["name"],
+        route = ap["meshRoute"]
+        mesh_route = " -> ".join(
+            f"[bold]{device_name(serial)}[/bold]" for serial in route
+        )
+        row = [
+            device_name(ap["serial"]),
             mesh_route,
             f"{ap['latestMeshPerformance']['mbps']}Mbps",
             str(ap["latestMeshPerformance"]["metric"]),
             ap["latestMeshPerformance"]["usagePercentage"],
-        )
+        ]
+
+        if stats:
+            # Each repeater in the route contributes one hop toward the gateway
+            hops = [serial for serial in route if mbps.get(serial) is not None]
+            depths[len(hops)] += 1
+            if hops:
+                bottleneck = min(hops, key=lambda serial: mbps[serial])
+                bottlenecks[bottleneck] += 1
+                row += [
+                    str(len(hops)),
+                    f"{device_name(bottleneck)} ({mbps[bottleneck]}Mbps)",
+                ]
+            else:
+                row += ["0", ""]
+
+        table.add_row(*row)
     console.print(table)
 
+    if stats and mesh:
+        total_hops = sum(depth * count for depth, count in depths.items())
+        console.print(
+            f"Mesh depth: max [bold]{max(depths)}[/bold] hops, average"
+            f" [bold]{total_hops / len(mesh):.1f}[/bold] hops"
+        )
+        for depth, count in sorted(depths.items()):
+            console.print(f" {depth} hop(s): {count} APs")
+
+        if bottlenecks:
+            console.print("Most common bottleneck hops:")
+            for serial, count in bottlenecks.most_common(5):
+                console.print(
+                    f" [bold]{device_name(serial)}[/bold] ({mbps[serial]}Mbps)"
+                    f" limits {count} route(s)"
+                )
+
 
 @app.command()
 def show_ssid(
@@ -350,6 +564,196 @@ def show_ssid(
     console.print(ssid)
 
 
+@app.command()
+def audit_ssid(
+    organization_name: str,
+    ssid_name: Optional[str] = typer.Option(None, help="Audit the SSID with this name"),
+    ssid_number: Optional[int] = typer.Option(
+        None, help="Audit the SSID with this number", min=0, max=15
+    ),
+    reference_network: Optional[str] = typer.Option(
+        None, help="Report drift against the SSID on this network"
+    ),
+    spec: Optional[Path] = typer.Option(
+        None,
+        help="Report drift against SSID settings in a JSON file",
+        exists=True,
+        dir_okay=False,
+    ),
+    include_psk: bool = False,
+    refresh: bool = typer.Option(False, help="Ignore cached network data"),
+    output: Optional[Path] = typer.Option(
+        None, dir_okay=False, help="Write every network using each variant to a file"
+    ),
+    output_format: Optional[ExportFormat] = typer.Option(
+        None, help="Format of --output, defaults to the file extension"
+    ),
+):
+    """
+    Audit an SSID across all wireless networks in an organization, grouping
+    networks with identical settings and reporting drift
+    """
+    if ssid_name is None and ssid_number is None:
+        console.print("Specify an SSID with --ssid-name and/or --ssid-number")
+        raise typer.Abort()
+
+    org = find_org_by_name(organization_name)
+    with status_spinner("Getting networks"):
+        networks = get_networks(
+            org["id"], product_type=ProductType.wireless, refresh=refresh
+        )
+    console.print(f"Found [bold]{len(networks)}[/bold] wireless networks.")
+
+    # Get SSIDs for every wireless network, keeping the audited SSID
+    configs = {}
+    missing = []
+    with Progress(console=console) as progress:
+        task = progress.add_task("Getting SSIDs", total=len(networks))
+        for net, ssids, err in run_concurrently(_get_network_ssids, networks):
+            progress.advance(task)
+            if err:
+                console.print(f"[red]Unable to get SSIDs for {net['name']}")
+                continue
+            ssid = next(
+                (
+                    ssid
+                    for ssid in ssids
+                    if (ssid_number is None or ssid["number"] == ssid_number)
+                    and (ssid_name is None or ssid["name"] == ssid_name)
+                ),
+                None,
+            )
+            if ssid is None:
+                missing.append(net["name"])
+                continue
+            configs[net["name"]] = _normalize_ssid(ssid)
+
+    if not configs:
+        console.print("SSID not found on any network.")
+        raise typer.Exit()
+
+    # Group networks by identical SSID configuration
+    variants = defaultdict(list)
+    for net_name, config in configs.items():
+        variants[fingerprint(config)].append(net_name)
+
+    # Find the expected configuration to compare each network against
+    if spec:
+        with open(spec, encoding="utf-8") as file:
+            expected = _normalize_ssid(json.load(file))
+        keys = expected.keys()
+        baseline = f"spec {spec.name}"
+    elif reference_network:
+        if reference_network not in configs:
+            console.print(f"SSID not found on network {reference_network}.")
+            raise typer.Abort()
+        expected = configs[reference_network]
+        keys = None
+        baseline = f"network {reference_network}"
+    else:
+        most_common = max(variants.values(), key=len)
+        expected = configs[most_common[0]]
+        keys = None
+        baseline = "the most common configuration"
+
+    # Create a table of configuration variants
+    table = table_with_columns(
+        ["Networks", "Count", "Matches"],
+        title=f"SSID variants in {org['name']}",
+        first_column_name="Variant",
+    )
+    matching = {}
+    for variant, net_names in sorted(
+        variants.items(), key=lambda k: len(k[1]), reverse=True
+    ):
+        matches = not settings_diff(expected, configs[net_names[0]], keys)
+        matching[variant] = matches
+        table.add_row(
+            variant,
+            ", ".join(sorted(net_names)[:5])
+            + (f" +{len(net_names) - 5} more" if len(net_names) > 5 else ""),
+            str(len(net_names)),
+            "[green]Yes" if matches else "[red]No",
+        )
+    console.print(table)
+
+    # Create a table of settings that drift from the expected configuration
+    table = table_with_columns(
+        ["Setting", "Expected", "Actual"],
+        title=f"Drift from {baseline}",
+        first_column_name="Network",
+    )
+    drifted = 0
+    for net_name in sorted(configs):
+        diff = settings_diff(expected, configs[net_name], keys)
+        if diff:
+            drifted += 1
+        for idx, (key, values) in enumerate(diff.items()):
+            table.add_row(
+                net_name if idx == 0 else "",
+                key,
+                *[_format_ssid_value(key, value, include_psk) for value in values],
+                end_section=idx == len(diff) - 1,
+            )
+    if drifted:
+        console.print(table)
+
+    console.print(
+        f"[green]{len(configs) - drifted} networks match[/green],"
+        f" [red]{drifted} networks drift[/red] from {baseline}."
+    )
+    if missing:
+        console.print(
+            f"SSID not found on {len(missing)} networks: {', '.join(missing)}"
+        )
+
+    if output:
+        with open(output, "w", encoding="utf-8", newline="") as file:
+            write_use = record_writer(
+                file, export_format(output, output_format), SSID_VARIANT_COLUMNS
+            )
+            for variant, net_names in variants.items():
+                for net_name in sorted(net_names):
+                    write_use(
+                        {
+                            "variant": variant,
+                            "network": net_name,
+                            "matches": matching[variant],
+                        }
+                    )
+        console.print(f"Wrote networks using each variant to {output}.")
+
+
+def _get_network_ssids(net):
+    """
+    Get all SSIDs for a network
+    """
+    return paced(dashboard.wireless.getNetworkWirelessSsids, net["id"])
+
+
+def _normalize_ssid(ssid):
+    """
+    Normalize SSID settings so identical configurations compare equal
+    """
+    ssid = {key: value for key, value in ssid.items() if key not in SSID_IGNORED_KEYS}
+    if "availabilityTags" in ssid:
+        ssid["availabilityTags"] = sorted(ssid["availabilityTags"])
+    return ssid
+
+
+def _format_ssid_value(key, value, include_psk=False):
+    """
+    Readable SSID setting value, redacting pre-shared keys
+    """
+    if value is None:
+        return "[i]not set"
+    if key == "psk" and not include_psk:
+        return "<redacted>"
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return str(value)
+
+
 @app.command()
 def update_ssid(
     organization_name: str,
@@ -393,15 +797,7 @@ def update_ssid(
     """
     net = find_network_by_name(organization_name, network_name)
     with status_spinner("Getting SSIDs"):
-        ssid = dashboard.wireless.getNetworkWirelessSsid(
-            networkId=net["id"], number=ssid_number
-        )
-        local_lan_rule = (
-            dashboard.wireless.getNetworkWirelessSsidFirewallL3FirewallRules(
-                networkId=net["id"],
-                number=ssid_number,
-            )["rules"][0]
-        )
+        ssid, local_lan_rule = _get_ssid_and_lan_rule(net, ssid_number)
 
     # Confirm SSID name with user before continuing
     if confirm:
@@ -413,9 +809,258 @@ def update_ssid(
         if not confirmed:
             raise typer.Abort()
 
-    # Enumerate changed values for SSID
-    update_ssid = {}
-    items = {
+    # Enumerate changed values for SSID and Local LAN FW
+    update_ssid, update_lan_fw = _ssid_changes(
+        ssid,
+        local_lan_rule,
+        _ssid_settings(
+            name=name,
+            enabled=enabled,
+            tag_vlan=tag_vlan,
+            default_vlan_id=default_vlan_id,
+            auth_mode=auth_mode,
+            encryption_mode=encryption_mode,
+            wpa_encryption_mode=wpa_encryption_mode,
+            min_bitrate=min_bitrate,
+            pre_shared_key=pre_shared_key,
+            ip_assignment_mode=ip_assignment_mode,
+        ),
+        local_lan_access,
+    )
+
+    # Do not call API if no changes were made
+    with status_spinner("Updating SSID"):
+        changed = False
+        if update_ssid:
+            changed = True
+            ssid = dashboard.wireless.updateNetworkWirelessSsid(
+                networkId=net["id"], number=ssid_number, **update_ssid
+            )
+
+        if update_lan_fw:
+            changed = True
+            local_lan_rule = (
+                dashboard.wireless.updateNetworkWirelessSsidFirewallL3FirewallRules(
+                    networkId=net["id"], number=ssid_number, **update_lan_fw
+                )
+            )
+    if not changed:
+        console.print(f"[bold green]No settings changed.")
+        raise typer.Exit()
+
+    console.print(f"[bold green]SSID '{ssid['name']}' has been updated.")
+    console.print(
+        " The following parameters were updated:"
+        f" {', '.join(update_ssid | update_lan_fw)}"
+    )
+
+
+@app.command()
+def bulk_update_ssid(
+    organization_name: str,
+    ssid_number: int = typer.Argument(..., help="The SSID number", min=0, max=15),
+    network_tag: Optional[List[str]] = typer.Option(
+        None, help="Update networks with this tag", rich_help_panel="Networks"
+    ),
+    network_name: Optional[str] = typer.Option(
+        None,
+        help="Update networks with names matching this regular expression",
+        rich_help_panel="Networks",
+    ),
+    psk_file: Optional[Path] = typer.Option(
+        None,
+        help="CSV file of network name and pre-shared key, one network per line",
+        exists=True,
+        dir_okay=False,
+    ),
+    journal: Optional[Path] = typer.Option(
+        None, help="Record progress to this file, and skip completed changes"
+    ),
+    dry_run: bool = typer.Option(False, help="Show planned changes only"),
+    confirm: bool = typer.Option(True, help="Confirm before applying changes"),
+    enabled: Optional[bool] = typer.Option(
+        None, help="Whether or not the SSID is enabled"
+    ),
+    name: Optional[str] = typer.Option(None, help="The name of the SSID"),
+    auth_mode: Optional[MRSSIDAuthMode] = typer.Option(
+        None, help="The association control method for the SSID"
+    ),
+    encryption_mode: Optional[MRSSIDEncryptionMode] = typer.Option(
+        None, help="The PSK encryption mode for the SSID"
+    ),
+    wpa_encryption_mode: Optional[MRSSIDWPAEncrytionMode] = typer.Option(
+        None, help="The types of WPA encryption"
+    ),
+    tag_vlan: Optional[bool] = typer.Option(
+        None, help="Whether or not traffic should be directed to use specific VLANs"
+    ),
+    default_vlan_id: Optional[int] = typer.Option(
+        None, help="The default VLAN ID used for 'all other APs'", min=1, max=4094
+    ),
+    pre_shared_key: Optional[str] = typer.Option(None, help="The passkey for the SSID"),
+    min_bitrate: Optional[int] = typer.Option(
+        None, help="The minimum bitrate in Mbps", min=1, max=54
+    ),
+    ip_assignment_mode: Optional[MRSSIDIPAssignmentMode] = typer.Option(
+        None, help="The client IP assignment mode"
+    ),
+    local_lan_access: Optional[FirewallPolicyOption] = typer.Option(
+        None, help="Policy for wireless clients accessing the Local LAN"
+    ),
+):
+    """
+    Update an SSID on many networks using action batches, only changing
+    settings that differ
+    """
+    if not network_tag and network_name is None:
+        console.print("Select networks with --network-tag and/or --network-name")
+        raise typer.Abort()
+    try:
+        name_pattern = re.compile(network_name) if network_name is not None else None
+    except re.error as err:
+        console.print(f"[red]Invalid --network-name expression: {err}")
+        raise typer.Abort()
+
+    # Read per network pre-shared keys
+    psks = {}
+    if psk_file:
+        with open(psk_file, newline="", encoding="utf-8") as file:
+            psks = {row[0]: row[1] for row in csv.reader(file) if row}
+
+    # Find networks matching the selectors
+    org = find_org_by_name(organization_name)
+    with status_spinner("Getting networks"):
+        networks = get_networks(org["id"], product_type=ProductType.wireless)
+    if network_tag:
+        networks = [
+            net for net in networks if any(tag in net["tags"] for tag in network_tag)
+        ]
+    if name_pattern is not None:
+        networks = [net for net in networks if name_pattern.search(net["name"])]
+    console.print(f"Found [bold]{len(networks)}[/bold] matching wireless networks.")
+    if not networks:
+        raise typer.Abort()
+
+    # Keys for networks outside of the selection would be silently skipped
+    unmatched = sorted(set(psks) - {net["name"] for net in networks})
+    if unmatched:
+        console.print(
+            f"[yellow]{len(unmatched)} networks in {psk_file} are not in the"
+            f" selected networks and will not be changed: {', '.join(unmatched)}"
+        )
+
+    settings = _ssid_settings(
+        name=name,
+        enabled=enabled,
+        tag_vlan=tag_vlan,
+        default_vlan_id=default_vlan_id,
+        auth_mode=auth_mode,
+        encryption_mode=encryption_mode,
+        wpa_encryption_mode=wpa_encryption_mode,
+        min_bitrate=min_bitrate,
+        pre_shared_key=pre_shared_key,
+        ip_assignment_mode=ip_assignment_mode,
+    )
+
+    # Get the current SSID and Local LAN rule on each network, and compare
+    actions = []
+    table = table_with_columns(
+        ["SSID", "Changes"],
+        title=f"Planned changes to SSID {ssid_number}",
+        first_column_name="Network",
+    )
+    with Progress(console=console) as progress:
+        task = progress.add_task("Getting SSIDs", total=len(networks))
+        for net, result, err in run_concurrently(
+            lambda net: _get_ssid_and_lan_rule(net, ssid_number),
+            networks,
+        ):
+            progress.advance(task)
+            if err:
+                console.print(f"[red]Unable to get SSID for {net['name']}")
+                continue
+            ssid, local_lan_rule = result
+
+            net_settings = settings
+            if net["name"] in psks:
+                net_settings = settings | {"psk": psks[net["name"]]}
+            update_ssid, update_lan_fw = _ssid_changes(
+                ssid, local_lan_rule, net_settings, local_lan_access
+            )
+
+            # Create actions for changed settings only
+            if update_ssid:
+                actions.append(
+                    dashboard.batch.wireless.updateNetworkWirelessSsid(
+                        networkId=net["id"], number=ssid_number, **update_ssid
+                    )
+                )
+            if update_lan_fw:
+                actions.append(
+                    dashboard.batch.wireless.updateNetworkWirelessSsidFirewallL3FirewallRules(
+                        networkId=net["id"], number=ssid_number, **update_lan_fw
+                    )
+                )
+            if update_ssid or update_lan_fw:
+                table.add_row(
+                    net["name"], ssid["name"], ", ".join(update_ssid | update_lan_fw)
+                )
+
+    if not actions:
+        console.print(f"[bold green]No settings changed.")
+        raise typer.Exit()
+    console.print(table)
+
+    if dry_run:
+        raise typer.Exit()
+    if confirm:
+        confirmed = Confirm.ask(
+            f"Apply {len(actions)} changes to {table.row_count} networks?",
+            console=console,
+        )
+        if not confirmed:
+            raise typer.Abort()
+
+    results = submit_action_batches(org["id"], actions, journal=journal)
+    print_batch_results(results)
+
+
+def _get_ssid_and_lan_rule(net, ssid_number):
+    """
+    Get an SSID and its Local LAN firewall rule
+    """
+    ssid = paced(
+        dashboard.wireless.getNetworkWirelessSsid,
+        networkId=net["id"],
+        number=ssid_number,
+    )
+    rules = paced(
+        dashboard.wireless.getNetworkWirelessSsidFirewallL3FirewallRules,
+        networkId=net["id"],
+        number=ssid_number,
+    )["rules"]
+    local_lan_rule = next(
+        (rule for rule in rules if rule["destCidr"] == "Local LAN"), rules[0]
+    )
+    return ssid, local_lan_rule
+
+
+def _ssid_settings(
+    name=None,
+    enabled=None,
+    tag_vlan=None,
+    default_vlan_id=None,
+    auth_mode=None,
+    encryption_mode=None,
+    wpa_encryption_mode=None,
+    min_bitrate=None,
+    pre_shared_key=None,
+    ip_assignment_mode=None,
+):
+    """
+    Map SSID options to Dashboard API settings
+    """
+    return {
         "name": name,
         "enabled": enabled,
         "useVlanTagging": tag_vlan,
@@ -433,12 +1078,19 @@ def update_ssid(
             ip_assignment_mode.value if ip_assignment_mode is not None else None
         ),
     }
-    for key, value in items.items():
+
+
+def _ssid_changes(ssid, local_lan_rule, settings, local_lan_access):
+    """
+    Compare requested settings to the current SSID and Local LAN rule,
+    returning only the settings that need to change
+    """
+    update_ssid = {}
+    for key, value in settings.items():
         if value is not None:
             if value != ssid.get(key, None):
                 update_ssid[key] = value
 
-    # Enumerate changed value for Local LAN FW
     update_lan_fw = {}
     if local_lan_access is not None:
         if local_lan_access.value != local_lan_rule.get("policy"):
@@ -446,31 +1098,7 @@ def update_ssid(
                 True if local_lan_access.value == "allow" else False
             )
 
-    # Do not call API if no changes were made
-    with status_spinner("Updating SSID"):
-        changed = False
-        if update_ssid:
-            changed = True
-            ssid = dashboard.wireless.updateNetworkWirelessSsid(
-                networkId=net["id"], number=ssid_number, **update_ssid
-            )
-
-        if update_lan_fw:
-            changed = True
-            local_lan_rule = (
-                dashboard.wireless.updateNetworkWirelessSsidFirewallL3FirewallRules(
-                    networkId=net["id"], number=ssid_number, **update_lan_fw
-                )
-            )
-    if not changed:
-        console.print(f"[bold green]No settings changed.")
-        raise typer.Exit()
-
-    console.print(f"[bold green]SSID '{ssid['name']}' has been updated.")
-    console.print(
-        " The following parameters were updated:"
-        f" {', '.join(update_ssid | update_lan_fw)}"
-    )
+    return update_ssid, update_lan_fw
 
 
 @app.command()
@@ -5,24 +5,51 @@ Billy Zoellers
 CLI tools for managing Meraki networks based on Typer
 """
 
-from typing import List, Optional
+import csv
+import heapq
+import itertools
 import time
+from array import array
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterator, List, Optional
 from meraki.exceptions import APIError
 import typer
-from rich import inspect
-from rich.progress import Progress, track
+from rich.live import Live
+from rich.progress import Progress
+from merakitools.action_batches import print_batch_results, submit_action_batches
+from merakitools.cache import cached_value
 from merakitools.console import console, status_spinner
 from merakitools.dashboardapi import dashboard
 from merakitools.meraki_helpers import (
+    api_error_text,
     find_network_by_name,
+    find_org_by_name,
     find_org_id_by_device_serial,
+    get_device_index,
+    get_networks,
+    get_switch_stacks,
+    paced,
+    run_concurrently,
 )
 from merakitools.formatting_helpers import table_with_columns
+from merakitools.switchport_index import (
+    find_switchports,
+    indexed_organization,
+    mark_indexed,
+    normalize_mac,
+    open_switchport_index,
+    remove_switches,
+    store_switch,
+    switches_to_index,
+)
 from merakitools.types import (
     DeviceModel,
     MSInterfaceMode,
     TrafficDirection,
     MSSTPGuardType,
+    ProductType,
 )
 
 app = typer.Typer()
@@ -30,7 +57,19 @@ app = typer.Typer()
 
 @app.command()
 def update_switchport(
-    serial: str,
+    serial: Optional[List[str]] = typer.Argument(None, help="Switch serial(s)"),
+    organization_name: Optional[str] = typer.Option(
+        None, help="Organization to find --stack or --device-tag switches in"
+    ),
+    network_name: Optional[str] = typer.Option(
+        None, help="Network to find --stack or --device-tag switches in"
+    ),
+    stack: Optional[str] = typer.Option(
+        None, help="Update all members of the switch stack with this name or ID"
+    ),
+    device_tag: Optional[List[str]] = typer.Option(
+        None, help="Update all switches with this tag"
+    ),
     port: Optional[List[int]] = typer.Option(None, min=1, max=52),
     port_range: Optional[str] = None,
     name: Optional[str] = None,
@@ -45,10 +84,59 @@ def update_switchport(
     remove_tag: Optional[List[str]] = None,
 ):
     """
-    Update switchport(s)
+    Update switchport(s) on one or more switches
     """
+    serials = [*serial] if serial else []
+
+    # Find the organization and network used to select switches
+    net = None
+    if stack or device_tag:
+        if not organization_name:
+            console.print("[red]--organization-name is required to select switches.")
+            raise typer.Abort()
+        if network_name:
+            net = find_network_by_name(organization_name, network_name)
+            org_id = net["organizationId"]
+        else:
+            org_id = find_org_by_name(organization_name)["id"]
+
+    # Add members of a switch stack
+    if stack:
+        if net is None:
+            console.print("[red]--network-name is required to select a stack.")
+            raise typer.Abort()
+        with status_spinner("Getting switch stacks"):
+            stacks = dashboard.switch.getNetworkSwitchStacks(networkId=net["id"])
+        try:
+            found = next(st for st in stacks if stack in (st["name"], st["id"]))
+        except StopIteration as exc:
+            console.print(f"[red]Switch stack '{stack}' not found.")
+            raise typer.Abort() from exc
+        serials += found["serials"]
+
+    # Add switches with matching tags
+    if device_tag:
+        filters = {"networkIds": [net["id"]]} if net else {}
+        with status_spinner("Getting switches"):
+            devices = dashboard.organizations.getOrganizationDevices(
+                org_id,
+                total_pages="all",
+                productTypes=["switch"],
+                tags=device_tag,
+                tagsFilterType="withAnyTags",
+                **filters,
+            )
+        serials += [device["serial"] for device in devices]
+
+    # Remove duplicate serials, keeping order
+    serials = list(dict.fromkeys(serials))
+    if not serials:
+        console.print("[red]No switches specified.")
+        raise typer.Abort()
+
     # Validate device by trying to find OrgID
-    org_id = find_org_id_by_device_serial(serial=serial)
+    if not (stack or device_tag):
+        org_id = find_org_id_by_device_serial(serial=serials[0])
 
     # Create range of ports
     ports = []
@@ -57,79 +145,272 @@ def update_switchport(
         ports = list(range(int(range_begin), int(range_end) + 1))
 
     # Add specified ports to the range
-    for port in port:
-        if port not in ports:
-            ports.append(port)
+    for p in port or []:
+        if p not in ports:
+            ports.append(p)
 
     if len(ports) < 1:
         console.print("[red]No ports specified.")
         raise typer.Abort()
 
-    # Iterate through each port in the range
+    # Compile a dict of settings to be updated
+    items = {
+        "name": name,
+        "enabled": enabled,
+        "poeEnabled": poe_enabled,
+        "type": type.value if type is not None else type,
+        "vlan": vlan,
+        "voiceVlan": voice_vlan,
+        "rtspEnabled": rtsp_enabled,
+        "stpGuard": stp_guard.value if stp_guard is not None else stp_guard,
+    }
+
+    # Get all switchports on each switch at once, and compare to each port
     actions = []
-    for port in track(ports, description="Processing switchports", console=console):
-        try:
-            port = dashboard.switch.getDeviceSwitchPort(serial=serial, portId=port)
-        except APIError as err:
-            console.print(err.message)
-            raise typer.Abort()
+    with Progress(console=console) as progress:
+        task = progress.add_task("Processing switches", total=len(serials))
+        for sw_serial, switchports, err in run_concurrently(_get_switchports, serials):
+            progress.advance(task)
+            if err:
+                console.print(f"[red]Unable to get switchports for {sw_serial}")
+                console.print(err.message)
+                continue
+
+            # Index switchports by port ID
+            switchports = {swp["portId"]: swp for swp in switchports}
+
+            missing = [str(p) for p in ports if str(p) not in switchports]
+            if missing:
+                console.print(
+                    f"[yellow]Ports {', '.join(missing)} not found on {sw_serial}"
+                )
+
+            for port_id in ports:
+                swp = switchports.get(str(port_id))
+                if swp is None:
+                    continue
+
+                update = {}
+                for key, value in items.items():
+                    if value is not None:
+                        if value != swp.get(key):
+                            update[key] = value
+
+                # Update tags
+                if add_tag or remove_tag:
+                    tags = [*swp["tags"]]
+                    for tag in add_tag or []:
+                        if tag not in tags:
+                            tags.append(tag)
+                    for tag in remove_tag or []:
+                        if tag in tags:
+                            tags.remove(tag)
+                    if tags != swp["tags"]:
+                        update["tags"] = tags
+
+                # Create an action to be included in action batch
+                if update:
+                    actions.append(
+                        dashboard.batch.switch.updateDeviceSwitchPort(
+                            serial=sw_serial, portId=swp["portId"], **update
+                        )
+                    )
+
+    # Use action batches to execute all changes
+    if not actions:
+        console.print(f"[red]No changes to apply.")
+        raise typer.Exit()
+
+    console.print(f"Updating {len(actions)} switchports on {len(serials)} switches")
+    results = submit_action_batches(org_id, actions)
+    print_batch_results(results, noun="switchport updates")
+
+
+def _get_switchports(serial):
+    """
+    Get all switchports for a switch
+    """
+    return paced(dashboard.switch.getDeviceSwitchPorts, serial=serial)
+
 
-        # Compile a dict of settings to be updated
-        update = {}
-        items = {
-            "name": name,
-            "enabled": enabled,
-            "poeEnabled": poe_enabled,
-            "type": type.value if type is not None else type,
-            "vlan": vlan,
-            "voiceVlan": voice_vlan,
-            "rtspEnabled": rtsp_enabled,
-            "stpGuard": stp_guard.value if stp_guard is not None else stp_guard,
+@app.command()
+def index_switchports(
+    organization_name: str,
+    full: bool = typer.Option(False, help="Re-index every switch"),
+    max_age: int = typer.Option(
+        60, min=0, help="Re-index switches last indexed more than this many minutes ago"
+    ),
+    client_timespan: int = typer.Option(
+        86400, min=300, max=2678400, help="Index clients seen within this many seconds"
+    ),
+):
+    """
+    Index switchports and clients of every switch in an organization for
+    find-switchport. Only new switches, switches with configuration changes
+    and switches older than --max-age are crawled again
+    """
+    org = find_org_by_name(organization_name)
+    db = open_switchport_index()
+    started = time.time()
+
+    with status_spinner("Getting switches"):
+        network_names = {
+            net["id"]: net["name"]
+            for net in get_networks(
+                org["id"], product_type=ProductType.switch, refresh=full
+            )
         }
-        for key, value in items.items():
-            if value is not None:
-                if value is not port[key]:
-                    update[key] = value
-
-        # Update tags
-        if add_tag or remove_tag:
-            update["tags"] = port["tags"]
-            for tag in add_tag:
-                if tag not in update["tags"]:
-                    update["tags"].append(tag)
-            for tag in remove_tag:
-                if tag in update["tags"]:
-                    update["tags"].remove(tag)
-
-        # Create an action to be included in action batch
-        if update:
-            update_action = dashboard.batch.switch.updateDeviceSwitchPort(
-                serial=serial, portId=port["portId"], **update
+        devices = dashboard.organizations.getOrganizationDevices(
+            org["id"], total_pages="all", productTypes=["switch"]
+        )
+
+        # Find switches with configuration changes since the last complete index
+        updated = set()
+        indexed_org = indexed_organization(db, org["id"])
+        if indexed_org and indexed_org["complete_at"] and not full:
+            updated = {
+                device["serial"]
+                for device in dashboard.organizations.getOrganizationDevices(
+                    org["id"],
+                    total_pages="all",
+                    productTypes=["switch"],
+                    configurationUpdatedAfter=datetime.fromtimestamp(
+                        indexed_org["complete_at"], timezone.utc
+                    ).isoformat(timespec="seconds"),
+                )
+            }
+
+    crawl, removed = switches_to_index(
+        db, org["id"], devices, updated, max_age * 60, full=full
+    )
+    remove_switches(db, removed)
+
+    failed = []
+    with Progress(console=console) as progress:
+        task = progress.add_task("Indexing switches", total=len(crawl))
+        for device, result, err in run_concurrently(
+            lambda device: _crawl_switch(device, client_timespan), crawl
+        ):
+            progress.advance(task)
+            if err:
+                failed.append(device.get("name") or device["serial"])
+                continue
+            store_switch(
+                db,
+                org["id"],
+                device,
+                network_names.get(device["networkId"], device["networkId"]),
+                *result,
             )
-            actions.append(update_action)
 
-    # Use an action batch to execute in one run
-    if actions:
-        with status_spinner("Waiting for API batch to complete"):
-            action_batch = dashboard.organizations.createOrganizationActionBatch(
-                organizationId=org_id, actions=actions, confirmed=True
+    # Only a complete run moves the point that configuration changes are checked from
+    mark_indexed(db, org, started, complete=not failed)
+
+    ports = db.execute(
+        "SELECT count(*) FROM ports p JOIN switches s ON s.serial = p.serial"
+        " WHERE s.organization_id = ?",
+        (org["id"],),
+    ).fetchone()[0]
+    console.print(
+        f"Indexed {len(crawl) - len(failed)} of {len(devices)} switches"
+        f" ({len(devices) - len(crawl)} unchanged, {len(removed)} removed)."
+        f" The index has [bold]{ports}[/bold] switchports for {org['name']}."
+    )
+    if failed:
+        console.print(f"[red]Unable to index {', '.join(sorted(failed))}")
+
+
+def _crawl_switch(device, client_timespan):
+    """
+    Get the configuration, status and clients of all switchports on a switch
+    """
+    ports = paced(dashboard.switch.getDeviceSwitchPorts, serial=device["serial"])
+    statuses = paced(
+        dashboard.switch.getDeviceSwitchPortsStatuses, serial=device["serial"]
+    )
+    clients = paced(
+        dashboard.devices.getDeviceClients,
+        serial=device["serial"],
+        timespan=client_timespan,
+    )
+    return ports, statuses, clients
+
+
+@app.command()
+def find_switchport(
+    organization_name: str,
+    vlan: Optional[int] = typer.Option(
+        None, min=1, max=4094, help="Access, voice or allowed trunk VLAN"
+    ),
+    tag: Optional[str] = typer.Option(None, help="Switchport tag"),
+    name: Optional[str] = typer.Option(None, help="Switchport name contains"),
+    neighbor: Optional[str] = typer.Option(
+        None, help="LLDP system name or CDP device ID contains"
+    ),
+    mac: Optional[str] = typer.Option(None, help="Client MAC address or prefix"),
+):
+    """
+    Find switchports in the local index created by index-switchports
+    """
+    if not any(value is not None for value in (vlan, tag, name, neighbor, mac)):
+        console.print(
+            "[red]Specify at least one of --vlan, --tag, --name, --neighbor or --mac"
+        )
+        raise typer.Exit()
+    if mac is not None and not normalize_mac(mac):
+        console.print(f"[red]Invalid MAC address {mac}")
+        raise typer.Exit()
+
+    db = open_switchport_index()
+    org = indexed_organization(db, organization_name)
+    if org is None:
+        console.print(
+            f"[red]{organization_name} has not been indexed, run ms index-switchports"
+        )
+        raise typer.Exit()
+
+    switchports = find_switchports(
+        db, org["id"], vlan=vlan, tag=tag, name=name, neighbor=neighbor, mac=mac
+    ).fetchall()
+    if not switchports:
+        console.print("No switchports found.")
+        raise typer.Exit()
+
+    cols = ["Switch", "Port", "Name", "Mode", "VLAN", "Status", "Neighbor"]
+    if mac:
+        cols.append("Client")
+    table = table_with_columns(
+        cols, title=f"Switchports in {org['name']}", first_column_name="Network"
+    )
+    for swp in switchports:
+        rows = [
+            swp["network_name"],
+            swp["switch_name"],
+            swp["port_id"],
+            swp["name"] or "",
+            swp["type"] or "",
+            str(swp["allowed_vlans"] if swp["type"] == "trunk" else swp["vlan"]),
+            swp["status"] or "",
+            swp["lldp_system_name"] or swp["cdp_device_id"] or "",
+        ]
+        if mac:
+            client_mac = ":".join(
+                swp["mac"][idx : idx + 2] for idx in range(0, len(swp["mac"]), 2)
             )
-            while True:
-                if (
-                    action_batch["status"]["completed"]
-                    or action_batch["status"]["failed"]
-                ):
-                    break
-                time.sleep(5)
-                action_batch = dashboard.organizations.getOrganizationActionBatch(
-                    organizationId=org_id, actionBatchId=action_batch["id"]
+            rows.append(
+                " ".join(
+                    value
+                    for value in (client_mac, swp["ip"], swp["description"])
+                    if value
                 )
-        if action_batch["status"]["completed"]:
-            console.print(f"[green]Updated {len(action_batch['actions'])} switchports")
-            raise typer.Exit()
-        console.print(f"[red]Failed to update switchports")
-    else:
-        console.print(f"[red]No changes to apply.")
+            )
+        table.add_row(*rows)
+
+    console.print(table)
+    console.print(
+        f"Found [bold]{len(switchports)}[/bold] switchports, index updated"
+        f" {datetime.fromtimestamp(org['indexed_at']).isoformat(sep=' ', timespec='minutes')}."
+    )
 
 
 @app.command()
@@ -158,6 +439,121 @@ def list_stacks(organization_name: str, network_name: str):
     console.print(table)
 
 
+@app.command()
+def stack_health(
+    organization_name: str,
+    issues_only: bool = typer.Option(
+        False, help="Only list stacks with offline members or port errors"
+    ),
+    refresh: bool = typer.Option(False, help="Ignore cached switch stack data"),
+):
+    """
+    Report member status and switchport errors for every switch stack in an
+    organization
+    """
+    org = find_org_by_name(organization_name)
+    with status_spinner("Getting switch stacks"):
+        network_names = {
+            net["id"]: net["name"]
+            for net in get_networks(
+                org["id"], product_type=ProductType.switch, refresh=refresh
+            )
+        }
+        try:
+            stacks = get_switch_stacks(org["id"], refresh=refresh)
+        except APIError as err:
+            console.print(f"[red]Unable to get switch stacks: {api_error_text(err)}")
+            raise typer.Abort()
+        devices = get_device_index(org["id"], refresh=refresh)
+        statuses = {
+            status["serial"]: status["status"]
+            for status in dashboard.organizations.getOrganizationDevicesStatuses(
+                org["id"], total_pages="all", productTypes=["switch"]
+            )
+        }
+
+    if not stacks:
+        console.print("No switch stacks found.")
+        raise typer.Exit()
+
+    # Get switchport status of every stack member
+    members = [{"serial": serial} for stack in stacks for serial in stack["serials"]]
+    port_issues = {}
+    with Progress(console=console) as progress:
+        task = progress.add_task("Getting switchport status", total=len(members))
+        for dev, switchport_statuses, err in run_concurrently(
+            _get_switchport_statuses, members
+        ):
+            progress.advance(task)
+            if err:
+                continue
+            port_issues[dev["serial"]] = _switchport_issues(switchport_statuses)
+
+    # Create and print a table
+    table = table_with_columns(
+        ["Stack", "Members", "Offline", "Port errors", "Port warnings", "Top issues"],
+        title=f"Switch stacks in {org['name']}",
+        first_column_name="Network",
+    )
+    unhealthy = 0
+    for stack in sorted(
+        stacks, key=lambda k: (network_names.get(k["networkId"], ""), k["name"])
+    ):
+        offline = [
+            devices.get(serial, {}).get("name") or serial
+            for serial in stack["serials"]
+            if statuses.get(serial) != "online"
+        ]
+        errors, warnings, issues = 0, 0, Counter()
+        for serial in stack["serials"]:
+            member = port_issues.get(serial)
+            if member is None:
+                issues["switchport status unavailable"] += 1
+                continue
+            errors += member["errors"]
+            warnings += member["warnings"]
+            issues.update(member["issues"])
+
+        healthy = not (offline or errors or issues["switchport status unavailable"])
+        unhealthy += not healthy
+        if issues_only and healthy:
+            continue
+        table.add_row(
+            network_names.get(stack["networkId"], stack["networkId"]),
+            stack["name"],
+            str(len(stack["serials"])),
+            f"[red]{', '.join(offline)}" if offline else "",
+            f"[red]{errors}" if errors else "0",
+            f"[yellow]{warnings}" if warnings else "0",
+            ", ".join(f"{issue} ({count})" for issue, count in issues.most_common(3)),
+        )
+
+    console.print(table)
+    console.print(
+        f"[bold]{len(stacks)}[/bold] switch stacks,"
+        f" [red]{unhealthy}[/red] with offline members or switchport errors."
+    )
+
+
+def _switchport_issues(switchport_statuses):
+    """
+    Count connected switchports with errors or warnings on a switch
+    """
+    issues = {"errors": 0, "warnings": 0, "issues": Counter()}
+    for swp_stat in switchport_statuses:
+        # Disconnected and disabled ports always report an error
+        if swp_stat.get("status") != "Connected":
+            continue
+        if swp_stat.get("errors"):
+            issues["errors"] += 1
+        if swp_stat.get("warnings"):
+            issues["warnings"] += 1
+        issues["issues"].update(
+            [*swp_stat.get("errors", []), *swp_stat.get("warnings", [])]
+        )
+    return issues
+
+
 @app.command()
 def list_routing_interfaces(
     organization_name: str, network_name: str, serial: str, include_dhcp: bool = False
@@ -175,8 +571,7 @@ def list_routing_interfaces(
         except APIError as err:
             if "switches in switch stack" in err.message["errors"][0].lower():
                 console.print(f"This switch is a member of a stack.")
-                stacks = dashboard.switch.getNetworkSwitchStacks(networkId=net["id"])
-                stack = next(stack for stack in stacks if serial in stack["serials"])
+                stack = _find_member_stack(net, serial)
                 routing_interfaces = (
                     dashboard.switch.getNetworkSwitchStackRoutingInterfaces(
                         networkId=net["id"], switchStackId=stack["id"]
@@ -190,6 +585,18 @@ def list_routing_interfaces(
         console.print("No routing interfaces found.")
         raise typer.Exit()
 
+    # Get DHCP settings for every interface at once
+    if stack:
+        target = {"networkId": net["id"], "switchStackId": stack["id"]}
+    else:
+        target = {"serial": serial}
+    dhcp = {}
+    if include_dhcp:
+        with status_spinner("Getting DHCP settings"):
+            dhcp = _get_routing_interfaces_dhcp(
+                [(target, intf) for intf in routing_interfaces]
+            )
+
     # Create and print a table
     cols = ["Subnet", "Interface IP", "VLAN ID"]
     if include_dhcp:
@@ -199,48 +606,218 @@ def list_routing_interfaces(
     )
     for intf in routing_interfaces:
         rows = [intf["name"], intf["subnet"], intf["interfaceIp"], str(intf["vlanId"])]
-
         if include_dhcp:
-            # Get DHCP info
-            with status_spinner("Getting DHCP settings"):
-                if stack:
-                    dhcp = dashboard.switch.getNetworkSwitchStackRoutingInterfaceDhcp(
-                        networkId=net["id"],
-                        switchStackId=stack["id"],
-                        interfaceId=intf["interfaceId"],
-                    )
-                else:
-                    dhcp = dashboard.switch.getDeviceSwitchRoutingInterfaceDhcp(
-                        serial=serial, interfaceId=intf["interfaceId"]
-                    )
+            rows.append(_format_dhcp(dhcp.get(intf["interfaceId"])))
+        table.add_row(*rows)
+
+    console.print(table)
 
-            # Format DHCP cell, and add to table rows
-            if dhcp["dhcpMode"] == "dhcpDisabled":
-                dhcp_formatted = "Disabled"
-            elif dhcp["dhcpMode"] == "dhcpServer":
-                if dhcp["dnsNameserversOption"] == "custom":
-                    dhcp_formatted = (
-                        "[bold]Server[/bold] DNS:"
-                        f" {', '.join(dhcp['dnsCustomNameservers'])}"
-                    )
-                else:
-                    dhcp_formatted = (
-                        "[bold]Server[/bold]"
-                        f" {dhcp['dnsNameserversOption'].capitalize()}"
-                    )
-            elif dhcp["dhcpMode"] == "dhcpRelay":
-                dhcp_formatted = (
-                    "[bold]Relay[/bold] Servers:"
-                    f" {', '.join(dhcp['dhcpRelayServerIps'])}"
-                )
-            else:
-                dhcp_formatted = dhcp["dhcpMode"].capitalize()
-                inspect(dhcp)
-            rows.append(dhcp_formatted)
 
+@app.command()
+def list_org_routing_interfaces(
+    organization_name: str,
+    include_dhcp: bool = False,
+    refresh: bool = typer.Option(False, help="Ignore cached network data"),
+):
+    """
+    List L3 routed interfaces on every MS switch and stack in an organization
+    """
+    org = find_org_by_name(organization_name)
+    with status_spinner("Getting switches"):
+        networks = get_networks(
+            org["id"], product_type=ProductType.switch, refresh=refresh
+        )
+        devices = dashboard.organizations.getOrganizationDevices(
+            org["id"], total_pages="all", productTypes=["switch"]
+        )
+    network_names = {net["id"]: net["name"] for net in networks}
+
+    # Switch stacks are queried instead of their members
+    try:
+        with status_spinner("Getting switch stacks"):
+            stacks = get_switch_stacks(org["id"], refresh=refresh)
+    except APIError as err:
+        console.print(f"[red]Unable to get switch stacks: {api_error_text(err)}")
+        raise typer.Abort()
+    stack_members = {serial for stack in stacks for serial in stack["serials"]}
+    targets = [
+        {
+            "networkId": stack["networkId"],
+            "switchStackId": stack["id"],
+            "name": stack["name"],
+        }
+        for stack in stacks
+    ]
+    targets += [
+        {
+            "networkId": device["networkId"],
+            "serial": device["serial"],
+            "name": device["name"] or device["serial"],
+        }
+        for device in devices
+        if device["serial"] not in stack_members
+    ]
+
+    # Get routing interfaces for every switch and stack
+    interfaces, errors = [], []
+    with Progress(console=console) as progress:
+        task = progress.add_task("Getting routing interfaces", total=len(targets))
+        for target, routing_interfaces, err in run_concurrently(
+            _get_routing_interfaces, targets
+        ):
+            progress.advance(task)
+            # Switches without L3 routing return a bad request error
+            if err and err.status == 400:
+                continue
+            if err:
+                errors.append(f"{target['name']}: {api_error_text(err)}")
+                continue
+            interfaces += [(target, intf) for intf in routing_interfaces]
+
+    for error in errors:
+        console.print(f"[yellow]Unable to get routing interfaces for {error}")
+    if not interfaces:
+        console.print("No routing interfaces found.")
+        raise typer.Exit()
+
+    dhcp = {}
+    if include_dhcp:
+        with status_spinner(f"Getting DHCP settings for {len(interfaces)} interfaces"):
+            dhcp = _get_routing_interfaces_dhcp(interfaces)
+
+    # Create and print a table
+    cols = ["Switch / Stack", "Name", "Subnet", "Interface IP", "VLAN ID"]
+    if include_dhcp:
+        cols.append("DHCP")
+    table = table_with_columns(
+        cols,
+        title=f"Routing interfaces in {org['name']}",
+        first_column_name="Network",
+    )
+    for target, intf in sorted(
+        interfaces,
+        key=lambda k: (
+            network_names.get(k[0]["networkId"], ""),
+            k[0]["name"],
+            k[1].get("vlanId") or 0,
+        ),
+    ):
+        rows = [
+            network_names.get(target["networkId"], target["networkId"]),
+            target["name"],
+            intf["name"],
+            intf.get("subnet") or "",
+            intf.get("interfaceIp") or "",
+            str(intf.get("vlanId")),
+        ]
+        if include_dhcp:
+            rows.append(_format_dhcp(dhcp.get(intf["interfaceId"])))
         table.add_row(*rows)
 
     console.print(table)
+    console.print(
+        f"Found [bold]{len(interfaces)}[/bold] routing interfaces on"
+        f" {len({id(target) for target, _ in interfaces})} switches and stacks."
+    )
+    if errors:
+        console.print(
+            f"[yellow]{len(errors)} switches and stacks could not be read,"
+            " the list may be incomplete."
+        )
+
+
+def _find_member_stack(net, serial):
+    """
+    Find the switch stack that a switch is a member of, from the cached stack
+    inventory of the organization or else the stacks of its network only
+    """
+    stacks = cached_value(f"org-switch-stacks-{net['organizationId']}") or []
+    stack = next(
+        (
+            stack
+            for stack in stacks
+            if stack["networkId"] == net["id"] and serial in stack["serials"]
+        ),
+        None,
+    )
+    if stack is None:
+        try:
+            stacks = paced(dashboard.switch.getNetworkSwitchStacks, networkId=net["id"])
+        except APIError as err:
+            console.print(f"[red]Unable to get switch stacks: {api_error_text(err)}")
+            raise typer.Abort()
+        stack = next((stack for stack in stacks if serial in stack["serials"]), None)
+    if stack is None:
+        console.print(f"[red]Switch stack for {serial} not found.")
+        raise typer.Abort()
+    return stack
+
+
+def _get_routing_interfaces(target):
+    """
+    Get routing interfaces for a switch or switch stack
+    """
+    if "switchStackId" in target:
+        return paced(
+            dashboard.switch.getNetworkSwitchStackRoutingInterfaces,
+            networkId=target["networkId"],
+            switchStackId=target["switchStackId"],
+        )
+    return paced(
+        dashboard.switch.getDeviceSwitchRoutingInterfaces, serial=target["serial"]
+    )
+
+
+def _get_routing_interface_dhcp(target_interface):
+    """
+    Get DHCP settings for a routing interface on a switch or switch stack
+    """
+    target, intf = target_interface
+    if "switchStackId" in target:
+        return paced(
+            dashboard.switch.getNetworkSwitchStackRoutingInterfaceDhcp,
+            networkId=target["networkId"],
+            switchStackId=target["switchStackId"],
+            interfaceId=intf["interfaceId"],
+        )
+    return paced(
+        dashboard.switch.getDeviceSwitchRoutingInterfaceDhcp,
+        serial=target["serial"],
+        interfaceId=intf["interfaceId"],
+    )
+
+
+def _get_routing_interfaces_dhcp(interfaces):
+    """
+    Get DHCP settings for many (target, interface) pairs concurrently,
+    indexed by interface ID
+    """
+    dhcp = {}
+    for (_, intf), result, err in run_concurrently(
+        _get_routing_interface_dhcp, interfaces
+    ):
+        if not err:
+            dhcp[intf["interfaceId"]] = result
+    return dhcp
+
+
+def _format_dhcp(dhcp):
+    """
+    Readable DHCP settings for a routing interface
+    """
+    if dhcp is None:
+        return "[red]Unknown"
+    if dhcp["dhcpMode"] == "dhcpDisabled":
+        return "Disabled"
+    if dhcp["dhcpMode"] == "dhcpServer":
+        if dhcp["dnsNameserversOption"] == "custom":
+            return (
+                "[bold]Server[/bold] DNS:" f" {', '.join(dhcp['dnsCustomNameservers'])}"
+            )
+        return f"[bold]Server[/bold] {dhcp['dnsNameserversOption'].capitalize()}"
+    if dhcp["dhcpMode"] == "dhcpRelay":
+        return f"[bold]Relay[/bold] Servers: {', '.join(dhcp['dhcpRelayServerIps'])}"
+    return dhcp["dhcpMode"].capitalize()
 
 
 @app.command()
@@ -252,10 +829,23 @@ def diag_switchport_traffic(
     interface_mode: MSInterfaceMode = None,
     ignore_device_tag: List[str] = None,
     ignore_switchport_tag: List[str] = None,
+    watch: bool = typer.Option(
+        False, help="Keep sampling switchports until interrupted with Ctrl+C"
+    ),
+    interval: int = typer.Option(
+        60, help="Seconds between samples in --watch mode", min=10
+    ),
+    samples: int = typer.Option(
+        60, help="Number of samples kept for each switchport in --watch mode", min=1
+    ),
+    export: Optional[Path] = typer.Option(
+        None, help="Write samples to this CSV file when --watch stops"
+    ),
 ):
     """
     Diagnose all switchports on a network of MS switches to find
-    switchports that are top talkers at a given instant
+    switchports that are top talkers at a given instant, or over time
+    with --watch
 
     ** This command gathers a significant amount of data and may
     take some time to complete on larger networks **
@@ -264,72 +854,68 @@ def diag_switchport_traffic(
     with status_spinner("Getting network devices"):
         devices = dashboard.networks.getNetworkDevices(net["id"])
 
+    # Only analyze MS switches, ignoring devices with specific tags
+    switches = [
+        dev
+        for dev in devices
+        if DeviceModel.MS in dev["model"]
+        and not (
+            ignore_device_tag and any(tag in dev["tags"] for tag in ignore_device_tag)
+        )
+    ]
+
+    if watch:
+        _watch_switchport_traffic(
+            switches,
+            top,
+            sort_by,
+            interface_mode,
+            ignore_switchport_tag,
+            interval,
+            samples,
+            export,
+        )
+        raise typer.Exit()
+
     console.print(
         "Analyzing each switchport on the network, this may take a few minutes"
     )
-    switchports = []
+
+    # Keep only the top switchports in a bounded heap, lowest traffic first
+    top_switchports = []
+    tiebreak = itertools.count()
     with Progress(console=console) as progress:
         task_devices = progress.add_task(
-            f"[blue]Processing {len(devices)} devices..", total=len(devices)
+            f"[blue]Processing {len(switches)} switches..", total=len(switches)
         )
-        # Iterate through each switchport and add to the master switchport list
-        for dev in devices:
+        for dev, switchports, err in run_concurrently(
+            lambda dev: _get_connected_switchports(
+                dev, interface_mode, ignore_switchport_tag
+            ),
+            switches,
+        ):
             progress.update(
                 task_devices,
                 advance=1,
-                description=f"[blue] Processing device '{dev['name']}'",
+                description=f"[blue] Processed switch '{dev['name']}'",
             )
-
-            # Ignore non-MS devices
-            if DeviceModel.MS not in dev["model"]:
-                continue
-
-            # Ignore devices with specific tags
-            if ignore_device_tag and any(
-                tag in dev["tags"] for tag in ignore_device_tag
-            ):
+            if err:
+                console.print(f"[red]Unable to get switchports for {dev['name']}")
                 continue
 
-            # Get switchport configuration and status
-            switchport_configs = dashboard.switch.getDeviceSwitchPorts(
-                serial=dev["serial"]
-            )
-            switchport_statuses = dashboard.switch.getDeviceSwitchPortsStatuses(
-                serial=dev["serial"]
-            )
-
-            # Iterate through each switchport
-            for swp_stat in switchport_statuses:
-                # Ignore non-connected switchports
-                if not swp_stat["status"] == "Connected":
-                    continue
-
-                # Create a combined switchport record (status+config)
-                swp_cfg = next(
-                    swp_cfg
-                    for swp_cfg in switchport_configs
-                    if swp_cfg["portId"] == swp_stat["portId"]
-                )
-                swp = swp_stat | swp_cfg
-                swp["switch_name"] = dev["name"]
-
-                # Ignore switchports with specific tags
-                if ignore_switchport_tag and any(
-                    tag in swp["tags"] for tag in ignore_switchport_tag
-                ):
-                    continue
-
-                # Add combined switchport record to list of switchports
-                switchports.append(swp)
+            for swp in switchports:
+                entry = (swp["trafficInKbps"][sort_by.value], next(tiebreak), swp)
+                if len(top_switchports) < top:
+                    heapq.heappush(top_switchports, entry)
+                else:
+                    heapq.heappushpop(top_switchports, entry)
 
         progress.update(
-            task_devices, description=f"[green]Processed {len(devices)} devices."
+            task_devices, description=f"[green]Processed {len(switches)} switches."
         )
 
-        # Sort all switchports based on the specified sort_by value (highest to lowest)
-        switchports = sorted(
-            switchports, key=lambda k: k["trafficInKbps"][sort_by.value], reverse=True
-        )
+        # Sort the top switchports (highest to lowest)
+        switchports = [swp for *_, swp in sorted(top_switchports, reverse=True)]
         table = table_with_columns(
             [
                 "Port",
@@ -345,7 +931,7 @@ def diag_switchport_traffic(
             first_column_name="Device",
         )
 
-        for swp in switchports[:top]:
+        for swp in switchports:
             # get Mbps values for traffic
             mb_size = 1024
             rounding_precision = 2
@@ -383,3 +969,260 @@ def diag_switchport_traffic(
             )
 
         console.print(table)
+
+
+class SwitchportHistory:
+    """
+    Fixed size ring buffer of traffic samples for a switchport
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.index = 0
+        self.count = 0
+        self.times = array("d", bytes(8 * size))
+        self.traffic = {
+            direction.value: array("f", bytes(4 * size))
+            for direction in TrafficDirection
+        }
+
+    def add(self, timestamp: float, traffic: dict):
+        """
+        Add a sample, replacing the oldest sample once the buffer is full
+        """
+        self.times[self.index] = timestamp
+        for direction, values in self.traffic.items():
+            values[self.index] = traffic.get(direction) or 0
+        self.index = (self.index + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def _ordered(self, values) -> List:
+        """
+        Samples from oldest to newest
+        """
+        if self.count < self.size:
+            return values[: self.count].tolist()
+        return (values[self.index :] + values[: self.index]).tolist()
+
+    def samples(self) -> Iterator:
+        """
+        Timestamp and traffic of each sample, oldest first
+        """
+        return zip(
+            self._ordered(self.times),
+            *[self._ordered(self.traffic[d.value]) for d in TrafficDirection],
+        )
+
+    def latest(self, direction: str) -> float:
+        """
+        Most recent sample
+        """
+        return self.traffic[direction][(self.index - 1) % self.size]
+
+    def average(self, direction: str) -> float:
+        """
+        Average of all samples in the buffer
+        """
+        return sum(self._ordered(self.traffic[direction])) / max(self.count, 1)
+
+    def peak(self, direction: str) -> float:
+        """
+        Highest sample in the buffer
+        """
+        return max(self._ordered(self.traffic[direction]), default=0)
+
+
+def _watch_switchport_traffic(
+    switches,
+    top,
+    sort_by,
+    interface_mode,
+    ignore_switchport_tag,
+    interval,
+    samples,
+    export,
+):
+    """
+    Sample switchport statuses on an interval, displaying the top switchports
+    by current traffic along with their average and peak traffic
+    """
+    # Get switchport configuration once, only statuses are sampled
+    configs = {}
+    with status_spinner("Getting switchports"):
+        for serial, switchports, err in run_concurrently(
+            _get_switchports, [dev["serial"] for dev in switches]
+        ):
+            if not err:
+                configs[serial] = {swp["portId"]: swp for swp in switchports}
+
+    # Samples are kept per (serial, port ID), with names for display
+    history = {}
+    labels = {}
+    try:
+        with Live(console=console, auto_refresh=False) as live:
+            while True:
+                started = time.monotonic()
+                timestamp = time.time()
+                for dev, statuses, err in run_concurrently(
+                    _get_switchport_statuses, switches
+                ):
+                    if err:
+                        continue
+                    switchport_configs = configs.get(dev["serial"], {})
+                    for swp_stat in statuses:
+                        swp_cfg = switchport_configs.get(swp_stat["portId"], {})
+
+                        # Ignore switchports in other modes or with specific tags
+                        if interface_mode and swp_cfg.get("type") != (
+                            interface_mode.value
+                        ):
+                            continue
+                        if ignore_switchport_tag and any(
+                            tag in swp_cfg.get("tags", [])
+                            for tag in ignore_switchport_tag
+                        ):
+                            continue
+
+                        key = (dev["serial"], swp_stat["portId"])
+                        if key not in history:
+                            history[key] = SwitchportHistory(samples)
+                        labels[key] = (
+                            dev.get("name") or dev["serial"],
+                            swp_cfg.get("name"),
+                        )
+                        history[key].add(
+                            timestamp,
+                            (
+                                swp_stat.get("trafficInKbps") or {}
+                                if swp_stat["status"] == "Connected"
+                                else {}
+                            ),
+                        )
+
+                live.update(
+                    _switchport_history_table(history, labels, top, sort_by, interval),
+                    refresh=True,
+                )
+                time.sleep(max(0, interval - (time.monotonic() - started)))
+    except KeyboardInterrupt:
+        console.print("Stopped sampling.")
+    finally:
+        # Keep the samples even when sampling stops on an error
+        if export:
+            _export_switchport_history(export, history, labels)
+
+
+def _export_switchport_history(export, history, labels):
+    """
+    Write sampled switchport traffic to a CSV file
+    """
+    with open(export, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(
+            ["time", "serial", "switch", "port", "name"]
+            + [f"{d.value}_kbps" for d in TrafficDirection]
+        )
+        for (serial, port_id), port_history in history.items():
+            switch_name, port_name = labels[(serial, port_id)]
+            for ts, *traffic in port_history.samples():
+                writer.writerow(
+                    [
+                        datetime.fromtimestamp(ts).isoformat(timespec="seconds"),
+                        serial,
+                        switch_name,
+                        port_id,
+                        port_name,
+                        *traffic,
+                    ]
+                )
+    console.print(f"Exported samples to {export}")
+
+
+def _switchport_history_table(history, labels, top, sort_by, interval):
+    """
+    Create a table of the top switchports by latest traffic
+    """
+    table = table_with_columns(
+        ["Port", "Current", "Average", "Peak", "Samples"],
+        title=(
+            f"Top {top} switchports by {sort_by.value} traffic, sampled every"
+            f" {interval}s"
+        ),
+        first_column_name="Device",
+    )
+    top_switchports = heapq.nlargest(
+        top, history.items(), key=lambda item: item[1].latest(sort_by.value)
+    )
+    mb_size = 1024
+    for (serial, port_id), port_history in top_switchports:
+        switch_name, port_name = labels[(serial, port_id)]
+        table.add_row(
+            switch_name,
+            f"{port_id} ({port_name})",
+            f"{port_history.latest(sort_by.value) / mb_size:.2f} Mbps",
+            f"{port_history.average(sort_by.value) / mb_size:.2f} Mbps",
+            f"{port_history.peak(sort_by.value) / mb_size:.2f} Mbps",
+            str(port_history.count),
+        )
+    return table
+
+
+def _get_switchport_statuses(dev):
+    """
+    Get the status of all switchports on a switch
+    """
+    return paced(dashboard.switch.getDeviceSwitchPortsStatuses, serial=dev["serial"])
+
+
+def _get_connected_switchports(dev, interface_mode=None, ignore_switchport_tag=None):
+    """
+    Get connected switchports on a switch, combining the status and
+    configuration of each port
+    """
+    switchport_configs = paced(
+        dashboard.switch.getDeviceSwitchPorts, serial=dev["serial"]
+    )
+    switchport_statuses = paced(
+        dashboard.switch.getDeviceSwitchPortsStatuses, serial=dev["serial"]
+    )
+
+    # Index switchport configuration by port ID
+    switchport_configs = {swp_cfg["portId"]: swp_cfg for swp_cfg in switchport_configs}
+
+    switchports = []
+    for swp_stat in switchport_statuses:
+        # Ignore non-connected switchports
+        if not swp_stat["status"] == "Connected":
+            continue
+
+        swp_cfg = switchport_configs.get(swp_stat["portId"], {})
+
+        # Ignore switchports in other modes or with specific tags
+        if interface_mode and swp_cfg.get("type") != interface_mode.value:
+            continue
+        if ignore_switchport_tag and any(
+            tag in swp_cfg.get("tags", []) for tag in ignore_switchport_tag
+        ):
+            continue
+
+        # Keep only the fields needed to display the switchport
+        swp = {
+            key: swp_stat.get(key)
+            for key in (
+                "portId",
+                "status",
+                "speed",
+                "trafficInKbps",
+                "clientCount",
+                "cdp",
+                "lldp",
+            )
+            if key in swp_stat
+        }
+        swp["name"] = swp_cfg.get("name")
+        swp["errors"] = swp_stat.get("errors", [])
+        swp["warnings"] = swp_stat.get("warnings", [])
+        swp["switch_name"] = dev["name"]
+        switchports.append(swp)
+
+    return switchports
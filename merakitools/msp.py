@@ -5,35 +5,113 @@ Billy Zoellers
 CLI tools for managing Meraki networks based on Typer
 """
 
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+from pathlib import Path
 from typing import List, Optional
 from datetime import datetime, timedelta
 import typer
-from rich.progress import track
+from rich.progress import Progress
 from merakitools.console import console, status_spinner
 from merakitools.dashboardapi import dashboard, APIError
+from merakitools.formatting_helpers import table_with_columns
+from merakitools.meraki_helpers import (
+    api_error_text,
+    export_format,
+    paced,
+    record_writer,
+    run_concurrently,
+    time_shards,
+)
+from merakitools.types import ExportFormat
 
 app = typer.Typer()
 
+# API errors worth retrying, and how many times
+TRANSIENT_STATUSES = (429, 500, 502, 503, 504)
+MAX_RETRIES = 3
+# Columns of security events exported as CSV
+EVENT_COLUMNS = [
+    "organization",
+    "ts",
+    "eventType",
+    "priority",
+    "classification",
+    "blocked",
+    "srcIp",
+    "destIp",
+    "protocol",
+    "clientMac",
+    "signature",
+    "message",
+]
+
 
 @app.command()
-def enable_api_all():
+def enable_api_all(
+    dry_run: bool = typer.Option(
+        False, help="Show organizations that would be changed without changing them"
+    ),
+):
     """
     Enable the Meraki API for all accessible organizations
     """
     with status_spinner("Finding organizations"):
-        orgs = dashboard.organizations.getOrganizations()
+        orgs = dashboard.organizations.getOrganizations(total_pages="all")
         orgs = [org for org in orgs if not org["api"]["enabled"]]
     console.print(f"Found {len(orgs)} organizations with API disabled.")
+    if not orgs:
+        return
+
+    table = table_with_columns(
+        ["ID", "Result"], title="Enable API", first_column_name="Organization"
+    )
+    if dry_run:
+        for org in sorted(orgs, key=lambda k: k["name"]):
+            table.add_row(org["name"], org["id"], "[yellow]Would enable API")
+        console.print(table)
+        return
+
+    results = []
+    failed = 0
+    with Progress(console=console) as progress:
+        task = progress.add_task("Enabling API", total=len(orgs))
+        for org, _, err in run_concurrently(_enable_api, orgs):
+            progress.advance(task)
+            if err:
+                failed += 1
+                results.append((org, f"[red]{api_error_text(err)}"))
+            else:
+                results.append((org, "[green]API enabled"))
+
+    for org, result in sorted(results, key=lambda k: k[0]["name"]):
+        table.add_row(org["name"], org["id"], result)
+    console.print(table)
+    console.print(
+        f"API enabled for [bold]{len(results) - failed}[/bold] organizations,"
+        f" [bold]{failed}[/bold] failed."
+    )
 
-    for org in track(orgs, console=console):
+
+def _enable_api(org):
+    """
+    Enable the API for an organization, retrying transient errors with
+    an increasing delay
+    """
+    for attempt in range(MAX_RETRIES + 1):
         try:
-            org = dashboard.organizations.updateOrganization(
-                organizationId=org["id"], name=org["name"], api={"enabled": True}
+            return paced(
+                dashboard.organizations.updateOrganization,
+                organizationId=org["id"],
+                name=org["name"],
+                api={"enabled": True},
             )
-        except APIError:
-            console.print(f"[red]Error enabling API for {org['name']}")
-            continue
-        console.print(f"[green]API enabled for {org['name']}")
+        except APIError as err:
+            if attempt == MAX_RETRIES or err.status not in TRANSIENT_STATUSES:
+                raise
+            time.sleep(2**attempt)
 
 
 @app.command()
@@ -45,57 +123,123 @@ def list_security_events(
     filter_event_name: Optional[str] = typer.Option(
         None, help="Filter by event message"
     ),
+    shard_hours: int = typer.Option(
+        24, min=1, help="Hours of events to get in each request"
+    ),
+    top: int = typer.Option(10, min=1, help="Number of hosts to show per organization"),
+    output: Optional[Path] = typer.Option(
+        None, dir_okay=False, help="Write matching events to a file"
+    ),
+    output_format: Optional[ExportFormat] = typer.Option(
+        None, help="Format of --output, defaults to the file extension"
+    ),
 ):
     """
     List security events for organization(s), filtering by organization or event name
     """
     # Get all accessible organizations, filtering by name if specified
     with status_spinner("Finding organizations"):
-        orgs = dashboard.organizations.getOrganizations()
+        orgs = dashboard.organizations.getOrganizations(total_pages="all")
         if organization_name:
             orgs = [org for org in orgs if org["name"] in organization_name]
     console.print(f"[bold]Found {len(orgs)} organizations.")
 
     # Calculate number of days to look back
-    end_time = datetime.now()
+    end_time = datetime.now().astimezone()
     start_time = end_time - timedelta(days=days_ago)
-    start_time = datetime.combine(start_time, start_time.min.time())
+    start_time = start_time.replace(hour=0, minute=0, second=0, microsecond=0)
     dtformat = "%Y-%m-%d %H:%M:%S"
     console.print(
         f" [italic]Displaying events from {start_time.strftime(dtformat)} to"
         f" {end_time.strftime(dtformat)}."
     )
 
-    # Iterate through each org to gather security events
-    for org in track(orgs, console=console):
-        try:
-            events = dashboard.appliance.getOrganizationApplianceSecurityEvents(
-                organizationId=org["id"],
-                total_pages="all",
-                perPage=1000,
-                t0=start_time,
-                t1=end_time,
+    # Split the time range so large ranges are fetched as many smaller requests
+    shards = time_shards(start_time, end_time, timedelta(hours=shard_hours))
+    requests = [(org, shard, shard == shards[-1]) for org in orgs for shard in shards]
+
+    # Count events and hosts per organization as each request completes, so
+    # only requests in progress are held in memory
+    counts = {org["id"]: 0 for org in orgs}
+    hosts = {org["id"]: Counter() for org in orgs}
+    failed = set()
+    with ExitStack() as stack:
+        write_event = None
+        if output:
+            file = stack.enter_context(open(output, "w", encoding="utf-8", newline=""))
+            write_event = record_writer(
+                file, export_format(output, output_format), EVENT_COLUMNS
             )
-        except APIError:
-            continue
 
-        # Iterate through each event
-        event_hosts = []
-        filtered_events = []
-        for event in events:
-            # Drop events that do not match the filter
-            if filter_event_name is not None:
-                if not filter_event_name in event["message"]:
+        with Progress(console=console) as progress:
+            task = progress.add_task("Getting security events", total=len(requests))
+            for (org, shard, _), events, err in run_concurrently(
+                lambda request: _get_security_events(*request), requests
+            ):
+                progress.advance(task)
+                if err:
+                    failed.add(org["id"])
+                    console.print(
+                        f"[red]Unable to get events for {org['name']} from"
+                        f" {shard[0].strftime(dtformat)}: {api_error_text(err)}"
+                    )
                     continue
-            filtered_events.append(event)
 
-            # Maintain a list of associated hosts
-            if not event["destIp"] in event_hosts:
-                event_hosts.append(event["destIp"])
+                for event in events:
+                    # Drop events that do not match the filter
+                    if filter_event_name is not None:
+                        if filter_event_name not in event.get("message", ""):
+                            continue
+                    counts[org["id"]] += 1
+                    hosts[org["id"]][event.get("destIp")] += 1
+                    if write_event:
+                        write_event({"organization": org["name"], **event})
 
-        if len(filtered_events) > 0:
-            console.print(
-                f"[bold]{org['name']}[/bold] matched {len(filtered_events)} events."
-            )
-            for host in event_hosts:
-                console.print(f" {host}")
+    table = table_with_columns(
+        ["Events", "Hosts", f"Top {top} hosts"],
+        title="Security Events",
+        first_column_name="Organization",
+    )
+    for org in sorted(orgs, key=lambda k: k["name"]):
+        if not counts[org["id"]] and org["id"] not in failed:
+            continue
+        table.add_row(
+            org["name"],
+            str(counts[org["id"]])
+            + (" [red](incomplete)" if org["id"] in failed else ""),
+            str(len(hosts[org["id"]])),
+            "\n".join(
+                f"{host} ({count})" for host, count in hosts[org["id"]].most_common(top)
+            ),
+        )
+    console.print(table)
+    if output:
+        console.print(f"Wrote [bold]{sum(counts.values())}[/bold] events to {output}.")
+
+
+def _get_security_events(org, shard, include_end=False):
+    """
+    Get the security events of an organization from one time window. Events
+    at the end of the window belong to the next window, unless include_end is set
+    """
+    start, end = shard
+    events = paced(
+        dashboard.appliance.getOrganizationApplianceSecurityEvents,
+        organizationId=org["id"],
+        total_pages="all",
+        perPage=1000,
+        t0=start.isoformat(),
+        t1=end.isoformat(),
+    )
+    if include_end:
+        return events
+    return [event for event in events if _event_time(event) < end]
+
+
+def _event_time(event) -> datetime:
+    """
+    Time of a security event, to the second
+    """
+    # Fractional seconds vary in length, which older Pythons can not parse
+    ts = re.sub(r"\.\d+", "", event["ts"]).replace("Z", "+00:00")
+    return datetime.fromisoformat(ts)
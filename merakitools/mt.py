@@ -5,45 +5,119 @@ Billy Zoellers
 CLI tools for managing Meraki networks based on Typer
 """
 
-from typing import List, Optional
+import json
+import operator
+import re
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 import typer
-from merakitools.meraki_helpers import find_org_by_name
-from merakitools.types import MTMetricType
+from rich.progress import Progress
+from merakitools.meraki_helpers import (
+    export_format,
+    find_org_by_name,
+    find_orgs_by_names,
+    get_device_index,
+    get_networks,
+    paced,
+    record_writer,
+    run_concurrently,
+    time_shards,
+)
+from merakitools.sensor_store import (
+    aggregate_readings,
+    mark_synced,
+    open_sensor_store,
+    store_organization,
+    store_readings,
+    stored_organization,
+    sync_marks,
+)
+from merakitools.types import ExportFormat, MTMetricType
 from merakitools.console import console
 from merakitools.dashboardapi import dashboard
 from merakitools.formatting_helpers import table_with_columns
 
 app = typer.Typer()
 
+# Sensor history requests can cover at most 7 days, up to 365 days ago
+MAX_HISTORY_WINDOW = timedelta(days=7)
+MAX_HISTORY_AGE = timedelta(days=365)
+# Columns of sensor readings exported as CSV
+READING_COLUMNS = ["ts", "networkId", "network", "serial", "metric", "unit", "value"]
+# Sensors requested together in one history request
+SYNC_SERIALS_PER_REQUEST = 100
+# Comparisons available in threshold rules, longest first
+THRESHOLD_OPERATORS = {
+    ">=": operator.ge,
+    "<=": operator.le,
+    "==": operator.eq,
+    "!=": operator.ne,
+    ">": operator.gt,
+    "<": operator.lt,
+}
+
 
 @app.command()
 def latest_readings(
-    organization_name: str,
+    organization_name: List[str] = typer.Argument(
+        ..., help="One or more organization names or IDs"
+    ),
     serial: Optional[List[str]] = None,
+    metric_type: Optional[List[MTMetricType]] = None,
+    network: Optional[List[str]] = typer.Option(
+        None, help="Only include sensors in networks with these names or IDs"
+    ),
+    output: Optional[Path] = typer.Option(
+        None, dir_okay=False, help="Write readings to a file instead of a table"
+    ),
+    output_format: Optional[ExportFormat] = typer.Option(
+        None, help="Format of --output, defaults to the file extension"
+    ),
 ):
     """
     Show the latest reading for each metric from each sensor
     """
-    org = find_org_by_name(organization_name)
-    readings = dashboard.sensor.getOrganizationSensorReadingsLatest(org["id"])
+    orgs = find_orgs_by_names(organization_name)
+    readings = []
+    for org, org_readings in _get_latest_readings(orgs, serial, metric_type, network):
+        readings += org_readings
 
-    for device in readings:
-        if serial and device["serial"] not in serial:
-            continue
+    if output:
+        with open(output, "w", encoding="utf-8", newline="") as file:
+            write_reading = _reading_writer(file, export_format(output, output_format))
+            for reading in readings:
+                write_reading(reading)
+        console.print(f"Wrote [bold]{len(readings)}[/bold] readings to {output}.")
+        return
 
-        table = table_with_columns(
-            ["Data", "Time"],
-            title=f"{device['network']['name']}: {device['serial']}",
-            first_column_name="Metric",
+    readings.sort(
+        key=lambda k: (
+            k["organization"],
+            k["network"]["name"],
+            k["serial"],
+            k["metric"],
         )
-        for reading in device["readings"]:
-            table.add_row(
-                reading["metric"].capitalize(),
-                str(reading[reading["metric"]]),
-                reading["ts"],
-            )
-
-        console.print(table)
+    )
+    columns = ["Metric", "Data", "Time"]
+    if len(orgs) > 1:
+        columns.insert(0, "Organization")
+    table = table_with_columns(
+        columns, title="Latest Readings", first_column_name="Network / Serial"
+    )
+    for reading in readings:
+        row = [
+            f"{reading['network']['name']} / {reading['serial']}",
+            reading["metric"],
+            _format_reading_value(reading),
+            reading["ts"],
+        ]
+        if len(orgs) > 1:
+            row.insert(1, reading["organization"])
+        table.add_row(*row)
+    console.print(table)
 
 
 @app.command()
@@ -51,23 +125,54 @@ def history(
     organization_name: str,
     serial: Optional[List[str]] = None,
     metric_type: Optional[List[MTMetricType]] = None,
+    t0: Optional[str] = typer.Option(
+        None, help="Start time (ISO 8601), up to 365 days ago"
+    ),
+    t1: Optional[str] = typer.Option(None, help="End time (ISO 8601), default now"),
+    timespan: int = typer.Option(
+        7200, min=1, help="Seconds of history before --t1 when --t0 is not given"
+    ),
+    shard_hours: int = typer.Option(
+        24, min=1, max=168, help="Hours of history to get in each request"
+    ),
+    output: Optional[Path] = typer.Option(
+        None, dir_okay=False, help="Write readings to a file instead of a table"
+    ),
+    output_format: Optional[ExportFormat] = typer.Option(
+        None, help="Format of --output, defaults to the file extension"
+    ),
 ):
     """
     Show the historical sensor readings for an organization
     """
     org = find_org_by_name(organization_name)
-    readings = dashboard.sensor.getOrganizationSensorReadingsHistory(org["id"])
+    start, end = _time_window(t0, t1, timespan)
+    shards = time_shards(
+        start, end, min(timedelta(hours=shard_hours), MAX_HISTORY_WINDOW)
+    )
+
+    # Filter readings in the API rather than after they are received
+    filters = {}
+    if serial:
+        filters["serials"] = serial
+    if metric_type:
+        filters["metrics"] = [metric.value for metric in metric_type]
+
+    if output:
+        output_format = export_format(output, output_format)
+        count = _export_history(org["id"], shards, filters, output, output_format)
+        console.print(f"Wrote [bold]{count}[/bold] readings to {output}.")
+        return
+
+    readings = []
+    for _, shard_readings in _get_history_shards(org["id"], shards, filters):
+        readings += shard_readings
+    readings.sort(key=lambda k: k["ts"])
 
     table = table_with_columns(
         ["Data", "Time", "Network / Serial"], "History", first_column_name="Metric"
     )
     for reading in readings:
-        if metric_type and reading["metric"] not in metric_type:
-            continue
-
-        if serial and reading["serial"] not in serial:
-            continue
-
         table.add_row(
             reading["metric"],
             str(reading[reading["metric"]]),
@@ -75,3 +180,493 @@ def history(
             f"{reading['network']['name']} / {reading['serial']}",
         )
     console.print(table)
+
+
+@app.command()
+def sync_history(
+    organization_name: str,
+    serial: Optional[List[str]] = None,
+    metric_type: Optional[List[MTMetricType]] = None,
+    days: int = typer.Option(
+        7, min=1, max=365, help="Days of history to get for sensors not yet synced"
+    ),
+    shard_hours: int = typer.Option(
+        24, min=1, max=168, help="Hours of history to get in each request"
+    ),
+):
+    """
+    Add sensor readings newer than the last sync to the local sensor store
+    """
+    org = find_org_by_name(organization_name)
+    db = open_sensor_store()
+    store_organization(db, org)
+
+    if not serial:
+        with console.status("Getting sensors..", spinner="material"):
+            devices = get_device_index(org["id"])
+        serial = [
+            sensor
+            for sensor, device in devices.items()
+            if device.get("productType") == "sensor"
+        ]
+    # Without --metric-type every metric of a sensor is synced together
+    metrics = [metric.value for metric in metric_type or []] or [""]
+
+    # Start each (serial, metric) at the time it was last synced up to. A
+    # sync of every metric also covers each single metric
+    now = datetime.now(timezone.utc)
+    marks = sync_marks(db, org["id"])
+    oldest = now - MAX_HISTORY_AGE + timedelta(hours=1)
+    starts = {}
+    for sensor in serial:
+        for metric in metrics:
+            synced_to = marks.get((sensor, metric)) or marks.get((sensor, ""))
+            start = (
+                datetime.fromtimestamp(synced_to, timezone.utc)
+                if synced_to
+                else now - timedelta(days=days)
+            )
+            start = max(start, oldest)
+            starts.setdefault(start, {}).setdefault(sensor, []).append(metric)
+
+    # Sensors with the same start and metrics share requests, so the serials
+    # and metrics filters of each request cover exactly the pairs it syncs
+    groups = {}
+    for start, sensor_metrics in starts.items():
+        for sensor, sensor_metric_list in sensor_metrics.items():
+            groups.setdefault((start, tuple(sensor_metric_list)), []).append(sensor)
+
+    windows = []
+    for (start, group_metrics), serials in sorted(groups.items()):
+        for idx in range(0, len(serials), SYNC_SERIALS_PER_REQUEST):
+            filters = {"serials": serials[idx : idx + SYNC_SERIALS_PER_REQUEST]}
+            if group_metrics != ("",):
+                filters["metrics"] = list(group_metrics)
+            shards = time_shards(
+                start, now, min(timedelta(hours=shard_hours), MAX_HISTORY_WINDOW)
+            )
+            windows += [(shard, filters, shard == shards[-1]) for shard in shards]
+
+    added = 0
+    failed = []
+    with Progress(console=console) as progress:
+        task = progress.add_task("Syncing sensor history", total=len(windows))
+        for (shard, filters, _), readings, err in run_concurrently(
+            lambda request: _get_history_shard(org["id"], *request), windows
+        ):
+            progress.advance(task)
+            if err:
+                console.print(
+                    f"[red]Unable to get readings from {shard[0].isoformat()}:"
+                    f" {err.message}"
+                )
+                failed.append(filters)
+                continue
+            added += store_readings(db, org["id"], readings)
+
+    # Pairs with a failed request keep their previous mark, so the next sync
+    # gets the missing readings again
+    unsynced = {
+        (sensor, metric)
+        for filters in failed
+        for sensor in filters["serials"]
+        for metric in filters.get("metrics", [""])
+    }
+    mark_synced(
+        db,
+        org["id"],
+        (
+            (sensor, metric)
+            for sensor in serial
+            for metric in metrics
+            if (sensor, metric) not in unsynced
+        ),
+        now.timestamp(),
+    )
+    if failed:
+        console.print(
+            f"[red]{len(failed)} requests failed, {len(unsynced)} sensor metrics"
+            " were not marked as synced."
+        )
+    console.print(
+        f"Added [bold]{added}[/bold] readings from {len(serial)} sensors"
+        f" in {len(windows)} requests."
+    )
+
+
+@app.command()
+def history_summary(
+    organization_name: str,
+    serial: Optional[List[str]] = None,
+    metric_type: Optional[List[MTMetricType]] = None,
+    t0: Optional[str] = typer.Option(None, help="Start time (ISO 8601)"),
+    t1: Optional[str] = typer.Option(None, help="End time (ISO 8601), default now"),
+    timespan: int = typer.Option(
+        86400, min=1, help="Seconds of history before --t1 when --t0 is not given"
+    ),
+    interval: int = typer.Option(
+        3600, min=60, help="Seconds of readings summarized in each row"
+    ),
+):
+    """
+    Summarize synced sensor readings from the local sensor store, without
+    using the API
+    """
+    db = open_sensor_store()
+    org = stored_organization(db, organization_name)
+    if org is None:
+        console.print(
+            f"[red]Organization [bold]{organization_name}[/bold] has not been synced."
+            " Run [bold]mt sync-history[/bold] first."
+        )
+        raise typer.Abort()
+
+    start, end = _time_window(t0, t1, timespan)
+    rows = aggregate_readings(
+        db,
+        org["id"],
+        start.timestamp(),
+        end.timestamp(),
+        interval,
+        serials=serial,
+        metrics=[metric.value for metric in metric_type or []],
+    )
+
+    table = table_with_columns(
+        ["Metric", "Period", "Min", "Max", "Mean", "Readings"],
+        title=f"{org['name']}: Sensor History",
+        first_column_name="Network / Serial",
+    )
+    for row in rows:
+        unit = f" ({row['unit']})" if row["unit"] else ""
+        table.add_row(
+            f"{row['network_name']} / {row['serial']}",
+            f"{row['metric']}{unit}",
+            datetime.fromtimestamp(row["period"], timezone.utc).isoformat(),
+            *(
+                "" if row[col] is None else f"{row[col]:g}"
+                for col in ("minimum", "maximum")
+            ),
+            "" if row["mean"] is None else f"{row['mean']:.2f}",
+            str(row["readings"]),
+        )
+    console.print(table)
+
+
+@app.command()
+def watch(
+    organization_name: List[str] = typer.Argument(
+        ..., help="One or more organization names or IDs"
+    ),
+    serial: Optional[List[str]] = None,
+    metric_type: Optional[List[MTMetricType]] = None,
+    network: Optional[List[str]] = typer.Option(
+        None, help="Only include sensors in networks with these names or IDs"
+    ),
+    threshold: Optional[List[str]] = typer.Option(
+        None,
+        help="Rule such as 'temperature.celsius>25' or 'door.open==true',"
+        " reported when crossed",
+    ),
+    interval: int = typer.Option(60, min=10, help="Seconds between polls"),
+    count: int = typer.Option(
+        0, min=0, help="Stop after this many polls, 0 to run until stopped"
+    ),
+    output: Optional[Path] = typer.Option(
+        None, dir_okay=False, help="Append events to a file instead of stdout"
+    ),
+):
+    """
+    Poll the latest sensor readings and write changed readings and threshold
+    crossings as NDJSON events
+    """
+    rules = {}
+    for text in threshold or []:
+        rule = ThresholdRule(text)
+        rules.setdefault(rule.metric, []).append(rule)
+
+    # Keep stdout for events, sending status and errors to stderr
+    if output is None:
+        console.stderr = True
+    orgs = find_orgs_by_names(organization_name)
+
+    previous = {}
+    exceeded = set()
+    file = open(output, "a", encoding="utf-8") if output else sys.stdout
+    try:
+        polls = 0
+        while True:
+            started = time.monotonic()
+            for _, readings in _get_latest_readings(orgs, serial, metric_type, network):
+                for event in _watch_events(readings, rules, previous, exceeded):
+                    file.write(json.dumps(event) + "\n")
+            file.flush()
+
+            polls += 1
+            if count and polls >= count:
+                break
+            time.sleep(max(0, interval - (time.monotonic() - started)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if output:
+            file.close()
+
+
+def _parse_time(value: str) -> datetime:
+    """
+    Parse an ISO 8601 time, in UTC unless it includes an offset
+    """
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError as err:
+        console.print(f"[red]Invalid time {value}: {err}")
+        raise typer.Abort()
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _time_window(t0, t1, timespan) -> Tuple[datetime, datetime]:
+    """
+    Start and end of a time window from --t0, --t1 and --timespan
+    """
+    end = _parse_time(t1) if t1 else datetime.now(timezone.utc)
+    start = _parse_time(t0) if t0 else end - timedelta(seconds=timespan)
+    if start >= end:
+        console.print("[red]The start time must be before the end time.")
+        raise typer.Abort()
+    return start, end
+
+
+def _get_history_shard(organization_id, shard, filters, include_end=False):
+    """
+    Get sensor readings from one time window. Readings at the end of the
+    window belong to the next window, unless include_end is set
+    """
+    start, end = shard
+    readings = paced(
+        dashboard.sensor.getOrganizationSensorReadingsHistory,
+        organization_id,
+        total_pages="all",
+        perPage=1000,
+        t0=start.isoformat(),
+        t1=end.isoformat(),
+        **filters,
+    )
+    if include_end:
+        return readings
+    return [reading for reading in readings if _parse_time(reading["ts"]) < end]
+
+
+def _get_history_shards(organization_id, shards, filters):
+    """
+    Get sensor readings from many time windows concurrently, yielding
+    (shard, readings) as each window is received
+    """
+    with Progress(console=console) as progress:
+        task = progress.add_task("Getting sensor history", total=len(shards))
+        for shard, readings, err in run_concurrently(
+            lambda shard: _get_history_shard(
+                organization_id, shard, filters, include_end=shard == shards[-1]
+            ),
+            shards,
+        ):
+            progress.advance(task)
+            if err:
+                console.print(
+                    f"[red]Unable to get readings from {shard[0].isoformat()}:"
+                    f" {err.message}"
+                )
+                continue
+            yield shard, readings
+
+
+def _reading_csv_row(reading: Dict) -> Dict:
+    """
+    CSV columns of a sensor reading
+    """
+    # Each metric has one or more values, such as celsius and fahrenheit
+    values = reading.get(reading["metric"]) or {}
+    unit, value = next(iter(values.items()), ("", ""))
+    return {
+        "ts": reading["ts"],
+        "networkId": reading["network"]["id"],
+        "network": reading["network"]["name"],
+        "serial": reading["serial"],
+        "metric": reading["metric"],
+        "unit": unit,
+        "value": value,
+    }
+
+
+def _reading_writer(file, output_format: ExportFormat):
+    """
+    Function writing one sensor reading at a time to a file
+    """
+    return record_writer(file, output_format, READING_COLUMNS, _reading_csv_row)
+
+
+def _export_history(organization_id, shards, filters, output, output_format):
+    """
+    Write sensor readings to a file as each time window is received, so only
+    the windows in progress are held in memory
+    """
+    count = 0
+    with open(output, "w", encoding="utf-8", newline="") as file:
+        write_reading = _reading_writer(file, output_format)
+        for _, readings in _get_history_shards(organization_id, shards, filters):
+            for reading in readings:
+                write_reading(reading)
+            count += len(readings)
+    return count
+
+
+def _format_reading_value(reading: Dict) -> str:
+    """
+    Values of a reading with their units
+    """
+    values = reading.get(reading["metric"]) or {}
+    return ", ".join(f"{unit}: {value}" for unit, value in values.items())
+
+
+def _latest_filters(org, serial, metric_type, network) -> Optional[Dict]:
+    """
+    API filters for the latest readings of an organization, or None when
+    none of the given networks are in the organization
+    """
+    filters = {}
+    if serial:
+        filters["serials"] = serial
+    if metric_type:
+        filters["metrics"] = [metric.value for metric in metric_type]
+    if network:
+        network_ids = [
+            net["id"]
+            for net in get_networks(org["id"], product_type="sensor")
+            if net["id"] in network or net["name"] in network
+        ]
+        if not network_ids:
+            return None
+        filters["networkIds"] = network_ids
+    return filters
+
+
+def _get_latest_readings(orgs, serial, metric_type, network):
+    """
+    Get the latest sensor readings from organizations concurrently, yielding
+    (organization, readings) as each is received. Each reading is flattened
+    to match history readings
+    """
+    requests = []
+    for org in orgs:
+        filters = _latest_filters(org, serial, metric_type, network)
+        if filters is not None:
+            requests.append((org, filters))
+    if not requests:
+        console.print("[red]None of the networks were found.")
+        raise typer.Abort()
+
+    for (org, _), devices, err in run_concurrently(
+        lambda request: paced(
+            dashboard.sensor.getOrganizationSensorReadingsLatest,
+            request[0]["id"],
+            total_pages="all",
+            perPage=100,
+            **request[1],
+        ),
+        requests,
+    ):
+        if err:
+            console.print(
+                f"[red]Unable to get readings for {org['name']}: {err.message}"
+            )
+            continue
+        yield org, [
+            {
+                "organization": org["name"],
+                "serial": device["serial"],
+                "network": device["network"],
+                **reading,
+            }
+            for device in devices
+            for reading in device["readings"]
+        ]
+
+
+class ThresholdRule:
+    """
+    Threshold on one value of a sensor metric, such as 'temperature.celsius>25'.
+    Without a unit, the first value of the metric is compared
+    """
+
+    def __init__(self, text: str):
+        match = re.fullmatch(
+            r"\s*(\w+)(?:\.(\w+))?\s*(>=|<=|==|!=|>|<)\s*(\S+)\s*", text
+        )
+        if not match or match[1] not in MTMetricType.__members__:
+            console.print(f"[red]Invalid threshold rule {text}")
+            raise typer.Abort()
+        self.text = text.strip()
+        self.metric, self.unit, operator_text, value = match.groups()
+        self.compare = THRESHOLD_OPERATORS[operator_text]
+        if value.lower() in ("true", "false"):
+            self.value = value.lower() == "true"
+        else:
+            try:
+                self.value = float(value)
+            except ValueError:
+                console.print(f"[red]Invalid threshold value {value} in {text}")
+                raise typer.Abort()
+
+    def reading_value(self, reading: Dict):
+        """
+        Value of a reading compared by this rule, or None if it has no value
+        """
+        values = reading.get(self.metric) or {}
+        if self.unit:
+            return values.get(self.unit)
+        return next(iter(values.values()), None)
+
+    def exceeded(self, reading: Dict) -> Optional[bool]:
+        """
+        Whether a reading meets the rule, or None if it can not be compared
+        """
+        value = self.reading_value(reading)
+        if value is None or isinstance(value, bool) != isinstance(self.value, bool):
+            return None
+        return self.compare(value, self.value)
+
+
+def _watch_events(readings, rules, previous, exceeded):
+    """
+    Events for readings whose values changed since the last poll, and for
+    threshold rules that became met or cleared. Updates previous values and
+    the set of (serial, rule) thresholds currently met
+    """
+    for reading in readings:
+        key = (reading["serial"], reading["metric"])
+        values = reading.get(reading["metric"])
+        if previous.get(key) != values:
+            yield {"event": "reading", "previous": previous.get(key), **reading}
+            previous[key] = values
+
+        # Only rules for the metric of this reading are evaluated
+        for rule in rules.get(reading["metric"], []):
+            met = rule.exceeded(reading)
+            state = (reading["serial"], rule.text)
+            if met is None or met == (state in exceeded):
+                continue
+            if met:
+                exceeded.add(state)
+            else:
+                exceeded.discard(state)
+            yield {
+                "event": "threshold",
+                "rule": rule.text,
+                "state": "exceeded" if met else "cleared",
+                "value": rule.reading_value(reading),
+                "organization": reading["organization"],
+                "serial": reading["serial"],
+                "network": reading["network"],
+                "metric": reading["metric"],
+                "ts": reading["ts"],
+            }
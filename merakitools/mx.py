@@ -5,16 +5,27 @@ Billy Zoellers
 CLI tools for managing Meraki networks based on Typer
 """
 
-from typing import List, Optional
+import csv
+import re
+from pathlib import Path
+from typing import List, Optional, Tuple
 import ipaddress
 import typer
+from rich.progress import Progress
 from rich.prompt import Confirm
+from merakitools.cache import cached, cached_value, invalidate, store
 from merakitools.console import console, status_spinner
 from merakitools.dashboardapi import dashboard, APIError
 from merakitools.meraki_helpers import (
+    api_error_text,
     find_network_by_name,
+    find_org_by_name,
+    get_networks,
+    paced,
+    run_concurrently,
 )
 from merakitools.formatting_helpers import table_with_columns, table_mx_onetoone_nat
+from merakitools.prefix_trie import PrefixTrie
 from merakitools.types import MXInternetUplinks
 
 app = typer.Typer()
@@ -31,14 +42,7 @@ def list_vlans(
     # Find network and VLANs
     net = find_network_by_name(organization_name, network_name)
     with status_spinner("Getting VLANs"):
-        if dashboard.appliance.getNetworkApplianceVlansSettings(networkId=net["id"])[
-            "vlansEnabled"
-        ]:
-            vlans = dashboard.appliance.getNetworkApplianceVlans(networkId=net["id"])
-        else:
-            vlans = dashboard.appliance.getNetworkApplianceSingleLan(
-                networkId=net["id"]
-            )
+        vlans = _get_network_vlans(net)
 
     # Create a table, including extra columns if --include-dhcp is specified
     columns = ["ID", "Subnet", "Appliance IP"]
@@ -52,11 +56,12 @@ def list_vlans(
             vlan["subnet"],
             vlan["applianceIp"],
         ]
+        dhcp_cols = []
         if include_dhcp:
-            dhcp_cols = [vlan["dhcpHandling"]]
-            if "Relay" in vlan["dhcpHandling"]:
+            dhcp_cols = [vlan.get("dhcpHandling", "")]
+            if "Relay" in dhcp_cols[0]:
                 dhcp_cols.append(f"Relays: {', '.join(vlan['dhcpRelayServerIps'])}")
-            elif "DHCP server" in vlan["dhcpHandling"]:
+            elif "DHCP server" in dhcp_cols[0]:
                 dhcp_cols.append(f"Lease time: {vlan['dhcpLeaseTime']}")
             else:
                 dhcp_cols.append("")
@@ -65,6 +70,207 @@ def list_vlans(
     console.print(table)
 
 
+def _get_network_vlans(net):
+    """
+    Get VLANs of an appliance network, or its single LAN if VLANs are disabled
+    """
+    try:
+        return paced(dashboard.appliance.getNetworkApplianceVlans, networkId=net["id"])
+    except APIError as err:
+        # Networks without VLANs enabled return a bad request error
+        if err.status != 400:
+            raise
+
+    lan = paced(dashboard.appliance.getNetworkApplianceSingleLan, networkId=net["id"])
+    return [{"id": "", "name": "Single LAN", **lan}]
+
+
+def _get_org_subnets(org, refresh=False):
+    """
+    VLAN subnets of every appliance network in an organization from the local
+    cache, and the names of networks that could not be read
+    """
+
+    def get_org_subnets():
+        networks = get_networks(org["id"], product_type="appliance", refresh=refresh)
+        subnets, errors = [], []
+        with Progress(console=console) as progress:
+            task = progress.add_task("Getting VLANs", total=len(networks))
+            for net, vlans, err in run_concurrently(_get_network_vlans, networks):
+                progress.advance(task)
+                if err:
+                    errors.append(net["name"])
+                    continue
+                subnets += [
+                    {
+                        "networkId": net["id"],
+                        "network": net["name"],
+                        "vlan": str(vlan["id"]),
+                        "name": vlan["name"],
+                        "subnet": vlan["subnet"],
+                        "applianceIp": vlan.get("applianceIp"),
+                    }
+                    for vlan in vlans
+                    if vlan.get("subnet")
+                ]
+        return {"subnets": subnets, "errors": errors}
+
+    # Never cache an incomplete inventory
+    key = f"org-appliance-subnets-{org['id']}"
+    org_subnets = None if refresh else cached_value(key)
+    if org_subnets is None:
+        org_subnets = get_org_subnets()
+        if not org_subnets["errors"]:
+            store(key, org_subnets)
+    if org_subnets["errors"]:
+        console.print(
+            f"[yellow]Unable to get VLANs for {', '.join(org_subnets['errors'])}"
+        )
+    return org_subnets["subnets"]
+
+
+def _subnet_trie(subnets):
+    """
+    Index subnets by prefix
+    """
+    trie = PrefixTrie()
+    for subnet in subnets:
+        try:
+            trie.insert(subnet["subnet"], subnet)
+        except ValueError:
+            console.print(
+                f"[yellow]Ignoring invalid subnet {subnet['subnet']} in"
+                f" {subnet['network']}"
+            )
+    return trie
+
+
+def _format_vlan(subnet):
+    """
+    VLAN ID and name of a subnet
+    """
+    return " ".join(value for value in (subnet["vlan"], subnet["name"]) if value)
+
+
+@app.command()
+def audit_subnets(
+    organization_name: str,
+    refresh: bool = typer.Option(False, help="Ignore cached VLAN data"),
+):
+    """
+    Find VLAN subnets that overlap between appliance networks in an organization
+    """
+    org = find_org_by_name(organization_name)
+    trie = _subnet_trie(_get_org_subnets(org, refresh=refresh))
+
+    # Subnets within one network can not overlap, only report groups of a
+    # subnet and the equal or nested subnets that span networks
+    groups = sorted(
+        (
+            group
+            for group in trie.overlap_groups()
+            if len({subnet["networkId"] for _, subnet in group}) > 1
+        ),
+        key=lambda group: (group[0][0].version, group[0][0]),
+    )
+    if not groups:
+        console.print(f"[green]No overlapping subnets found in {len(trie)} subnets.")
+        raise typer.Exit()
+
+    table = table_with_columns(
+        ["Networks", "Network / VLAN"],
+        title=f"Overlapping subnets in {org['name']}",
+        first_column_name="Subnet",
+    )
+    for group in groups:
+        by_prefix = {}
+        for prefix, subnet in group:
+            by_prefix.setdefault(prefix, []).append(subnet)
+        for idx, (prefix, subnets) in enumerate(by_prefix.items()):
+            table.add_row(
+                str(prefix) if idx == 0 else f"  └ {prefix}",
+                str(len(subnets)),
+                ", ".join(
+                    f"{subnet['network']} ({_format_vlan(subnet)})"
+                    for subnet in sorted(subnets, key=lambda k: k["network"])
+                ),
+                end_section=idx == len(by_prefix) - 1,
+            )
+    console.print(table)
+    networks = {subnet["networkId"] for group in groups for _, subnet in group}
+    console.print(
+        f"[red]{len(groups)}[/red] groups of overlapping subnets in {len(networks)}"
+        f" networks, of {len(trie)} subnets."
+    )
+
+
+@app.command()
+def find_ip(
+    organization_name: str,
+    address: Optional[List[str]] = typer.Argument(None, help="IP address(es)"),
+    file: Optional[Path] = typer.Option(
+        None, exists=True, dir_okay=False, help="File with one IP address per line"
+    ),
+    refresh: bool = typer.Option(False, help="Ignore cached VLAN data"),
+):
+    """
+    Find the appliance network and VLAN that own IP addresses
+    """
+    addresses = _read_addresses(address, file)
+    org = find_org_by_name(organization_name)
+    trie = _subnet_trie(_get_org_subnets(org, refresh=refresh))
+
+    table = table_with_columns(
+        ["Network", "VLAN", "Subnet", "Appliance IP", "Also in"],
+        title=f"IP addresses in {org['name']}",
+        first_column_name="Address",
+    )
+    for addr in addresses:
+        try:
+            matches = trie.covering(ipaddress.ip_address(addr))
+        except ValueError:
+            table.add_row(addr, "[red]Invalid address", "", "", "", "")
+            continue
+        if not matches:
+            table.add_row(addr, "[yellow]Not found", "", "", "", "")
+            continue
+
+        # The most specific subnet owns the address
+        _, owner = matches[-1]
+        others = [
+            subnet["network"]
+            for _, subnet in matches[:-1]
+            if subnet["networkId"] != owner["networkId"]
+        ]
+        table.add_row(
+            addr,
+            owner["network"],
+            _format_vlan(owner),
+            owner["subnet"],
+            owner["applianceIp"] or "",
+            f"[red]{', '.join(others)}" if others else "",
+        )
+    console.print(table)
+
+
+def _read_addresses(address, file):
+    """
+    Combine IP addresses given as arguments with those in a file, one per line
+    """
+    addresses = [*address] if address else []
+    if file:
+        with open(file, encoding="utf-8") as ip_file:
+            addresses += [
+                line.strip()
+                for line in ip_file
+                if line.strip() and not line.startswith("#")
+            ]
+    if not addresses:
+        console.print("No addresses provided.")
+        raise typer.Abort()
+    return addresses
+
+
 @app.command()
 def list_routes(
     organization_name: str,
@@ -124,6 +330,211 @@ def list_routes(
     console.print(table)
 
 
+def _select_networks(org, network_name, refresh=False):
+    """
+    Appliance networks with the given names, or all appliance networks
+    """
+    networks = get_networks(org["id"], product_type="appliance", refresh=refresh)
+    if not network_name:
+        return networks
+
+    networks = [net for net in networks if net["name"] in network_name]
+    missing = set(network_name) - {net["name"] for net in networks}
+    if missing:
+        console.print(f"[red]Networks not found: {', '.join(sorted(missing))}")
+        raise typer.Abort()
+    return networks
+
+
+def _get_network_routing(net):
+    """
+    Get VLANs and static routes of an appliance network
+    """
+    return {
+        "vlans": _get_network_vlans(net),
+        "routes": paced(
+            dashboard.appliance.getNetworkApplianceStaticRoutes, networkId=net["id"]
+        ),
+    }
+
+
+def _get_routing_tries(organization_name, network_name, refresh=False):
+    """
+    Prefix tries of the VLAN subnets and enabled static routes of appliance
+    networks, each from the local cache
+    """
+    org = find_org_by_name(organization_name)
+    networks = _select_networks(org, network_name, refresh=refresh)
+
+    tries = {}
+    with Progress(console=console) as progress:
+        task = progress.add_task("Getting routes", total=len(networks))
+        for net, routing, err in run_concurrently(
+            lambda net: cached(
+                f"network-routing-{net['id']}",
+                _get_network_routing,
+                net,
+                refresh=refresh,
+            ),
+            networks,
+        ):
+            progress.advance(task)
+            if err:
+                console.print(f"[yellow]Unable to get routes for {net['name']}")
+                continue
+
+            # VLANs are added last, so they win over static routes for the same subnet
+            trie = PrefixTrie()
+            for route in routing["routes"]:
+                if route.get("enabled", True):
+                    trie.insert(
+                        route["subnet"],
+                        {
+                            "type": "Static",
+                            "name": route["name"],
+                            "subnet": route["subnet"],
+                            "nextHop": route["gatewayIp"],
+                        },
+                    )
+            for vlan in routing["vlans"]:
+                if vlan.get("subnet"):
+                    trie.insert(
+                        vlan["subnet"],
+                        {
+                            "type": "VLAN",
+                            "name": _format_vlan(
+                                {"vlan": str(vlan["id"]), "name": vlan["name"]}
+                            ),
+                            "subnet": vlan["subnet"],
+                            "nextHop": vlan.get("applianceIp") or "",
+                        },
+                    )
+            tries[net["name"]] = trie
+    return tries
+
+
+@app.command()
+def lookup_route(
+    organization_name: str,
+    address: Optional[List[str]] = typer.Argument(None, help="IP address(es)"),
+    network_name: Optional[List[str]] = typer.Option(
+        None, help="Network(s) to look up routes in, defaults to all"
+    ),
+    file: Optional[Path] = typer.Option(
+        None, exists=True, dir_okay=False, help="File with one IP address per line"
+    ),
+    refresh: bool = typer.Option(False, help="Ignore cached route data"),
+):
+    """
+    Find the VLAN or static route that MX devices use for IP addresses, by
+    longest prefix match
+    """
+    addresses = _read_addresses(address, file)
+    tries = _get_routing_tries(organization_name, network_name, refresh=refresh)
+
+    table = table_with_columns(
+        ["Network", "Prefix", "Type", "Name", "Next hop"],
+        title="Route lookup",
+        first_column_name="Address",
+    )
+    for addr in addresses:
+        try:
+            ip = ipaddress.ip_address(addr)
+        except ValueError:
+            table.add_row(
+                addr, "[red]Invalid address", "", "", "", "", end_section=True
+            )
+            continue
+
+        rows = [(net_name, trie.lookup(ip)) for net_name, trie in sorted(tries.items())]
+        rows = [(net_name, match) for net_name, match in rows if match]
+        if not rows:
+            table.add_row(
+                addr, "[yellow]No route, uses uplink", "", "", "", "", end_section=True
+            )
+            continue
+        for idx, (net_name, (_, route)) in enumerate(rows):
+            table.add_row(
+                addr if idx == 0 else "",
+                net_name,
+                route["subnet"],
+                route["type"],
+                route["name"],
+                route["nextHop"],
+                end_section=idx == len(rows) - 1,
+            )
+    console.print(table)
+
+
+@app.command()
+def audit_routes(
+    organization_name: str,
+    network_name: Optional[List[str]] = typer.Option(
+        None, help="Network(s) to audit, defaults to all"
+    ),
+    refresh: bool = typer.Option(False, help="Ignore cached route data"),
+):
+    """
+    Find shadowed and redundant MX static routes
+    """
+    tries = _get_routing_tries(organization_name, network_name, refresh=refresh)
+
+    table = table_with_columns(
+        ["Route", "Subnet", "Next hop", "Issue"],
+        title="Static route issues",
+        first_column_name="Network",
+    )
+    issues = 0
+    for net_name, trie in sorted(tries.items()):
+        for network, route in trie:
+            if route["type"] != "Static":
+                continue
+
+            # Other prefixes covering this route, least specific first
+            covering = [
+                (other_network, other)
+                for other_network, other in trie.covering(network)
+                if other is not route
+            ]
+            same = [
+                other for other_network, other in covering if other_network == network
+            ]
+            parent = next(
+                (
+                    other
+                    for other_network, other in reversed(covering)
+                    if other_network != network
+                ),
+                None,
+            )
+
+            if any(other["type"] == "VLAN" for other in same):
+                issue = "[red]Shadowed by VLAN with the same subnet"
+            elif any(other["nextHop"] != route["nextHop"] for other in same):
+                issue = "[red]Conflicts with another route for the same subnet"
+            elif same:
+                issue = "[yellow]Duplicate of another route"
+            elif (
+                parent
+                and parent["type"] == "Static"
+                and parent["nextHop"] == route["nextHop"]
+            ):
+                issue = f"[yellow]Redundant, covered by {parent['name']} ({parent['subnet']})"
+            else:
+                continue
+
+            issues += 1
+            table.add_row(
+                net_name, route["name"], route["subnet"], route["nextHop"], issue
+            )
+
+    if not issues:
+        console.print(f"[green]No route issues found in {len(tries)} networks.")
+        raise typer.Exit()
+    console.print(table)
+    console.print(f"Found [bold]{issues}[/bold] route issues in {len(tries)} networks.")
+
+
 @app.command()
 def delete_route(
     organization_name: str,
@@ -147,14 +558,13 @@ def delete_route(
             networkId=net["id"]
         )
 
+    existing_routes = {route["subnet"]: route for route in existing_routes}
+
     # Iterate through each provided subnet and remove route
     for delete_net in subnet:
         # Try to find a matching route
-        try:
-            found = next(
-                route for route in existing_routes if route["subnet"] == delete_net
-            )
-        except StopIteration:
+        found = existing_routes.get(delete_net)
+        if found is None:
             console.print(f" [red bold]Route matching '{delete_net}' not found.")
             continue
 
@@ -179,6 +589,166 @@ def delete_route(
         console.print(f" [green]Deleted route {found_text}")
 
 
+@app.command()
+def delete_routes(
+    organization_name: str,
+    network_name: Optional[List[str]] = typer.Option(
+        None, help="Network(s) to delete routes from, defaults to all"
+    ),
+    within: Optional[str] = typer.Option(
+        None, help="Delete routes for subnets within this prefix"
+    ),
+    name: Optional[str] = typer.Option(
+        None, help="Delete routes with names matching this regular expression"
+    ),
+    gateway: Optional[str] = typer.Option(
+        None, help="Delete routes with a gateway IP equal to or within this prefix"
+    ),
+    dry_run: bool = typer.Option(False, help="Show planned changes only"),
+    confirm: bool = typer.Option(True, help="Confirm before applying changes"),
+):
+    """
+    Delete static routes matching all given selectors from MX devices in many
+    networks
+    """
+    if not (within or name or gateway):
+        console.print("Specify at least one of --within, --name or --gateway.")
+        raise typer.Abort()
+
+    # Validate selectors before getting any routes
+    try:
+        within = ipaddress.ip_network(within, strict=False) if within else None
+        gateway = ipaddress.ip_network(gateway, strict=False) if gateway else None
+    except ValueError as err:
+        console.print(f"[red]{err}")
+        raise typer.Abort()
+    try:
+        name = re.compile(name) if name else None
+    except re.error as err:
+        console.print(f"[red]Invalid --name expression: {err}")
+        raise typer.Abort()
+
+    org = find_org_by_name(organization_name)
+    networks = _select_networks(org, network_name, refresh=True)
+
+    # Get routes of every network and find matches
+    matches = []
+    with Progress(console=console) as progress:
+        task = progress.add_task("Getting routes", total=len(networks))
+        for net, routes, err in run_concurrently(
+            lambda net: paced(
+                dashboard.appliance.getNetworkApplianceStaticRoutes,
+                networkId=net["id"],
+            ),
+            networks,
+        ):
+            progress.advance(task)
+            if err:
+                console.print(f"[red]Unable to get routes for {net['name']}")
+                continue
+            matches += [
+                {**route, "network": net["name"], "networkId": net["id"]}
+                for route in routes
+                if _route_matches(route, within, name, gateway)
+            ]
+
+    if not matches:
+        console.print("No matching routes found.")
+        raise typer.Exit()
+
+    # Show a single plan of all deletions
+    matches.sort(
+        key=lambda k: (
+            k["network"],
+            ipaddress.ip_network(k["subnet"]).version,
+            ipaddress.ip_network(k["subnet"]),
+        )
+    )
+    table = table_with_columns(
+        ["Name", "Subnet", "Gateway", "Enabled"],
+        title="Routes to delete",
+        first_column_name="Network",
+    )
+    for route in matches:
+        table.add_row(
+            route["network"],
+            route["name"],
+            route["subnet"],
+            route["gatewayIp"],
+            "[green]Enabled" if route["enabled"] else "[red]Disabled",
+        )
+    console.print(table)
+
+    if dry_run:
+        raise typer.Exit()
+    network_count = len({route["networkId"] for route in matches})
+    if confirm and not Confirm.ask(
+        f"Delete {len(matches)} routes from {network_count} networks?",
+        console=console,
+    ):
+        raise typer.Abort()
+
+    failures = _delete_routes(matches)
+    for route, error in failures:
+        console.print(
+            f" [red]{route['network']} {route['name']} ({route['subnet']}): {error}"
+        )
+
+
+def _route_matches(route, within, name, gateway):
+    """
+    Whether a static route matches all of the given selectors
+    """
+    try:
+        if within and not ipaddress.ip_network(route["subnet"]).subnet_of(within):
+            return False
+        if gateway and ipaddress.ip_address(route["gatewayIp"]) not in gateway:
+            return False
+    except (TypeError, ValueError):
+        # Different IP versions or invalid addresses never match
+        return False
+    return not name or bool(name.search(route["name"]))
+
+
+def _delete_routes(routes):
+    """
+    Delete static routes, one network at a time per worker as static routes
+    can not be deleted with action batches. Returns (route, error) for each
+    route that failed
+    """
+    by_network = {}
+    for route in routes:
+        by_network.setdefault(route["networkId"], []).append(route)
+
+    failures = []
+    with Progress(console=console) as progress:
+        task = progress.add_task("Deleting routes", total=len(routes))
+
+        def delete_network_routes(network_id):
+            net_failures = []
+            for route in by_network[network_id]:
+                try:
+                    paced(
+                        dashboard.appliance.deleteNetworkApplianceStaticRoute,
+                        networkId=network_id,
+                        staticRouteId=route["id"],
+                    )
+                except APIError as err:
+                    net_failures.append((route, api_error_text(err)))
+                progress.advance(task)
+            invalidate(f"network-routing-{network_id}")
+            return net_failures
+
+        for _, net_failures, _ in run_concurrently(delete_network_routes, by_network):
+            failures += net_failures
+
+    console.print(
+        f"[green]{len(routes) - len(failures)} routes deleted[/green],"
+        f" [red]{len(failures)} failed[/red]."
+    )
+    return failures
+
+
 @app.command()
 def add_staticroute(
     organization_name: str,
@@ -255,6 +825,191 @@ def add_staticroute(
                     console.print(f" - {e}")
 
 
+@app.command()
+def import_routes(
+    organization_name: str,
+    file: Path = typer.Argument(
+        ..., exists=True, dir_okay=False, help="CSV with network,name,subnet,gateway"
+    ),
+    dry_run: bool = typer.Option(False, help="Show planned changes only"),
+    confirm: bool = typer.Option(True, help="Confirm before applying changes"),
+):
+    """
+    Add static routes to MX devices in many networks from a CSV file
+    """
+    org = find_org_by_name(organization_name)
+    networks = {
+        net["name"]: net
+        for net in get_networks(org["id"], product_type="appliance", refresh=True)
+    }
+
+    # Validate every route before making any changes
+    routes, failures = [], []
+    seen = {}
+    with open(file, encoding="utf-8", newline="") as csv_file:
+        for line, row in enumerate(csv.DictReader(csv_file), start=2):
+            route = {
+                "line": line,
+                "network": (row.get("network") or "").strip(),
+                "name": (row.get("name") or "").strip(),
+                "subnet": (row.get("subnet") or "").strip(),
+                "gatewayIp": (row.get("gateway") or "").strip(),
+            }
+            error = _validate_route(route, networks)
+            if error is None:
+                key = (route["network"], route["subnet"])
+                if key in seen:
+                    error = f"Duplicate of line {seen[key]}"
+                seen.setdefault(key, line)
+            if error:
+                failures.append((route, error))
+                continue
+            routes.append(route)
+
+    # Compare to existing routes in each network
+    target_networks = [networks[name] for name in {r["network"] for r in routes}]
+    existing = {}
+    with Progress(console=console) as progress:
+        task = progress.add_task("Getting routes", total=len(target_networks))
+        for net, net_routes, err in run_concurrently(
+            lambda net: paced(
+                dashboard.appliance.getNetworkApplianceStaticRoutes,
+                networkId=net["id"],
+            ),
+            target_networks,
+        ):
+            progress.advance(task)
+            if err:
+                console.print(f"[red]Unable to get routes for {net['name']}")
+                continue
+            existing[net["name"]] = {r["subnet"]: r for r in net_routes}
+
+    new_routes, unchanged = [], 0
+    for route in routes:
+        if route["network"] not in existing:
+            failures.append((route, "Unable to get existing routes"))
+            continue
+        found = existing[route["network"]].get(route["subnet"])
+        if found is None:
+            new_routes.append(route)
+        elif found["gatewayIp"] == route["gatewayIp"]:
+            unchanged += 1
+        else:
+            failures.append(
+                (route, f"Exists as {found['name']} via {found['gatewayIp']}")
+            )
+
+    console.print(
+        f"{len(new_routes)} routes to add, {unchanged} already exist,"
+        f" [red]{len(failures)} invalid or conflicting[/red]."
+    )
+    if new_routes and (dry_run or confirm):
+        table = table_with_columns(
+            ["Name", "Subnet", "Gateway"],
+            title="Routes to add",
+            first_column_name="Network",
+        )
+        for route in sorted(new_routes, key=lambda k: (k["network"], k["line"])):
+            table.add_row(
+                route["network"], route["name"], route["subnet"], route["gatewayIp"]
+            )
+        console.print(table)
+
+    if new_routes and not dry_run:
+        if confirm and not Confirm.ask(
+            f"Add {len(new_routes)} routes to {len({r['network'] for r in new_routes})}"
+            " networks?",
+            console=console,
+        ):
+            raise typer.Abort()
+        failures += _create_routes(new_routes, networks)
+
+    if failures:
+        _print_route_failures(failures)
+
+
+def _validate_route(route, networks):
+    """
+    Reason a route from an import file is invalid, normalizing its subnet and
+    name when valid
+    """
+    if route["network"] not in networks:
+        return "Network not found"
+    try:
+        route["subnet"] = format(ipaddress.ip_network(route["subnet"]))
+    except ValueError as err:
+        return f"Invalid subnet: {err}"
+    try:
+        route["gatewayIp"] = format(ipaddress.ip_address(route["gatewayIp"]))
+    except ValueError as err:
+        return f"Invalid gateway: {err}"
+    if not route["name"]:
+        route["name"] = route["subnet"].replace(".", "-").replace("/", "-")
+    return None
+
+
+def _create_routes(routes, networks):
+    """
+    Create static routes, one network at a time per worker as static routes
+    can not be added with action batches. Returns (route, error) for each
+    route that failed
+    """
+    by_network = {}
+    for route in routes:
+        by_network.setdefault(route["network"], []).append(route)
+
+    failures = []
+    with Progress(console=console) as progress:
+        task = progress.add_task("Adding routes", total=len(routes))
+
+        def create_network_routes(net_name):
+            net_failures = []
+            for route in by_network[net_name]:
+                try:
+                    paced(
+                        dashboard.appliance.createNetworkApplianceStaticRoute,
+                        networkId=networks[net_name]["id"],
+                        name=route["name"],
+                        subnet=route["subnet"],
+                        gatewayIp=route["gatewayIp"],
+                    )
+                except APIError as err:
+                    net_failures.append((route, api_error_text(err)))
+                progress.advance(task)
+            invalidate(f"network-routing-{networks[net_name]['id']}")
+            return net_failures
+
+        for _, net_failures, _ in run_concurrently(create_network_routes, by_network):
+            failures += net_failures
+
+    console.print(
+        f"[green]{len(routes) - len(failures)} routes added[/green],"
+        f" [red]{len(failures)} failed[/red]."
+    )
+    return failures
+
+
+def _print_route_failures(failures):
+    """
+    Print a table of routes that were not added, and why
+    """
+    table = table_with_columns(
+        ["Network", "Name", "Subnet", "Gateway", "Error"],
+        title="Routes not added",
+        first_column_name="Line",
+    )
+    for route, error in sorted(failures, key=lambda k: k[0]["line"]):
+        table.add_row(
+            str(route["line"]),
+            route["network"],
+            route["name"],
+            route["subnet"],
+            route["gatewayIp"],
+            f"[red]{error}",
+        )
+    console.print(table)
+
+
 @app.command()
 def create_staticnat(
     organization_name: str,
@@ -283,48 +1038,13 @@ def create_staticnat(
 
     # Iterate through each provided port
     allowed_ports = []
-    for p in port:
-        args = len(p.split("!"))
-        # Each port item should  be formatted as 'protocol!portNum' or 'protocol!portNum!allowedIPs'
-        if not 1 < args < 4:
-            console.print("Incorect --port formatting")
-            raise typer.Abort()
-
-        if args == 3:
-            # 'protocol!portNum!allowedIPs' format
-            proto, num, allowed_ips = p.split("!")
-        elif args == 2:
-            # 'protocol!portNum' format
-            proto, num = p.split("!")
-            allowed_ips = "any"
-
-        # Validate protocol input
-        valid_protocols = ["tcp", "udp", "icmp", "any"]
-        if not proto in valid_protocols:
-            console.print(
-                "Incorect --port protocol. Protocol must be"
-                f" \[{', '.join(valid_protocols)}]"
-            )
+    for p in port or []:
+        try:
+            allowed_ports.append(_parse_nat_port(p))
+        except ValueError as err:
+            console.print(err)
             raise typer.Abort()
 
-        # Validate allowed IP input
-        for ip in allowed_ips.split(","):
-            if not ip == "any":
-                try:
-                    ip = ipaddress.ip_network(ip)
-                except ValueError as err:
-                    console.print(f"Invalid allowed IP {ip}. {err}")
-                    raise typer.Abort()
-
-        # Add to list of allowed_ports for all NAT entries
-        allowed_ports.append(
-            {
-                "protocol": proto,
-                "destinationPorts": num.split(","),
-                "allowedIps": allowed_ips.split(","),
-            }
-        )
-
     # Iterate through each provided NAT
     new_rules = []
     for entry in nat:
@@ -342,30 +1062,22 @@ def create_staticnat(
             public_ip, private_ip = entry.split("!")
             name = public_ip.replace(".", "-")
 
-        # Validate public IP input
         try:
-            public_ip = ipaddress.ip_address(public_ip)
+            new_rules.append(
+                _nat_rule(name, public_ip, private_ip, uplink.value, allowed_ports)
+            )
         except ValueError as err:
-            console.print(f"Invalid public IP {public_ip}. {err}")
+            console.print(err)
             raise typer.Abort()
 
-        # Validate private IP input
-        try:
-            private_ip = ipaddress.ip_address(private_ip)
-        except ValueError as err:
-            console.print(f"Invalid private IP {private_ip}. {err}")
+    # Check new rules against existing rules and each other
+    index = NatIndex(rules)
+    for rule in new_rules:
+        conflicts = index.conflicts(rule)
+        if conflicts:
+            console.print(f"[red]{rule['name']}: {'; '.join(conflicts)}")
             raise typer.Abort()
-
-        # Add to list of new_rules
-        new_rules.append(
-            {
-                "name": name,
-                "lanIp": format(private_ip),
-                "publicIp": format(public_ip),
-                "uplink": uplink.value,
-                "allowedInbound": allowed_ports,
-            }
-        )
+        index.add(rule)
 
     # Display a table of new rules
     table = table_mx_onetoone_nat(new_rules, title="New 1:1 NAT Rules")
@@ -382,3 +1094,268 @@ def create_staticnat(
 
     rules += new_rules
     dashboard.appliance.updateNetworkApplianceFirewallOneToOneNatRules(net["id"], rules)
+
+
+@app.command()
+def import_nat(
+    organization_name: str,
+    network_name: str,
+    file: Path = typer.Argument(
+        ...,
+        exists=True,
+        dir_okay=False,
+        help="CSV with name,publicIp,lanIp,uplink,ports",
+    ),
+    replace: bool = typer.Option(
+        False, help="Remove existing rules that are not in the file"
+    ),
+    dry_run: bool = typer.Option(False, help="Show planned changes only"),
+    confirm: bool = typer.Option(True, help="Confirm before applying changes"),
+):
+    """
+    Add or update 1:1 NAT rules on an MX device from a CSV file. Rules are
+    matched to existing rules by public IP, or else by name so a public IP can
+    be changed. Ports are separated by ';', each formatted as 'protocol!portNum'
+    or 'protocol!portNum!allowedIPs'
+    """
+    net = find_network_by_name(organization_name, network_name)
+    with status_spinner("Getting 1:1 NAT rules"):
+        rules = dashboard.appliance.getNetworkApplianceFirewallOneToOneNatRules(
+            net["id"]
+        )["rules"]
+
+    # Validate every rule in the file before comparing
+    file_rules, errors = [], []
+    with open(file, encoding="utf-8", newline="") as csv_file:
+        for line, row in enumerate(csv.DictReader(csv_file), start=2):
+            try:
+                file_rules.append(
+                    _nat_rule(
+                        (row.get("name") or "").strip(),
+                        (row.get("publicIp") or "").strip(),
+                        (row.get("lanIp") or "").strip(),
+                        (row.get("uplink") or MXInternetUplinks.one.value).strip(),
+                        [
+                            _parse_nat_port(p.strip())
+                            for p in (row.get("ports") or "").split(";")
+                            if p.strip()
+                        ],
+                    )
+                )
+            except ValueError as err:
+                errors.append(f"Line {line}: {err}")
+
+    added, updated, removed, replacements, conflicts = _plan_nat_import(
+        rules, file_rules, replace
+    )
+    errors += conflicts
+
+    for error in errors:
+        console.print(f" [red]{error}")
+    if errors:
+        console.print(f"[red]{len(errors)} rules are invalid or conflict.")
+        raise typer.Abort()
+    if not (added or updated or removed):
+        console.print("[green]1:1 NAT rules are up to date.")
+        raise typer.Exit()
+
+    # Only display rules that change
+    for title, changed in (
+        ("1:1 NAT rules to add", added),
+        ("1:1 NAT rules to update", updated),
+        ("1:1 NAT rules to remove", removed),
+    ):
+        if changed:
+            console.print(table_mx_onetoone_nat(changed, title=title))
+    console.print(
+        f"{len(added)} to add, {len(updated)} to update, {len(removed)} to remove,"
+        f" {len(rules) - len(updated) - len(removed)} unchanged."
+    )
+
+    if dry_run:
+        raise typer.Exit()
+    if confirm and not Confirm.ask("Apply changes?", console=console):
+        raise typer.Abort()
+
+    # Keep the order of existing rules, replacing updated rules in place
+    removed_ids = {id(rule) for rule in removed}
+    new_rules = [
+        replacements.get(id(rule), rule)
+        for rule in rules
+        if id(rule) not in removed_ids
+    ] + added
+    with status_spinner("Updating 1:1 NAT rules"):
+        dashboard.appliance.updateNetworkApplianceFirewallOneToOneNatRules(
+            net["id"], new_rules
+        )
+    console.print(f"[green]Updated 1:1 NAT rules in {net['name']}.")
+
+
+class NatIndex:
+    """
+    Index of 1:1 NAT rules by public IP, LAN IP and name
+    """
+
+    def __init__(self, rules: List):
+        self.keys = {"publicIp": {}, "lanIp": {}, "name": {}}
+        for rule in rules:
+            self.add(rule)
+
+    def add(self, rule: dict):
+        """
+        Add a rule to the index
+        """
+        for key, index in self.keys.items():
+            index.setdefault(rule[key], rule)
+
+    def get(self, public_ip: str) -> Optional[dict]:
+        """
+        Rule using a public IP
+        """
+        return self.keys["publicIp"].get(public_ip)
+
+    def conflicts(self, rule: dict, ignore: Optional[dict] = None) -> List[str]:
+        """
+        Descriptions of indexed rules that use the same public IP, LAN IP or
+        name as a rule, other than the ignored rule
+        """
+        conflicts = []
+        for key, index in self.keys.items():
+            other = index.get(rule[key])
+            if other is not None and other is not ignore:
+                conflicts.append(f"{key} {rule[key]} is used by {other['name']}")
+        return conflicts
+
+
+def _plan_nat_import(rules: List, file_rules: List, replace: bool) -> Tuple:
+    """
+    Compare imported 1:1 NAT rules to existing rules, matching each by public
+    IP or else by name. Returns the added, updated and removed rules, the
+    replacement for each updated rule by id of the existing rule, and conflicts
+    """
+    by_ip = {rule["publicIp"]: rule for rule in rules}
+    by_name = {rule["name"]: rule for rule in rules}
+    matches, matched = [], set()
+    for rule in file_rules:
+        current = by_ip.get(rule["publicIp"])
+        if current is None or id(current) in matched:
+            current = by_name.get(rule["name"])
+        if current is not None and id(current) in matched:
+            current = None
+        if current is not None:
+            matched.add(id(current))
+        matches.append((rule, current))
+    removed = [rule for rule in rules if replace and id(rule) not in matched]
+
+    # Matched rules are replaced and removed rules are deleted, so only the
+    # remaining existing rules and other imported rules can conflict
+    unchanged = NatIndex(
+        [rule for rule in rules if id(rule) not in matched and not replace]
+    )
+    planned = NatIndex([])
+    added, updated, replacements, conflicts = [], [], {}, []
+    for rule, current in matches:
+        rule_conflicts = planned.conflicts(rule) + unchanged.conflicts(rule)
+        if rule_conflicts:
+            conflicts.append(
+                f"{rule['name']} ({rule['publicIp']}): {'; '.join(rule_conflicts)}"
+            )
+            continue
+        planned.add(rule)
+
+        if current is None:
+            added.append(rule)
+        elif _normalize_nat(current) != _normalize_nat(rule):
+            updated.append(rule)
+            replacements[id(current)] = rule
+    return added, updated, removed, replacements, conflicts
+
+
+def _parse_nat_port(port):
+    """
+    Parse a 'protocol!portNum' or 'protocol!portNum!allowedIPs' port into an
+    allowed inbound connection
+    """
+    args = len(port.split("!"))
+    # Each port item should  be formatted as 'protocol!portNum' or 'protocol!portNum!allowedIPs'
+    if not 1 < args < 4:
+        raise ValueError("Incorect --port formatting")
+
+    if args == 3:
+        # 'protocol!portNum!allowedIPs' format
+        proto, num, allowed_ips = port.split("!")
+    else:
+        # 'protocol!portNum' format
+        proto, num = port.split("!")
+        allowed_ips = "any"
+
+    # Validate protocol input
+    valid_protocols = ["tcp", "udp", "icmp", "any"]
+    if not proto in valid_protocols:
+        raise ValueError(
+            "Incorect --port protocol. Protocol must be"
+            f" \\[{', '.join(valid_protocols)}]"
+        )
+
+    # Validate allowed IP input
+    for ip in allowed_ips.split(","):
+        if not ip == "any":
+            try:
+                ipaddress.ip_network(ip)
+            except ValueError as err:
+                raise ValueError(f"Invalid allowed IP {ip}. {err}") from err
+
+    return {
+        "protocol": proto,
+        "destinationPorts": num.split(","),
+        "allowedIps": allowed_ips.split(","),
+    }
+
+
+def _nat_rule(name, public_ip, private_ip, uplink, allowed_ports):
+    """
+    Validate and create a 1:1 NAT rule, naming it after its public IP if no
+    name is given
+    """
+    try:
+        public_ip = ipaddress.ip_address(public_ip)
+    except ValueError as err:
+        raise ValueError(f"Invalid public IP {public_ip}. {err}") from err
+
+    try:
+        private_ip = ipaddress.ip_address(private_ip)
+    except ValueError as err:
+        raise ValueError(f"Invalid private IP {private_ip}. {err}") from err
+
+    if uplink not in [u.value for u in MXInternetUplinks]:
+        raise ValueError(f"Invalid uplink {uplink}")
+
+    return {
+        "name": name or format(public_ip).replace(".", "-"),
+        "lanIp": format(private_ip),
+        "publicIp": format(public_ip),
+        "uplink": uplink,
+        "allowedInbound": allowed_ports,
+    }
+
+
+def _normalize_nat(rule):
+    """
+    Comparable copy of a 1:1 NAT rule
+    """
+    return {
+        "name": rule["name"],
+        "lanIp": rule["lanIp"],
+        "publicIp": rule["publicIp"],
+        "uplink": rule["uplink"],
+        "allowedInbound": [
+            {
+                "protocol": entry["protocol"],
+                "destinationPorts": [
+                    str(p) for p in entry.get("destinationPorts") or []
+                ],
+                "allowedIps": sorted(entry.get("allowedIps") or []),
+            }
+            for entry in rule.get("allowedInbound") or []
+        ],
+    }
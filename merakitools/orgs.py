@@ -5,14 +5,29 @@ Billy Zoellers
 CLI tools for managing Meraki networks based on Typer
 """
 
+import csv
+import ipaddress
+from pathlib import Path
 from typing import List, Optional
 import typer
+from rich.progress import Progress
+from merakitools.cache import cached
 from merakitools.console import console, status_spinner
 from merakitools.dashboardapi import dashboard, APIError
+from merakitools.firewall import (
+    LOCAL_LAN,
+    analyze_rules,
+    compile_rules,
+    evaluate_rules,
+)
 from merakitools.meraki_helpers import (
     find_network_by_name,
     find_org_by_name,
     find_orgs_by_name,
+    get_device_index,
+    get_networks,
+    paced,
+    run_concurrently,
 )
 from merakitools.formatting_helpers import table_with_columns, table_network_health
 
@@ -140,6 +155,119 @@ def mx_uplinks(
     console.print(table)
 
 
+@app.command()
+def appliance_status(
+    organization_name: str,
+    issues_only: bool = typer.Option(
+        False, help="Only list appliances with uplink or VPN issues"
+    ),
+    refresh: bool = typer.Option(False, help="Ignore cached network and device data"),
+):
+    """
+    Report uplink status and site-to-site VPN peer reachability for every MX
+    in the organization
+    """
+    org = find_org_by_name(organization_name)
+
+    # Get uplink and VPN statuses for the whole organization at the same time
+    fetch = {
+        "uplinks": lambda: dashboard.appliance.getOrganizationApplianceUplinkStatuses(
+            org["id"], total_pages="all", perPage=1000
+        ),
+        "vpn": lambda: dashboard.appliance.getOrganizationApplianceVpnStatuses(
+            org["id"], total_pages="all", perPage=300
+        ),
+        "networks": lambda: get_networks(org["id"], refresh=refresh),
+        "devices": lambda: get_device_index(org["id"], refresh=refresh),
+    }
+    data = {}
+    with status_spinner("Getting uplink and VPN status"):
+        for name, result, err in run_concurrently(lambda name: fetch[name](), fetch):
+            if err:
+                console.print(f"[red]Unable to get {name}: {err.message}")
+                raise typer.Abort()
+            data[name] = result
+
+    # Index by network ID and serial to join the statuses
+    network_names = {net["id"]: net["name"] for net in data["networks"]}
+    vpn_by_serial = {vpn["deviceSerial"]: vpn for vpn in data["vpn"]}
+
+    table = table_with_columns(
+        ["Device", "Uplinks", "VPN", "Peers", "Issues"],
+        title=f"Appliance status in {org['name']}",
+        first_column_name="Network",
+    )
+    counts = {"failed over": 0, "uplink down": 0, "peers down": 0}
+    for appliance in sorted(
+        data["uplinks"],
+        key=lambda k: network_names.get(k["networkId"], k["networkId"]),
+    ):
+        vpn = vpn_by_serial.get(appliance["serial"], {})
+        issues = _appliance_issues(appliance, vpn)
+        for issue in issues:
+            counts[issue.split(":")[0]] += 1
+        if issues_only and not issues:
+            continue
+
+        peers = vpn.get("merakiVpnPeers", []) + vpn.get("thirdPartyVpnPeers", [])
+        reachable = len([p for p in peers if p.get("reachability") == "reachable"])
+        table.add_row(
+            network_names.get(appliance["networkId"], appliance["networkId"]),
+            data["devices"].get(appliance["serial"], {}).get("name")
+            or appliance["serial"],
+            "\n".join(
+                f"{uplink['interface']}: {_format_uplink_status(uplink['status'])}"
+                for uplink in appliance["uplinks"]
+            ),
+            vpn.get("vpnMode", ""),
+            f"{reachable}/{len(peers)}" if peers else "",
+            "\n".join(f"[red]{issue}" for issue in issues),
+        )
+
+    console.print(table)
+    console.print(
+        f"{len(data['uplinks'])} appliances: [red]{counts['failed over']}[/red]"
+        f" failed over, [red]{counts['uplink down']}[/red] with an uplink down,"
+        f" [red]{counts['peers down']}[/red] with unreachable VPN peers."
+    )
+
+
+def _format_uplink_status(status):
+    """
+    Colored uplink status
+    """
+    styles = {"active": "green", "ready": "blue", "failed": "red"}
+    return f"[{styles.get(status, 'yellow')}]{status}[/]"
+
+
+def _appliance_issues(appliance, vpn):
+    """
+    Failed over uplinks, uplinks that are down and unreachable VPN peers of an
+    appliance
+    """
+    issues = []
+    uplinks = {uplink["interface"]: uplink["status"] for uplink in appliance["uplinks"]}
+
+    # The primary uplink is not in use while another uplink is
+    if uplinks.get("wan1") != "active" and "active" in uplinks.values():
+        active = [name for name, status in uplinks.items() if status == "active"]
+        issues.append(f"failed over: {', '.join(active)} active")
+
+    down = [name for name, status in uplinks.items() if status == "failed"]
+    if down:
+        issues.append(f"uplink down: {', '.join(down)}")
+
+    peers = [
+        peer.get("networkName") or peer.get("name")
+        for peer in vpn.get("merakiVpnPeers", []) + vpn.get("thirdPartyVpnPeers", [])
+        if peer.get("reachability") != "reachable"
+    ]
+    if peers:
+        more = f" and {len(peers) - 3} more" if len(peers) > 3 else ""
+        issues.append(f"peers down: {', '.join(peers[:3])}{more}")
+    return issues
+
+
 @app.command()
 def create(
     name: str,
@@ -421,3 +549,246 @@ def list_api_requests(organization_name: str):
         )
 
     console.print(table)
+
+
+def _get_network_firewall_rules(net, include_ssids):
+    """
+    Get MX and enabled SSID L3 firewall rules of a network, as a list of
+    (rule set name, rules)
+    """
+    rulesets = []
+    if "appliance" in net["productTypes"]:
+        rules = paced(
+            dashboard.appliance.getNetworkApplianceFirewallL3FirewallRules,
+            networkId=net["id"],
+        )["rules"]
+        rulesets.append(("MX", rules))
+
+    if include_ssids and "wireless" in net["productTypes"]:
+        ssids = paced(dashboard.wireless.getNetworkWirelessSsids, networkId=net["id"])
+        for ssid in ssids:
+            if not ssid["enabled"]:
+                continue
+            rules = paced(
+                dashboard.wireless.getNetworkWirelessSsidFirewallL3FirewallRules,
+                networkId=net["id"],
+                number=ssid["number"],
+            )["rules"]
+            rulesets.append((f"SSID {ssid['number']} {ssid['name']}", rules))
+    return rulesets
+
+
+def _get_firewall_rulesets(org, include_ssids, refresh=False, local_lan=LOCAL_LAN):
+    """
+    Compiled L3 firewall rules of every network in an organization, each from
+    the local cache, as a list of (network name, rule set name, rules)
+    """
+    networks = [
+        net
+        for net in get_networks(org["id"], refresh=refresh)
+        if "appliance" in net["productTypes"]
+        or (include_ssids and "wireless" in net["productTypes"])
+    ]
+
+    rulesets = []
+    with Progress(console=console) as progress:
+        task = progress.add_task("Getting firewall rules", total=len(networks))
+        for net, net_rulesets, err in run_concurrently(
+            lambda net: cached(
+                f"network-l3-firewall-{net['id']}-{include_ssids}",
+                _get_network_firewall_rules,
+                net,
+                include_ssids,
+                refresh=refresh,
+            ),
+            networks,
+        ):
+            progress.advance(task)
+            if err:
+                console.print(f"[yellow]Unable to get firewall rules for {net['name']}")
+                continue
+            rulesets += [
+                (net["name"], name, compile_rules(rules, local_lan))
+                for name, rules in net_rulesets
+            ]
+    return sorted(rulesets, key=lambda k: (k[0], k[1]))
+
+
+def _parse_flow(src, dst, protocol, port):
+    """
+    Validate a flow to check against firewall rules
+    """
+    if port is not None:
+        try:
+            port = int(str(port).strip())
+        except ValueError as err:
+            raise ValueError(f"Invalid port {port}") from err
+        if not 1 <= port <= 65535:
+            raise ValueError(f"Invalid port {port}")
+    return {
+        "src": ipaddress.ip_address(src.strip()),
+        "dst": ipaddress.ip_address(dst.strip()),
+        "protocol": protocol.strip().lower(),
+        "port": port,
+    }
+
+
+def _format_fw_rule(rule):
+    """
+    Short description of an L3 firewall rule
+    """
+    fields = rule.rule
+    text = (
+        f"{fields['policy']} {fields['protocol']}"
+        f" {fields.get('srcCidr', 'Any')}:{fields.get('srcPort', 'Any')} ->"
+        f" {fields['destCidr']}:{fields.get('destPort', 'Any')}"
+    )
+    if fields.get("comment"):
+        text += f" ({fields['comment']})"
+    return text
+
+
+@app.command()
+def audit_firewall(
+    organization_name: str,
+    include_ssids: bool = typer.Option(True, help="Include SSID L3 firewall rules"),
+    local_lan: List[str] = typer.Option(
+        LOCAL_LAN, help="Subnets matched by Local LAN in SSID rules"
+    ),
+    refresh: bool = typer.Option(False, help="Ignore cached firewall rules"),
+):
+    """
+    Find shadowed, redundant and overly broad MX and SSID L3 firewall rules
+    """
+    org = find_org_by_name(organization_name)
+    rulesets = _get_firewall_rulesets(
+        org, include_ssids, refresh=refresh, local_lan=local_lan
+    )
+
+    table = table_with_columns(
+        ["Rules", "#", "Rule", "Issue"],
+        title=f"L3 firewall rule issues in {org['name']}",
+        first_column_name="Network",
+    )
+    issues, inexact = 0, 0
+    for net_name, ruleset_name, rules in rulesets:
+        inexact += len([rule for rule in rules if not rule.exact])
+        for rule, issue in analyze_rules(rules):
+            issues += 1
+            table.add_row(
+                net_name,
+                ruleset_name,
+                str(rule.position),
+                _format_fw_rule(rule),
+                f"[red]{issue}" if "Shadowed" in issue else f"[yellow]{issue}",
+            )
+
+    if issues:
+        console.print(table)
+    console.print(
+        f"Found [bold]{issues}[/bold] issues in {len(rulesets)} rule sets."
+        f" {inexact} rules using VLANs, objects or FQDNs were not analyzed."
+    )
+
+
+@app.command()
+def check_firewall(
+    organization_name: str,
+    src: Optional[str] = typer.Option(None, help="Source IP address"),
+    dst: Optional[str] = typer.Option(None, help="Destination IP address"),
+    port: Optional[int] = typer.Option(None, min=1, max=65535, help="Destination port"),
+    protocol: str = typer.Option("tcp", help="tcp, udp, icmp or icmp6"),
+    file: Optional[Path] = typer.Option(
+        None,
+        exists=True,
+        dir_okay=False,
+        help="CSV with src,dst,protocol,port to check many flows",
+    ),
+    include_ssids: bool = typer.Option(True, help="Include SSID L3 firewall rules"),
+    denied_only: bool = typer.Option(False, help="Only list rule sets that deny"),
+    local_lan: List[str] = typer.Option(
+        LOCAL_LAN, help="Subnets matched by Local LAN in SSID rules"
+    ),
+    refresh: bool = typer.Option(False, help="Ignore cached firewall rules"),
+):
+    """
+    Check whether traffic would be allowed by the MX and SSID L3 firewall
+    rules of every network in an organization
+    """
+    # Validate every flow before getting any rules
+    flows, errors = [], []
+    if src and dst:
+        try:
+            flows.append(_parse_flow(src, dst, protocol, port))
+        except ValueError as err:
+            errors.append(str(err))
+    if file:
+        with open(file, encoding="utf-8", newline="") as csv_file:
+            for line, row in enumerate(csv.DictReader(csv_file), start=2):
+                try:
+                    if not (row.get("src") and row.get("dst")):
+                        raise ValueError("src and dst are required")
+                    flows.append(
+                        _parse_flow(
+                            row["src"],
+                            row["dst"],
+                            row.get("protocol") or "tcp",
+                            (row.get("port") or "").strip() or None,
+                        )
+                    )
+                except ValueError as err:
+                    errors.append(f"Line {line}: {err}")
+    for error in errors:
+        console.print(f" [red]{error}")
+    if errors:
+        console.print(f"[red]{len(errors)} flows are invalid.")
+        raise typer.Abort()
+    if not flows:
+        console.print("Provide --src and --dst, or a --file of flows.")
+        raise typer.Abort()
+
+    org = find_org_by_name(organization_name)
+    rulesets = _get_firewall_rulesets(
+        org, include_ssids, refresh=refresh, local_lan=local_lan
+    )
+
+    table = table_with_columns(
+        ["Network", "Rules", "Result", "Rule"],
+        title=f"L3 firewall check in {org['name']}",
+        first_column_name="Flow",
+    )
+    styles = {"allow": "[green]", "deny": "[red]", "unknown": "[yellow]"}
+    for flow in flows:
+        flow_text = f"{flow['src']} -> {flow['dst']} {flow['protocol']}" + (
+            f"/{flow['port']}" if flow["port"] else ""
+        )
+        results = {"allow": 0, "deny": 0, "unknown": 0}
+        rows = []
+        for net_name, ruleset_name, rules in rulesets:
+            policy, rule = evaluate_rules(
+                rules, flow["src"], flow["dst"], flow["protocol"], flow["port"]
+            )
+            results[policy] += 1
+            if denied_only and policy == "allow":
+                continue
+            rows.append(
+                (
+                    net_name,
+                    ruleset_name,
+                    f"{styles[policy]}{policy.capitalize()}",
+                    f"{rule.position}: {_format_fw_rule(rule)}" if rule else "",
+                )
+            )
+
+        table.add_row(
+            flow_text,
+            "",
+            "",
+            f"{results['allow']} allow, {results['deny']} deny,"
+            f" {results['unknown']} unknown",
+            "",
+            style="bold",
+        )
+        for idx, row in enumerate(rows):
+            table.add_row("", *row, end_section=idx == len(rows) - 1)
+    console.print(table)
@@ -0,0 +1,113 @@
+"""
+merakitools - prefix_trie.py
+Billy Zoellers
+
+CLI tools for managing Meraki networks based on Typer
+"""
+
+import ipaddress
+from typing import Any, Iterator, List, Optional, Tuple
+
+
+def _bit(network, depth: int) -> int:
+    """
+    Bit of a network address at a given depth, starting from the most significant
+    """
+    return (int(network.network_address) >> (network.max_prefixlen - 1 - depth)) & 1
+
+
+class PrefixTrie:
+    """
+    Binary trie of IPv4 and IPv6 prefixes, each holding one or more values,
+    for longest prefix match lookups and finding overlapping prefixes
+    """
+
+    def __init__(self):
+        self.roots = {4: {}, 6: {}}
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def insert(self, prefix, value: Any):
+        """
+        Add a value for a prefix
+        """
+        network = ipaddress.ip_network(prefix, strict=False)
+        node = self.roots[network.version]
+        for depth in range(network.prefixlen):
+            node = node.setdefault(_bit(network, depth), {})
+        node.setdefault("values", []).append((network, value))
+        self.count += 1
+
+    def covering(self, prefix) -> List[Tuple]:
+        """
+        (network, value) of every prefix containing an address or prefix,
+        least specific first
+        """
+        network = ipaddress.ip_network(prefix, strict=False)
+        node = self.roots[network.version]
+        matches = []
+        for depth in range(network.prefixlen + 1):
+            matches += node.get("values", [])
+            if depth == network.prefixlen:
+                break
+            node = node.get(_bit(network, depth))
+            if node is None:
+                break
+        return matches
+
+    def lookup(self, address) -> Optional[Tuple]:
+        """
+        (network, value) of the longest prefix containing an address
+        """
+        matches = self.covering(address)
+        return matches[-1] if matches else None
+
+    def __iter__(self) -> Iterator[Tuple]:
+        for root in self.roots.values():
+            stack = [root]
+            while stack:
+                node = stack.pop()
+                yield from node.get("values", [])
+                stack += [node[bit] for bit in (1, 0) if bit in node]
+
+    def overlaps(self) -> Iterator[Tuple[Tuple, Tuple]]:
+        """
+        Pairs of (network, value) where the first prefix contains or equals
+        the second
+        """
+        for root in self.roots.values():
+            stack = [(root, [])]
+            while stack:
+                node, ancestors = stack.pop()
+                values = node.get("values", [])
+                for idx, entry in enumerate(values):
+                    for ancestor in ancestors:
+                        yield ancestor, entry
+                    for other in values[idx + 1 :]:
+                        yield entry, other
+                stack += [
+                    (node[bit], ancestors + values) for bit in (1, 0) if bit in node
+                ]
+
+    def overlap_groups(self) -> Iterator[List[Tuple]]:
+        """
+        Groups of (network, value) for each least specific prefix, with every
+        equal or nested prefix, least specific first
+        """
+        for root in self.roots.values():
+            stack = [root]
+            while stack:
+                node = stack.pop()
+                if "values" not in node:
+                    stack += [node[bit] for bit in (1, 0) if bit in node]
+                    continue
+
+                # Collect the whole subtree, breadth first so that less
+                # specific prefixes are listed first
+                group, level = [], [node]
+                while level:
+                    group += [entry for n in level for entry in n.get("values", [])]
+                    level = [n[bit] for n in level for bit in (0, 1) if bit in n]
+                yield group
@@ -0,0 +1,179 @@
+"""
+merakitools - sensor_store.py
+Billy Zoellers
+
+CLI tools for managing Meraki networks based on Typer
+"""
+
+import sqlite3
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+from merakitools.cache import open_database
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS organizations (
+    id TEXT PRIMARY KEY,
+    name TEXT
+);
+CREATE TABLE IF NOT EXISTS readings (
+    organization_id TEXT,
+    serial TEXT,
+    metric TEXT,
+    ts REAL,
+    unit TEXT,
+    value REAL,
+    network_id TEXT,
+    network_name TEXT,
+    PRIMARY KEY (serial, metric, ts)
+);
+CREATE INDEX IF NOT EXISTS readings_time ON readings (organization_id, ts);
+CREATE TABLE IF NOT EXISTS sync_marks (
+    organization_id TEXT,
+    serial TEXT,
+    metric TEXT,
+    synced_to REAL,
+    PRIMARY KEY (organization_id, serial, metric)
+);
+"""
+
+
+def open_sensor_store() -> sqlite3.Connection:
+    """
+    Open the local sensor reading store, creating it if needed
+    """
+    db = open_database("sensors")
+    db.executescript(SCHEMA)
+    return db
+
+
+def timestamp(value: str) -> float:
+    """
+    Seconds since the epoch of an ISO 8601 reading time
+    """
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+def store_organization(db: sqlite3.Connection, organization: Dict):
+    """
+    Record an organization so the store can be queried by its name
+    """
+    with db:
+        db.execute(
+            "INSERT OR REPLACE INTO organizations VALUES (?, ?)",
+            (organization["id"], organization["name"]),
+        )
+
+
+def stored_organization(db: sqlite3.Connection, name: str) -> Optional[sqlite3.Row]:
+    """
+    Find a stored organization by name or ID
+    """
+    return db.execute(
+        "SELECT * FROM organizations WHERE id = ? OR lower(name) = lower(?)",
+        (name, name),
+    ).fetchone()
+
+
+def sync_marks(db: sqlite3.Connection, organization_id: str) -> Dict[Tuple, float]:
+    """
+    Time each (serial, metric) was last synced up to. A metric of "" marks a
+    sync of every metric of the sensor
+    """
+    return {
+        (row["serial"], row["metric"]): row["synced_to"]
+        for row in db.execute(
+            "SELECT serial, metric, synced_to FROM sync_marks"
+            " WHERE organization_id = ?",
+            (organization_id,),
+        )
+    }
+
+
+def mark_synced(
+    db: sqlite3.Connection,
+    organization_id: str,
+    pairs: Iterable[Tuple[str, str]],
+    synced_to: float,
+):
+    """
+    Record that (serial, metric) pairs were synced up to a time
+    """
+    with db:
+        db.executemany(
+            "INSERT OR REPLACE INTO sync_marks VALUES (?, ?, ?, ?)",
+            ((organization_id, serial, metric, synced_to) for serial, metric in pairs),
+        )
+
+
+def _reading_value(reading: Dict):
+    """
+    Unit and numeric value of a reading, using the first value of metrics
+    with more than one, such as celsius and fahrenheit
+    """
+    values = reading.get(reading["metric"]) or {}
+    unit, value = next(iter(values.items()), (None, None))
+    if isinstance(value, bool):
+        value = int(value)
+    if not isinstance(value, (int, float)):
+        value = None
+    return unit, value
+
+
+def store_readings(
+    db: sqlite3.Connection, organization_id: str, readings: Iterable[Dict]
+) -> int:
+    """
+    Add readings to the store, ignoring readings already stored. Returns the
+    number of new readings
+    """
+    with db:
+        before = db.total_changes
+        db.executemany(
+            "INSERT OR IGNORE INTO readings VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                (
+                    organization_id,
+                    reading["serial"],
+                    reading["metric"],
+                    timestamp(reading["ts"]),
+                    *_reading_value(reading),
+                    reading["network"]["id"],
+                    reading["network"]["name"],
+                )
+                for reading in readings
+            ),
+        )
+        return db.total_changes - before
+
+
+def aggregate_readings(
+    db: sqlite3.Connection,
+    organization_id: str,
+    start: float,
+    end: float,
+    interval: int,
+    serials: Optional[List[str]] = None,
+    metrics: Optional[List[str]] = None,
+) -> List[sqlite3.Row]:
+    """
+    Minimum, maximum and mean value and count of readings for each sensor
+    and metric, in intervals of seconds
+    """
+    query = (
+        "SELECT serial, network_name, metric, unit,"
+        " CAST(ts / :interval AS INTEGER) * :interval AS period,"
+        " min(value) AS minimum, max(value) AS maximum, avg(value) AS mean,"
+        " count(*) AS readings"
+        " FROM readings WHERE organization_id = :org AND ts >= :start AND ts < :end"
+    )
+    params = {"interval": interval, "org": organization_id, "start": start, "end": end}
+    for column, values in (("serial", serials), ("metric", metrics)):
+        if values:
+            names = [f"{column}{idx}" for idx in range(len(values))]
+            query += f" AND {column} IN ({', '.join(':' + name for name in names)})"
+            params.update(zip(names, values))
+    query += (
+        " GROUP BY serial, metric, unit, period"
+        " ORDER BY network_name, serial, metric, period"
+    )
+    return db.execute(query, params).fetchall()
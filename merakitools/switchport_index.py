@@ -0,0 +1,348 @@
+"""
+merakitools - switchport_index.py
+Billy Zoellers
+
+CLI tools for managing Meraki networks based on Typer
+"""
+
+import re
+import sqlite3
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+from merakitools.cache import open_database
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS organizations (
+    id TEXT PRIMARY KEY,
+    name TEXT,
+    indexed_at REAL,
+    complete_at REAL
+);
+CREATE TABLE IF NOT EXISTS switches (
+    serial TEXT PRIMARY KEY,
+    organization_id TEXT,
+    network_id TEXT,
+    network_name TEXT,
+    name TEXT,
+    model TEXT,
+    indexed_at REAL
+);
+CREATE INDEX IF NOT EXISTS switches_organization ON switches (organization_id);
+CREATE TABLE IF NOT EXISTS ports (
+    serial TEXT,
+    port_id TEXT,
+    name TEXT,
+    enabled INTEGER,
+    type TEXT,
+    vlan INTEGER,
+    voice_vlan INTEGER,
+    allowed_vlans TEXT,
+    status TEXT,
+    speed TEXT,
+    lldp_system_name TEXT,
+    cdp_device_id TEXT,
+    PRIMARY KEY (serial, port_id)
+);
+CREATE TABLE IF NOT EXISTS port_vlans (
+    serial TEXT,
+    port_id TEXT,
+    vlan_start INTEGER,
+    vlan_end INTEGER
+);
+CREATE INDEX IF NOT EXISTS port_vlans_range ON port_vlans (vlan_start, vlan_end);
+CREATE INDEX IF NOT EXISTS port_vlans_port ON port_vlans (serial, port_id);
+CREATE TABLE IF NOT EXISTS port_tags (
+    serial TEXT,
+    port_id TEXT,
+    tag TEXT
+);
+CREATE INDEX IF NOT EXISTS port_tags_tag ON port_tags (tag);
+CREATE INDEX IF NOT EXISTS port_tags_port ON port_tags (serial, port_id);
+CREATE TABLE IF NOT EXISTS clients (
+    mac TEXT,
+    serial TEXT,
+    port_id TEXT,
+    description TEXT,
+    ip TEXT,
+    vlan INTEGER
+);
+CREATE INDEX IF NOT EXISTS clients_mac ON clients (mac);
+CREATE INDEX IF NOT EXISTS clients_port ON clients (serial, port_id);
+"""
+
+# Remove the ports and clients of a single switch
+DELETE_SWITCH_PORTS = (
+    "DELETE FROM ports WHERE serial = ?",
+    "DELETE FROM port_vlans WHERE serial = ?",
+    "DELETE FROM port_tags WHERE serial = ?",
+    "DELETE FROM clients WHERE serial = ?",
+)
+
+# Literal clauses of a switchport search; every filter value is a bound parameter
+FIND_SELECT = (
+    "SELECT s.network_name, s.name AS switch_name, p.*"
+    " FROM ports p JOIN switches s ON s.serial = p.serial"
+)
+FIND_SELECT_CLIENTS = (
+    "SELECT s.network_name, s.name AS switch_name, p.*, c.mac, c.ip, c.description"
+    " FROM ports p JOIN switches s ON s.serial = p.serial"
+)
+FIND_MAC_EQUAL = (
+    " JOIN clients c ON c.serial = p.serial AND c.port_id = p.port_id AND c.mac = ?"
+)
+FIND_MAC_PREFIX = (
+    " JOIN clients c ON c.serial = p.serial AND c.port_id = p.port_id"
+    " AND c.mac LIKE ?"
+)
+FIND_ORGANIZATION = " WHERE s.organization_id = ?"
+FIND_VLAN = (
+    " AND (p.serial, p.port_id) IN (SELECT serial, port_id FROM port_vlans"
+    " WHERE vlan_start <= ? AND vlan_end >= ?)"
+)
+FIND_TAG = (
+    " AND (p.serial, p.port_id) IN"
+    " (SELECT serial, port_id FROM port_tags WHERE tag = ?)"
+)
+FIND_NAME = " AND p.name LIKE ?"
+FIND_NEIGHBOR = " AND (p.lldp_system_name LIKE ? OR p.cdp_device_id LIKE ?)"
+FIND_ORDER = " ORDER BY s.network_name, s.name, CAST(p.port_id AS INTEGER), p.port_id"
+
+
+def open_switchport_index() -> sqlite3.Connection:
+    """
+    Open the local switchport index, creating it if needed
+    """
+    db = open_database("switchports")
+    db.executescript(SCHEMA)
+    return db
+
+
+def normalize_mac(mac: str) -> str:
+    """
+    Lowercase hex digits of a full or partial MAC address
+    """
+    return re.sub(r"[^0-9a-f]", "", mac.lower())
+
+
+def vlan_ranges(port: Dict) -> List[Tuple[int, int]]:
+    """
+    VLAN ranges carried by a switchport
+    """
+    ranges = []
+    for key in ("vlan", "voiceVlan"):
+        if port.get(key):
+            ranges.append((int(port[key]), int(port[key])))
+
+    if port.get("type") != "trunk":
+        return ranges
+
+    allowed = str(port.get("allowedVlans") or "")
+    if allowed.strip().lower() == "all":
+        return [(1, 4094)]
+    for part in allowed.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        start, _, end = part.partition("-")
+        ranges.append((int(start), int(end or start)))
+    return ranges
+
+
+def indexed_organization(db: sqlite3.Connection, name: str) -> Optional[sqlite3.Row]:
+    """
+    Find an indexed organization by name or ID
+    """
+    return db.execute(
+        "SELECT * FROM organizations WHERE id = ? OR lower(name) = lower(?)",
+        (name, name),
+    ).fetchone()
+
+
+def switches_to_index(
+    db: sqlite3.Connection,
+    organization_id: str,
+    devices: List,
+    updated: set,
+    max_age: int,
+    full: bool = False,
+) -> Tuple[List, List[str]]:
+    """
+    Switches that are new, have configuration changes, or were indexed more
+    than max_age seconds ago, and serials of indexed switches that no longer
+    exist in the organization
+    """
+    indexed = {
+        row["serial"]: row["indexed_at"]
+        for row in db.execute(
+            "SELECT serial, indexed_at FROM switches WHERE organization_id = ?",
+            (organization_id,),
+        )
+    }
+    stale = time.time() - max_age
+
+    crawl = [
+        device
+        for device in devices
+        if full
+        or device["serial"] not in indexed
+        or device["serial"] in updated
+        or indexed[device["serial"]] < stale
+    ]
+    current = {device["serial"] for device in devices}
+    removed = [serial for serial in indexed if serial not in current]
+    return crawl, removed
+
+
+def remove_switches(db: sqlite3.Connection, serials: List[str]):
+    """
+    Remove switches and their ports from the index
+    """
+    with db:
+        for serial in serials:
+            for statement in DELETE_SWITCH_PORTS:
+                db.execute(statement, (serial,))
+            db.execute("DELETE FROM switches WHERE serial = ?", (serial,))
+
+
+def store_switch(
+    db: sqlite3.Connection,
+    organization_id: str,
+    device: Dict,
+    network_name: str,
+    ports: List,
+    statuses: List,
+    clients: List,
+):
+    """
+    Replace the indexed ports and clients of a switch
+    """
+    statuses = {status["portId"]: status for status in statuses}
+    with db:
+        for statement in DELETE_SWITCH_PORTS:
+            db.execute(statement, (device["serial"],))
+        db.execute(
+            "INSERT OR REPLACE INTO switches VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                device["serial"],
+                organization_id,
+                device.get("networkId"),
+                network_name,
+                device.get("name") or device["serial"],
+                device.get("model"),
+                time.time(),
+            ),
+        )
+
+        for port in ports:
+            status = statuses.get(port["portId"], {})
+            lldp = status.get("lldp") or {}
+            cdp = status.get("cdp") or {}
+            db.execute(
+                "INSERT INTO ports VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    device["serial"],
+                    port["portId"],
+                    port.get("name"),
+                    port.get("enabled"),
+                    port.get("type"),
+                    port.get("vlan"),
+                    port.get("voiceVlan"),
+                    port.get("allowedVlans"),
+                    status.get("status"),
+                    status.get("speed"),
+                    lldp.get("systemName"),
+                    cdp.get("deviceId"),
+                ),
+            )
+            db.executemany(
+                "INSERT INTO port_vlans VALUES (?, ?, ?, ?)",
+                [
+                    (device["serial"], port["portId"], start, end)
+                    for start, end in vlan_ranges(port)
+                ],
+            )
+            db.executemany(
+                "INSERT INTO port_tags VALUES (?, ?, ?)",
+                [
+                    (device["serial"], port["portId"], tag)
+                    for tag in port.get("tags") or []
+                ],
+            )
+
+        db.executemany(
+            "INSERT INTO clients VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    normalize_mac(client["mac"]),
+                    device["serial"],
+                    str(client["switchport"]),
+                    client.get("description") or client.get("dhcpHostname"),
+                    client.get("ip"),
+                    client.get("vlan"),
+                )
+                for client in clients
+                if client.get("mac") and client.get("switchport")
+            ],
+        )
+
+
+def mark_indexed(
+    db: sqlite3.Connection, organization: Dict, indexed_at: float, complete: bool
+):
+    """
+    Record when an organization was last indexed, and when every switch was
+    last indexed successfully
+    """
+    previous = indexed_organization(db, organization["id"])
+    complete_at = indexed_at if complete else previous and previous["complete_at"]
+    with db:
+        db.execute(
+            "INSERT OR REPLACE INTO organizations VALUES (?, ?, ?, ?)",
+            (organization["id"], organization["name"], indexed_at, complete_at),
+        )
+
+
+def find_switchports(
+    db: sqlite3.Connection,
+    organization_id: str,
+    vlan: Optional[int] = None,
+    tag: Optional[str] = None,
+    name: Optional[str] = None,
+    neighbor: Optional[str] = None,
+    mac: Optional[str] = None,
+) -> Iterator[sqlite3.Row]:
+    """
+    Find indexed switchports matching all of the given filters
+    """
+    clauses = []
+    params = []
+    if mac is not None:
+        mac = normalize_mac(mac)
+        if not mac:
+            raise ValueError("MAC address has no hexadecimal digits")
+        if len(mac) == 12:
+            clauses.append(FIND_MAC_EQUAL)
+            params.append(mac)
+        else:
+            clauses.append(FIND_MAC_PREFIX)
+            params.append(f"{mac}%")
+
+    clauses.append(FIND_ORGANIZATION)
+    params.append(organization_id)
+    if vlan is not None:
+        clauses.append(FIND_VLAN)
+        params += [vlan, vlan]
+    if tag:
+        clauses.append(FIND_TAG)
+        params.append(tag)
+    if name:
+        clauses.append(FIND_NAME)
+        params.append(f"%{name}%")
+    if neighbor:
+        clauses.append(FIND_NEIGHBOR)
+        params += [f"%{neighbor}%", f"%{neighbor}%"]
+
+    select = FIND_SELECT_CLIENTS if mac else FIND_SELECT
+    # Only the literal clauses above are joined; filter values are bound
+    query = select + "".join(clauses) + FIND_ORDER  # nosec B608
+    return db.execute(query, params)
@@ -168,3 +168,12 @@ class MTMetricType(str, Enum):
     indoorAirQuality = "indoorAirQuality"
     pm25 = "pm25"
     button = "button"
+
+
+class ExportFormat(str, Enum):
+    """
+    File formats for exported data
+    """
+
+    csv = "csv"
+    ndjson = "ndjson"
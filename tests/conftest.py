@@ -0,0 +1,5 @@
+import os
+
+# The Dashboard API client is created on import and requires a key, but
+# tests never reach the API
+os.environ.setdefault("MERAKI_DASHBOARD_API_KEY", "0" * 40)
@@ -0,0 +1,140 @@
+from types import SimpleNamespace
+
+import pytest
+from meraki.exceptions import APIError
+
+from merakitools import action_batches
+from merakitools.action_batches import load_journal, submit_action_batches
+
+
+def api_error(status, message="error"):
+    response = SimpleNamespace(
+        status_code=status, reason=message, json=lambda: {"errors": [message]}
+    )
+    return APIError({"tags": ["organizations"], "operation": "test"}, response)
+
+
+class FakeBatches:
+    """
+    Action batch endpoints that run each batch after one poll, failing
+    batches with any action marked to fail
+    """
+
+    def __init__(self):
+        self.created = []
+        self.batches = {}
+        self.create_errors = []
+        self.get_error = None
+
+    def getOrganizationActionBatches(self, organization_id, status=None):
+        return []
+
+    def createOrganizationActionBatch(self, organizationId, actions, confirmed):
+        if self.create_errors:
+            raise self.create_errors.pop(0)
+        batch_id = str(len(self.created))
+        self.created.append(actions)
+        failed = any(action["body"].get("fail") for action in actions)
+        self.batches[batch_id] = {
+            "id": batch_id,
+            "status": {
+                "completed": not failed,
+                "failed": failed,
+                "errors": ["bad action"] if failed else [],
+            },
+        }
+        return {
+            "id": batch_id,
+            "status": {"completed": False, "failed": False, "errors": []},
+        }
+
+    def getOrganizationActionBatch(self, organizationId, actionBatchId):
+        if self.get_error:
+            raise self.get_error
+        return self.batches[actionBatchId]
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    batches = FakeBatches()
+    monkeypatch.setattr(
+        action_batches, "dashboard", SimpleNamespace(organizations=batches)
+    )
+    monkeypatch.setattr(
+        action_batches, "paced", lambda func, *args, **kwargs: func(*args, **kwargs)
+    )
+    monkeypatch.setattr(action_batches.time, "sleep", lambda seconds: None)
+    return batches
+
+
+def actions(count, fail=()):
+    return [
+        {
+            "resource": f"/devices/Q{idx}/switch/ports/1",
+            "operation": "update",
+            "body": {"fail": True} if idx in fail else {"enabled": True},
+        }
+        for idx in range(count)
+    ]
+
+
+def test_actions_are_split_into_batches(fake):
+    results = submit_action_batches("1", actions(250))
+    assert [len(batch) for batch in fake.created] == [100, 100, 50]
+    assert results["completed"] == 250
+    assert results["failed"] == 0
+
+
+def test_failed_batches_are_split_to_isolate_failures(fake):
+    results = submit_action_batches("1", actions(8, fail={5}))
+    assert results["completed"] == 7
+    assert results["failed"] == 1
+    assert results["errors"][0]["action"]["resource"] == "/devices/Q5/switch/ports/1"
+    assert results["errors"][0]["errors"] == ["bad action"]
+
+
+def test_failed_batches_are_not_split_without_isolation(fake):
+    results = submit_action_batches("1", actions(8, fail={5}), isolate_failures=False)
+    assert len(fake.created) == 1
+    assert results["failed"] == 8
+
+
+def test_journal_skips_completed_actions(fake, tmp_path):
+    journal = tmp_path / "journal.ndjson"
+    submit_action_batches("1", actions(4, fail={3}), journal=journal)
+    assert len(load_journal(journal)) == 3
+
+    fake.created.clear()
+    results = submit_action_batches("1", actions(4), journal=journal)
+    assert results["skipped"] == 3
+    assert results["completed"] == 1
+    assert [len(batch) for batch in fake.created] == [1]
+
+
+def test_throttled_batches_are_retried(fake):
+    fake.create_errors = [api_error(429, "Too many concurrent batches")]
+    results = submit_action_batches("1", actions(3))
+    assert results["completed"] == 3
+    assert len(fake.created) == 1
+
+
+def test_unreadable_batches_are_failed_with_unknown_status(fake, tmp_path):
+    fake.get_error = api_error(404, "Not found")
+    journal = tmp_path / "journal.ndjson"
+    results = submit_action_batches("1", actions(4), journal=journal)
+    # A batch that may still be applied is neither split nor resubmitted
+    assert len(fake.created) == 1
+    assert results["failed"] == 4
+    assert results["errors"][0]["errors"] == ["status unknown"]
+    assert "status unknown" in journal.read_text()
+
+
+def test_batches_that_never_finish_are_failed(fake, monkeypatch):
+    monkeypatch.setattr(action_batches, "MAX_BATCH_SECONDS", 0)
+    fake.getOrganizationActionBatch = lambda organizationId, actionBatchId: {
+        "id": actionBatchId,
+        "status": {"completed": False, "failed": False, "errors": []},
+    }
+    results = submit_action_batches("1", actions(2))
+    assert results["failed"] == 2
+    assert results["errors"][0]["errors"] == ["status unknown"]
@@ -0,0 +1,188 @@
+import ipaddress
+
+import pytest
+from typer.testing import CliRunner
+
+from merakitools import orgs
+from merakitools.firewall import analyze_rules, compile_rules, evaluate_rules
+
+DEFAULT_RULE = {
+    "comment": "Default rule",
+    "policy": "allow",
+    "protocol": "Any",
+    "srcPort": "Any",
+    "srcCidr": "Any",
+    "destPort": "Any",
+    "destCidr": "Any",
+}
+
+
+def rule(policy, protocol="any", src="Any", dst="Any", dst_port="Any", **kwargs):
+    return {
+        "policy": policy,
+        "protocol": protocol,
+        "srcCidr": src,
+        "srcPort": "Any",
+        "destCidr": dst,
+        "destPort": dst_port,
+        **kwargs,
+    }
+
+
+def evaluate(rules, src, dst, protocol="tcp", port=None):
+    policy, matched = evaluate_rules(
+        compile_rules(rules),
+        ipaddress.ip_address(src),
+        ipaddress.ip_address(dst),
+        protocol,
+        port,
+    )
+    return policy, matched.position if matched else None
+
+
+def test_first_matching_rule_wins():
+    rules = [
+        rule("deny", "tcp", dst="10.0.0.0/8", dst_port="22"),
+        rule("allow", "tcp", dst="10.1.0.0/16"),
+        DEFAULT_RULE,
+    ]
+    assert evaluate(rules, "192.168.1.1", "10.1.1.1", port=22) == ("deny", 1)
+    assert evaluate(rules, "192.168.1.1", "10.1.1.1", port=443) == ("allow", 2)
+    assert evaluate(rules, "192.168.1.1", "10.1.1.1", "udp", 53) == ("allow", 3)
+
+
+def test_unmatched_traffic_is_allowed():
+    assert evaluate([rule("deny", dst="10.0.0.0/8")], "1.1.1.1", "8.8.8.8") == (
+        "allow",
+        None,
+    )
+
+
+def test_port_ranges_and_lists():
+    rules = [rule("deny", "tcp", dst_port="20-23,3389"), DEFAULT_RULE]
+    assert evaluate(rules, "1.1.1.1", "2.2.2.2", port=21)[0] == "deny"
+    assert evaluate(rules, "1.1.1.1", "2.2.2.2", port=3389)[0] == "deny"
+    assert evaluate(rules, "1.1.1.1", "2.2.2.2", port=24)[0] == "allow"
+
+
+def test_flow_without_port_is_unknown_for_port_rules():
+    rules = [rule("deny", "tcp", dst_port="22"), DEFAULT_RULE]
+    assert evaluate(rules, "1.1.1.1", "2.2.2.2") == ("unknown", 1)
+
+
+def test_vlan_rule_does_not_block_other_protocols():
+    rules = [rule("deny", "tcp", dst="VLAN(10).*"), DEFAULT_RULE]
+    assert evaluate(rules, "10.1.1.1", "8.8.8.8", "udp", 53) == ("allow", 2)
+    assert evaluate(rules, "10.1.1.1", "8.8.8.8", "tcp", 443) == ("unknown", 1)
+
+
+def test_vlan_rule_excluded_by_exact_field():
+    rules = [rule("deny", src="192.168.0.0/16", dst="VLAN(10).*"), DEFAULT_RULE]
+    assert evaluate(rules, "10.1.1.1", "8.8.8.8", "tcp", 443) == ("allow", 2)
+
+
+def test_local_lan_matches_private_ranges():
+    rules = [
+        rule("deny", dst="Local LAN", comment="Wireless clients accessing LAN"),
+        DEFAULT_RULE,
+    ]
+    assert evaluate(rules, "10.1.1.1", "8.8.8.8", "tcp", 443) == ("allow", 2)
+    assert evaluate(rules, "10.1.1.1", "172.16.5.5", "tcp", 443) == ("deny", 1)
+
+
+def test_local_lan_is_configurable():
+    compiled = compile_rules([rule("deny", dst="Local LAN")], ["100.64.0.0/10"])
+    assert compiled[0].exact
+    policy, _ = evaluate_rules(
+        compiled,
+        ipaddress.ip_address("10.1.1.1"),
+        ipaddress.ip_address("100.64.1.1"),
+        "tcp",
+        443,
+    )
+    assert policy == "deny"
+
+
+def test_ipv6_addresses_do_not_match_ipv4_rules():
+    rules = [rule("deny", dst="10.0.0.0/8"), DEFAULT_RULE]
+    assert evaluate(rules, "2001:db8::1", "2001:db8::2")[0] == "allow"
+
+
+def issues(rules):
+    return [
+        (matched.position, issue)
+        for matched, issue in analyze_rules(compile_rules(rules))
+    ]
+
+
+def test_shadowed_rule():
+    rules = [
+        rule("deny", dst="10.0.0.0/8"),
+        rule("allow", "tcp", dst="10.1.0.0/16", dst_port="443"),
+        DEFAULT_RULE,
+    ]
+    assert issues(rules) == [(2, "Shadowed by rule 1, never matches")]
+
+
+def test_redundant_with_earlier_rule():
+    rules = [
+        rule("deny", "tcp", dst="10.0.0.0/8"),
+        rule("deny", "tcp", dst="10.1.0.0/16", dst_port="22"),
+        DEFAULT_RULE,
+    ]
+    assert issues(rules) == [(2, "Redundant, always matched by rule 1")]
+
+
+def test_redundant_with_later_rule():
+    rules = [
+        rule("deny", "tcp", dst="10.1.0.0/16", dst_port="22"),
+        rule("deny", "tcp", dst="10.0.0.0/8"),
+        DEFAULT_RULE,
+    ]
+    assert issues(rules) == [(1, "Redundant, same effect as rule 2")]
+
+
+def test_later_rule_not_redundant_across_conflicting_rule():
+    rules = [
+        rule("deny", "tcp", dst="10.1.0.0/16", dst_port="22"),
+        rule("allow", "tcp", dst="10.1.1.0/24"),
+        rule("deny", "tcp", dst="10.0.0.0/8"),
+        DEFAULT_RULE,
+    ]
+    assert issues(rules) == []
+
+
+def test_overly_broad_allow_rule():
+    rules = [rule("allow", src="10.0.0.0/8"), rule("deny"), DEFAULT_RULE]
+    assert (1, "Overly broad allow rule") in issues(rules)
+
+
+def test_rules_with_unknown_fields_are_not_analyzed():
+    rules = [
+        rule("deny", dst="VLAN(10).*"),
+        rule("deny", dst="VLAN(10).*"),
+        DEFAULT_RULE,
+    ]
+    assert issues(rules) == []
+
+
+def test_check_firewall_reports_invalid_flows(tmp_path, monkeypatch):
+    flows = tmp_path / "flows.csv"
+    flows.write_text(
+        "src,dst,protocol,port\n"
+        "10.0.0.1,10.0.1.1,tcp,443\n"
+        "10.0.0.1,10.0.1.1,tcp,https\n"
+        "10.0.0.1,,tcp,80\n"
+        "10.0.0.300,10.0.1.1,udp,\n"
+    )
+    monkeypatch.setattr(
+        orgs, "find_org_by_name", lambda name: pytest.fail("flows are invalid")
+    )
+    result = CliRunner().invoke(
+        orgs.app, ["check-firewall", "Org", "--file", str(flows)]
+    )
+    assert result.exit_code == 1
+    assert "Line 3: Invalid port https" in result.output
+    assert "Line 4: src and dst are required" in result.output
+    assert "Line 5:" in result.output
+    assert "3 flows are invalid" in result.output
@@ -0,0 +1,148 @@
+import pytest
+from typer.testing import CliRunner
+
+from merakitools import mx
+from merakitools.mx import (
+    NatIndex,
+    _nat_rule,
+    _normalize_nat,
+    _parse_nat_port,
+    _plan_nat_import,
+)
+
+
+def nat(name, public_ip, lan_ip):
+    return _nat_rule(name, public_ip, lan_ip, "internet1", [])
+
+
+def test_lookup_by_public_ip():
+    web = nat("web", "203.0.113.10", "10.0.0.10")
+    index = NatIndex([web])
+    assert index.get("203.0.113.10") is web
+    assert index.get("203.0.113.11") is None
+
+
+def test_conflicts_on_any_key():
+    index = NatIndex([nat("web", "203.0.113.10", "10.0.0.10")])
+    assert index.conflicts(nat("mail", "203.0.113.11", "10.0.0.11")) == []
+    assert index.conflicts(nat("mail", "203.0.113.10", "10.0.0.10")) == [
+        "publicIp 203.0.113.10 is used by web",
+        "lanIp 10.0.0.10 is used by web",
+    ]
+    assert index.conflicts(nat("web", "203.0.113.12", "10.0.0.12")) == [
+        "name web is used by web"
+    ]
+
+
+def test_rule_being_replaced_is_ignored():
+    web = nat("web", "203.0.113.10", "10.0.0.10")
+    index = NatIndex([web])
+    updated = nat("web", "203.0.113.10", "10.0.0.20")
+    assert index.conflicts(updated, ignore=web) == []
+
+
+def test_rules_added_later_are_indexed():
+    index = NatIndex([])
+    index.add(nat("web", "203.0.113.10", "10.0.0.10"))
+    assert index.conflicts(nat("other", "203.0.113.10", "10.0.0.99"))
+
+
+def test_nat_rule_is_named_after_public_ip():
+    assert nat(None, "203.0.113.10", "10.0.0.10")["name"] == "203-0-113-10"
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ("web", "203.0.113.300", "10.0.0.10", "internet1"),
+        ("web", "203.0.113.10", "10.0.0", "internet1"),
+        ("web", "203.0.113.10", "10.0.0.10", "cellular"),
+    ],
+)
+def test_invalid_nat_rules(args):
+    with pytest.raises(ValueError):
+        _nat_rule(*args, [])
+
+
+def test_parse_nat_port():
+    assert _parse_nat_port("tcp!443") == {
+        "protocol": "tcp",
+        "destinationPorts": ["443"],
+        "allowedIps": ["any"],
+    }
+    assert _parse_nat_port("udp!500,4500!198.51.100.0/24")["allowedIps"] == [
+        "198.51.100.0/24"
+    ]
+    for port in ("tcp", "gre!1", "tcp!22!not-an-ip"):
+        with pytest.raises(ValueError):
+            _parse_nat_port(port)
+
+
+def test_normalized_rules_compare_equal():
+    first = nat("web", "203.0.113.10", "10.0.0.10")
+    first["allowedInbound"] = [
+        {"protocol": "tcp", "destinationPorts": [443], "allowedIps": ["b", "a"]}
+    ]
+    second = nat("web", "203.0.113.10", "10.0.0.10")
+    second["allowedInbound"] = [
+        {"protocol": "tcp", "destinationPorts": ["443"], "allowedIps": ["a", "b"]}
+    ]
+    assert _normalize_nat(first) == _normalize_nat(second)
+
+
+def test_import_changes_public_ip_of_rule_matched_by_name():
+    web = nat("web", "203.0.113.10", "10.0.0.10")
+    renumbered = nat("web", "198.51.100.10", "10.0.0.10")
+    for replace in (False, True):
+        added, updated, removed, replacements, conflicts = _plan_nat_import(
+            [web], [renumbered], replace
+        )
+        assert (added, updated, removed, conflicts) == ([], [renumbered], [], [])
+        assert replacements == {id(web): renumbered}
+
+
+def test_import_ignores_rules_being_removed():
+    old = nat("old", "203.0.113.10", "10.0.0.10")
+    new = nat("new", "198.51.100.10", "10.0.0.10")
+    added, _, removed, _, conflicts = _plan_nat_import([old], [new], True)
+    assert (added, removed, conflicts) == ([new], [old], [])
+
+    # Without --replace the existing rule is kept, so its LAN IP conflicts
+    _, _, _, _, conflicts = _plan_nat_import([old], [new], False)
+    assert conflicts == ["new (198.51.100.10): lanIp 10.0.0.10 is used by old"]
+
+
+def test_import_conflicts_between_imported_rules():
+    first = nat("web", "198.51.100.10", "10.0.0.10")
+    second = nat("mail", "198.51.100.11", "10.0.0.10")
+    added, _, _, _, conflicts = _plan_nat_import([], [first, second], False)
+    assert added == [first]
+    assert conflicts == ["mail (198.51.100.11): lanIp 10.0.0.10 is used by web"]
+
+
+def test_import_nat_replaces_renumbered_rule(tmp_path, monkeypatch):
+    rules = [nat("web", "203.0.113.10", "10.0.0.10")]
+    applied = []
+    monkeypatch.setattr(
+        mx, "find_network_by_name", lambda *args: {"id": "N_1", "name": "Net"}
+    )
+    monkeypatch.setattr(
+        mx.dashboard.appliance,
+        "getNetworkApplianceFirewallOneToOneNatRules",
+        lambda *args: {"rules": rules},
+    )
+    monkeypatch.setattr(
+        mx.dashboard.appliance,
+        "updateNetworkApplianceFirewallOneToOneNatRules",
+        lambda net_id, new_rules: applied.append(new_rules),
+    )
+    file = tmp_path / "nat.csv"
+    file.write_text("name,publicIp,lanIp\nweb,198.51.100.10,10.0.0.10\n")
+
+    result = CliRunner().invoke(
+        mx.app, ["import-nat", "Org", "Net", str(file), "--replace", "--no-confirm"]
+    )
+    assert result.exit_code == 0, result.output
+    assert [(rule["name"], rule["publicIp"]) for rule in applied[0]] == [
+        ("web", "198.51.100.10")
+    ]
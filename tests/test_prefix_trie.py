@@ -0,0 +1,74 @@
+import ipaddress
+
+from merakitools.prefix_trie import PrefixTrie
+
+
+def trie(*prefixes):
+    prefix_trie = PrefixTrie()
+    for prefix in prefixes:
+        prefix_trie.insert(prefix, prefix)
+    return prefix_trie
+
+
+def test_longest_prefix_match():
+    prefixes = trie("0.0.0.0/0", "10.0.0.0/8", "10.1.0.0/16", "10.1.1.0/24")
+    assert prefixes.lookup(ipaddress.ip_address("10.1.1.1"))[1] == "10.1.1.0/24"
+    assert prefixes.lookup(ipaddress.ip_address("10.1.2.1"))[1] == "10.1.0.0/16"
+    assert prefixes.lookup(ipaddress.ip_address("8.8.8.8"))[1] == "0.0.0.0/0"
+
+
+def test_covering_is_least_specific_first():
+    prefixes = trie("10.1.0.0/16", "10.0.0.0/8", "192.168.0.0/16")
+    assert [value for _, value in prefixes.covering("10.1.1.0/24")] == [
+        "10.0.0.0/8",
+        "10.1.0.0/16",
+    ]
+
+
+def test_no_match():
+    assert trie("10.0.0.0/8").lookup(ipaddress.ip_address("192.168.1.1")) is None
+
+
+def test_ipv4_and_ipv6_are_separate():
+    prefixes = trie("::/0", "2001:db8::/32", "10.0.0.0/8")
+    assert prefixes.lookup(ipaddress.ip_address("2001:db8::1"))[1] == "2001:db8::/32"
+    assert prefixes.lookup(ipaddress.ip_address("11.0.0.1")) is None
+    assert len(prefixes) == 3
+
+
+def test_overlaps():
+    prefixes = trie("10.0.0.0/8", "10.1.0.0/16", "10.1.0.0/16", "192.168.0.0/16")
+    pairs = sorted((outer[1], inner[1]) for outer, inner in prefixes.overlaps())
+    assert pairs == [
+        ("10.0.0.0/8", "10.1.0.0/16"),
+        ("10.0.0.0/8", "10.1.0.0/16"),
+        ("10.1.0.0/16", "10.1.0.0/16"),
+    ]
+
+
+def test_iteration_includes_every_value():
+    prefixes = trie("10.0.0.0/8", "10.0.0.0/8", "fd00::/8")
+    assert sorted(value for _, value in prefixes) == [
+        "10.0.0.0/8",
+        "10.0.0.0/8",
+        "fd00::/8",
+    ]
+
+
+def test_overlap_groups():
+    prefixes = trie(
+        "10.1.1.0/24",
+        "10.0.0.0/8",
+        "10.1.1.0/24",
+        "192.168.0.0/16",
+        "192.168.1.0/24",
+        "172.16.0.0/24",
+    )
+    groups = sorted(
+        [str(network) for network, _ in group] for group in prefixes.overlap_groups()
+    )
+    assert groups == [
+        ["10.0.0.0/8", "10.1.1.0/24", "10.1.1.0/24"],
+        ["172.16.0.0/24"],
+        ["192.168.0.0/16", "192.168.1.0/24"],
+    ]
@@ -0,0 +1,87 @@
+import sqlite3
+
+import pytest
+
+from merakitools.sensor_store import (
+    SCHEMA,
+    aggregate_readings,
+    mark_synced,
+    store_readings,
+    sync_marks,
+    timestamp,
+)
+
+
+@pytest.fixture
+def db():
+    connection = sqlite3.connect(":memory:")
+    connection.row_factory = sqlite3.Row
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def reading(metric, ts, values, serial="Q2XX-0000-0001"):
+    return {
+        "serial": serial,
+        "metric": metric,
+        "ts": ts,
+        "network": {"id": "N_1", "name": "Net"},
+        metric: values,
+    }
+
+
+def test_readings_are_stored_once(db):
+    readings = [
+        reading("temperature", "2026-01-01T00:00:00Z", {"celsius": 20.0}),
+        reading("temperature", "2026-01-01T00:10:00Z", {"celsius": 22.0}),
+    ]
+    assert store_readings(db, "1", readings) == 2
+    assert store_readings(db, "1", readings) == 0
+
+
+def test_non_numeric_values_are_stored_without_value(db):
+    store_readings(
+        db,
+        "1",
+        [
+            reading("door", "2026-01-01T00:00:00Z", {"open": True}),
+            reading("button", "2026-01-01T00:00:00Z", {"pressType": "short"}),
+        ],
+    )
+    rows = {
+        row["metric"]: row["value"]
+        for row in db.execute("SELECT metric, value FROM readings")
+    }
+    assert rows == {"door": 1, "button": None}
+
+
+def test_sync_marks_per_sensor_and_metric(db):
+    mark_synced(db, "1", [("Q1", "temperature"), ("Q1", "humidity")], 100.0)
+    mark_synced(db, "1", [("Q1", "temperature")], 200.0)
+    mark_synced(db, "2", [("Q2", "")], 300.0)
+    assert sync_marks(db, "1") == {
+        ("Q1", "temperature"): 200.0,
+        ("Q1", "humidity"): 100.0,
+    }
+    assert sync_marks(db, "2") == {("Q2", ""): 300.0}
+
+
+def test_aggregate_readings(db):
+    store_readings(
+        db,
+        "1",
+        [
+            reading("temperature", "2026-01-01T00:00:00Z", {"celsius": 20.0}),
+            reading("temperature", "2026-01-01T00:30:00Z", {"celsius": 24.0}),
+            reading("temperature", "2026-01-01T01:00:00Z", {"celsius": 30.0}),
+            reading("humidity", "2026-01-01T00:00:00Z", {"relativePercentage": 40}),
+        ],
+    )
+    start = timestamp("2026-01-01T00:00:00Z")
+    rows = aggregate_readings(
+        db, "1", start, start + 7200, 3600, metrics=["temperature"]
+    )
+    assert [
+        (row["period"], row["minimum"], row["maximum"], row["mean"], row["readings"])
+        for row in rows
+    ] == [(start, 20.0, 24.0, 22.0, 2), (start + 3600, 30.0, 30.0, 30.0, 1)]
@@ -0,0 +1,129 @@
+import sqlite3
+
+import pytest
+
+from merakitools.switchport_index import (
+    SCHEMA,
+    find_switchports,
+    normalize_mac,
+    store_switch,
+    switches_to_index,
+    vlan_ranges,
+)
+
+
+@pytest.fixture
+def db():
+    connection = sqlite3.connect(":memory:")
+    connection.row_factory = sqlite3.Row
+    connection.executescript(SCHEMA)
+    store_switch(
+        connection,
+        "1",
+        {"serial": "Q1", "networkId": "N1", "name": "idf-1", "model": "MS225"},
+        "Branch",
+        [
+            {"portId": "1", "name": "Printer", "type": "access", "vlan": 10},
+            {
+                "portId": "2",
+                "name": "Phone",
+                "type": "access",
+                "vlan": 10,
+                "voiceVlan": 20,
+                "tags": ["voice"],
+            },
+            {
+                "portId": "48",
+                "name": "Uplink",
+                "type": "trunk",
+                "vlan": 1,
+                "allowedVlans": "1,100-200",
+            },
+        ],
+        [{"portId": "48", "status": "Connected", "lldp": {"systemName": "core-sw"}}],
+        [{"mac": "AA:BB:CC:00:11:22", "switchport": "1", "ip": "10.0.10.5"}],
+    )
+    return connection
+
+
+def test_vlan_ranges():
+    assert vlan_ranges({"type": "access", "vlan": 10, "voiceVlan": 20}) == [
+        (10, 10),
+        (20, 20),
+    ]
+    assert vlan_ranges({"type": "trunk", "vlan": 1, "allowedVlans": "1,5-7"}) == [
+        (1, 1),
+        (1, 1),
+        (5, 7),
+    ]
+    assert vlan_ranges({"type": "trunk", "vlan": 1, "allowedVlans": "all"}) == [
+        (1, 4094)
+    ]
+
+
+def test_normalize_mac():
+    assert normalize_mac("AA:BB:CC-00.11.22") == "aabbcc001122"
+
+
+def port_ids(rows):
+    return [row["port_id"] for row in rows]
+
+
+def test_find_by_vlan(db):
+    assert port_ids(find_switchports(db, "1", vlan=10)) == ["1", "2"]
+    assert port_ids(find_switchports(db, "1", vlan=20)) == ["2"]
+    assert port_ids(find_switchports(db, "1", vlan=150)) == ["48"]
+    assert port_ids(find_switchports(db, "1", vlan=300)) == []
+
+
+def test_find_by_tag_name_and_neighbor(db):
+    assert port_ids(find_switchports(db, "1", tag="voice")) == ["2"]
+    assert port_ids(find_switchports(db, "1", name="print")) == ["1"]
+    assert port_ids(find_switchports(db, "1", neighbor="core")) == ["48"]
+
+
+def test_find_by_full_or_partial_mac(db):
+    rows = list(find_switchports(db, "1", mac="aa-bb-cc-00-11-22"))
+    assert port_ids(rows) == ["1"]
+    assert rows[0]["ip"] == "10.0.10.5"
+    assert port_ids(find_switchports(db, "1", mac="aabbcc")) == ["1"]
+
+
+@pytest.mark.parametrize("mac", ["", "zz", ":"])
+def test_mac_without_hex_digits_is_rejected(db, mac):
+    with pytest.raises(ValueError):
+        find_switchports(db, "1", mac=mac)
+
+
+def test_filters_are_combined(db):
+    assert port_ids(find_switchports(db, "1", vlan=10, tag="voice")) == ["2"]
+    assert port_ids(find_switchports(db, "2", vlan=10)) == []
+
+
+def test_store_switch_replaces_ports(db):
+    store_switch(
+        db,
+        "1",
+        {"serial": "Q1", "networkId": "N1", "name": "idf-1", "model": "MS225"},
+        "Branch",
+        [{"portId": "1", "name": "Camera", "type": "access", "vlan": 30}],
+        [],
+        [],
+    )
+    assert port_ids(find_switchports(db, "1", vlan=10)) == []
+    assert port_ids(find_switchports(db, "1", tag="voice")) == []
+    assert port_ids(find_switchports(db, "1", vlan=30)) == ["1"]
+
+
+def test_switches_to_index(db):
+    devices = [{"serial": "Q1"}, {"serial": "Q2"}]
+    crawl, removed = switches_to_index(db, "1", devices, set(), max_age=3600)
+    assert [device["serial"] for device in crawl] == ["Q2"]
+    assert removed == []
+
+    crawl, removed = switches_to_index(db, "1", devices[1:], {"Q2"}, max_age=3600)
+    assert [device["serial"] for device in crawl] == ["Q2"]
+    assert removed == ["Q1"]
+
+    crawl, _ = switches_to_index(db, "1", devices, set(), max_age=3600, full=True)
+    assert len(crawl) == 2
@@ -0,0 +1,86 @@
+import pytest
+import typer
+
+from merakitools.mt import ThresholdRule, _watch_events
+
+
+def reading(metric, values, serial="Q2XX-0000-0001", ts="2026-01-01T00:00:00Z"):
+    return {
+        "organization": "Org",
+        "serial": serial,
+        "network": {"id": "N_1", "name": "Net"},
+        "metric": metric,
+        "ts": ts,
+        metric: values,
+    }
+
+
+def test_rule_parsing():
+    rule = ThresholdRule(" temperature.celsius >= 25.5 ")
+    assert (rule.metric, rule.unit, rule.value) == ("temperature", "celsius", 25.5)
+    assert rule.text == "temperature.celsius >= 25.5"
+    assert ThresholdRule("door.open==true").value is True
+
+
+@pytest.mark.parametrize("text", ["nosuchmetric>1", "temperature~1", "humidity>high"])
+def test_invalid_rules(text):
+    with pytest.raises(typer.Abort):
+        ThresholdRule(text)
+
+
+def test_rule_compares_unit_or_first_value():
+    values = {"fahrenheit": 80.0, "celsius": 26.7}
+    assert ThresholdRule("temperature.celsius>25").exceeded(
+        reading("temperature", values)
+    )
+    # The first value of the metric is used without a unit
+    assert not ThresholdRule("temperature>85").exceeded(reading("temperature", values))
+
+
+def test_rule_without_comparable_value():
+    rule = ThresholdRule("temperature.celsius>25")
+    assert rule.exceeded(reading("temperature", {"fahrenheit": 80.0})) is None
+    assert (
+        ThresholdRule("door.open==true").exceeded(reading("door", {"open": 1})) is None
+    )
+
+
+def test_reading_events_only_on_change():
+    previous = {}
+    first = reading("humidity", {"relativePercentage": 40})
+    events = list(_watch_events([first], {}, previous, set()))
+    assert [event["event"] for event in events] == ["reading"]
+    assert events[0]["previous"] is None
+
+    assert list(_watch_events([first], {}, previous, set())) == []
+
+    changed = reading("humidity", {"relativePercentage": 45})
+    events = list(_watch_events([changed], {}, previous, set()))
+    assert events[0]["previous"] == {"relativePercentage": 40}
+
+
+def test_threshold_events_on_transitions():
+    rule = ThresholdRule("temperature.celsius>25")
+    rules = {"temperature": [rule]}
+    previous, exceeded = {}, set()
+
+    def thresholds(celsius):
+        readings = [reading("temperature", {"celsius": celsius})]
+        return [
+            event["state"]
+            for event in _watch_events(readings, rules, previous, exceeded)
+            if event["event"] == "threshold"
+        ]
+
+    assert thresholds(20) == []
+    assert thresholds(30) == ["exceeded"]
+    assert thresholds(31) == []
+    assert thresholds(20) == ["cleared"]
+    assert exceeded == set()
+
+
+def test_rules_only_apply_to_their_metric():
+    rules = {"temperature": [ThresholdRule("temperature>0")]}
+    readings = [reading("humidity", {"relativePercentage": 40})]
+    events = list(_watch_events(readings, rules, {}, set()))
+    assert [event["event"] for event in events] == ["reading"]